@@ -1,14 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from jose import jwt, JWTError
+from sqlalchemy.exc import IntegrityError
 
-from app.core.database import get_db
+from app.core import rank_service
+from app.core.database import AsyncSessionLocal, get_db
 from app.core.security import hash_password, verify_password, create_access_token
-from app.core.config import access_token_expires, SECRET_KEY, ALGORITHM
+from app.core.config import access_token_expires
+from app.core.cache import bump_generation
+from app.core.game_catalog import get_game, invalidate_game
+from app.core.log import get_logger
+from app.api.games import GAMES_CACHE_NAMESPACE
 from app.schemas.auth import RegisterRequest, LoginRequest, TokenResponse, UserPublic
 from app.models.models import User, UserGameRating, Game
 
+log = get_logger("auth")
+
 router = APIRouter(prefix="/api/auth", tags=["Auth"])
 
 
@@ -18,16 +25,9 @@ async def ensure_user_caro_rating(db: AsyncSession, user_id: int) -> int:
     Tự động tạo nếu chưa có.
     Returns: rating hiện tại (default 1200).
     """
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
-        # Tạo game Caro nếu chưa có
-        game = Game(
-            name="Caro",
-            description="Classic Tic-Tac-Toe game with 5 in a row to win",
-            thumbnail_url=None
-        )
-        db.add(game)
-        await db.flush()
+        game = await _create_caro_game(db)
     
     # Tìm rating hiện có
     rating_obj = await db.scalar(
@@ -48,12 +48,33 @@ async def ensure_user_caro_rating(db: AsyncSession, user_id: int) -> int:
         )
         db.add(rating_obj)
         await db.flush()
-        print(f"✅ Created initial rating 1200 for user {user_id}")
+        rank_service.sync_after_commit(db, game.id, {user_id: 1200})  # vào ZSET rank khi commit
+        log.info("initial_rating_created", user_id=user_id, rating=1200)
         return 1200
     
     return rating_obj.rating
 
 
+async def _create_caro_game(db: AsyncSession):
+    """
+    Tạo game Caro trong transaction riêng và commit ngay, xong mới xóa cache
+    (get_game + danh sách /api/games) -> không worker nào cache trạng thái trước commit.
+    """
+    async with AsyncSessionLocal() as session:
+        session.add(Game(
+            name="Caro",
+            description="Classic Tic-Tac-Toe game with 5 in a row to win",
+            thumbnail_url=None
+        ))
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()  # request khác vừa tạo xong
+    await invalidate_game("Caro")
+    await bump_generation(GAMES_CACHE_NAMESPACE)
+    return await get_game(db, "Caro")
+
+
 async def user_to_public(user: User, db: AsyncSession) -> UserPublic:
     """Convert User model to UserPublic schema with rating."""
     rating = await ensure_user_caro_rating(db, user.id)
@@ -97,7 +118,7 @@ async def register(payload: RegisterRequest, db: AsyncSession = Depends(get_db))
     user = User(
         username=payload.username,
         email=payload.email,
-        hashed_password=hash_password(payload.password) if payload.provider == "local" else None,
+        hashed_password=await hash_password(payload.password) if payload.provider == "local" else None,
         avatar_url=str(payload.avatar_url) if payload.avatar_url else None,
         bio=payload.bio,
         provider=payload.provider,
@@ -129,7 +150,7 @@ async def register(payload: RegisterRequest, db: AsyncSession = Depends(get_db))
 @router.post("/login", response_model=TokenResponse)
 async def login(payload: LoginRequest, db: AsyncSession = Depends(get_db)):
     user = await get_user_by_email(db, payload.email)
-    if not user or not verify_password(payload.password, user.hashed_password):
+    if not user or not await verify_password(payload.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     expires = access_token_expires()
@@ -144,30 +165,9 @@ async def login(payload: LoginRequest, db: AsyncSession = Depends(get_db)):
         user=user_public,
     )
 
-# OAuth2-style Bearer token dependency
-from fastapi.security import OAuth2PasswordBearer
-from fastapi import Request
-
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")  # FE dùng JSON; tokenUrl chỉ để docs
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str | None = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    user = await get_user_by_id(db, int(user_id))
-    if user is None:
-        raise credentials_exception
-    return user
+# Bearer token dependency: dùng chung bản có cache trong app.core.security
+# (giữ tên ở đây cho các module import từ app.api.auth)
+from app.core.security import get_current_user  # noqa: E402
 
 @router.get("/me", response_model=UserPublic)
 async def me(
@@ -175,7 +175,6 @@ async def me(
     db: AsyncSession = Depends(get_db)
 ):
     """Get current user profile with Caro rating."""
-    print(f"📍 GET /api/auth/me called for user {current_user.id} ({current_user.username})")
     result = await user_to_public(current_user, db)
-    print(f"📤 Returning user data with rating: {result.rating}")
+    log.debug("profile_served", user_id=current_user.id, rating=result.rating)
     return result
@@ -4,6 +4,7 @@ from sqlalchemy import select
 
 from app.core.database import get_db
 from app.core.security import create_access_token
+from app.core import auth_cache
 from app.core.config import access_token_expires
 from app.models.models import User
 from app.schemas.auth import TokenResponse, UserPublic, LoginGoogleRequest
@@ -53,6 +54,7 @@ async def google_login(payload: LoginGoogleRequest, db: AsyncSession = Depends(g
         
         await db.commit()
         await db.refresh(user)
+        await auth_cache.invalidate_user(user.id)  # provider / avatar có thể vừa đổi
 
     # Tạo JWT
     expires = access_token_expires()
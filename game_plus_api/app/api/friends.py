@@ -4,9 +4,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, or_, and_, func
 from app.core.database import get_db
 from app.core.security import get_current_user
+from app.core.game_catalog import get_game
+from app.core.log import get_logger
 from app.models.models import (
     User, Friend, FriendRequest, FriendRequestStatus, 
-    UserGameRating, Game, Challenge, ChallengeStatus,
+    UserGameRating, Challenge, ChallengeStatus,
     Match, MatchStatus, MatchPlayer
 )
 from app.schemas.friend import (
@@ -17,6 +19,8 @@ from app.schemas.friend import (
 from typing import List
 from datetime import datetime, timezone, timedelta
 
+log = get_logger("friends")
+
 router = APIRouter(prefix="/api/friends", tags=["friends"])
 
 # ==== Helper Functions ====
@@ -27,7 +31,7 @@ def normalize_friendship(user1_id: int, user2_id: int):
 
 async def get_user_rating(db: AsyncSession, user_id: int) -> int:
     """Lấy rating Caro của user."""
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
         return 1200
     
@@ -379,31 +383,27 @@ async def remove_friend(
     db: AsyncSession = Depends(get_db)
 ):
     """Hủy kết bạn."""
-    # Add logging for debugging
-    print(f"DEBUG: User {current_user.id} ({current_user.username}) trying to unfriend user {friend_id}")
-    
     if friend_id == current_user.id:
-        print(f"ERROR: User {current_user.id} trying to unfriend themselves")
+        log.debug("unfriend_rejected", user_id=current_user.id, friend_id=friend_id, reason="self")
         raise HTTPException(400, f"Cannot unfriend yourself (your user_id: {current_user.id}, friend_id requested: {friend_id}). Make sure you're passing the friend's user ID, not the friendship ID.")
     
     # Verify the friend exists
     friend_user = await db.scalar(select(User).where(User.id == friend_id))
     if not friend_user:
-        print(f"ERROR: User {friend_id} does not exist")
+        log.debug("unfriend_rejected", user_id=current_user.id, friend_id=friend_id, reason="user_not_found")
         raise HTTPException(404, f"User with ID {friend_id} not found")
     
     # Tìm friendship
     u1, u2 = normalize_friendship(current_user.id, friend_id)
-    print(f"DEBUG: Looking for friendship between {u1} and {u2}")
     friendship = await db.scalar(
         select(Friend).where(Friend.user1_id == u1, Friend.user2_id == u2)
     )
     
     if not friendship:
-        print(f"ERROR: No friendship found between users {current_user.id} and {friend_id}")
+        log.debug("unfriend_rejected", user_id=current_user.id, friend_id=friend_id, reason="not_friends")
         raise HTTPException(404, f"Friendship not found between {current_user.username} (ID: {current_user.id}) and {friend_user.username} (ID: {friend_id}). Make sure you are friends with this user.")
     
-    print(f"SUCCESS: Deleting friendship {friendship.id} between users {u1} and {u2}")
+    log.debug("friendship_deleted", friendship_id=friendship.id, user1_id=u1, user2_id=u2)
     await db.delete(friendship)
     await db.commit()
     
@@ -416,17 +416,15 @@ async def remove_friend_by_friendship_id(
     db: AsyncSession = Depends(get_db)
 ):
     """Hủy kết bạn bằng friendship ID (alternative endpoint)."""
-    print(f"DEBUG: User {current_user.id} ({current_user.username}) trying to remove friendship {friendship_id}")
-    
     # Tìm friendship
     friendship = await db.scalar(select(Friend).where(Friend.id == friendship_id))
     if not friendship:
-        print(f"ERROR: Friendship {friendship_id} not found")
+        log.debug("unfriend_rejected", user_id=current_user.id, friendship_id=friendship_id, reason="not_found")
         raise HTTPException(404, f"Friendship with ID {friendship_id} not found")
     
     # Kiểm tra user có quyền xóa friendship này không
     if current_user.id != friendship.user1_id and current_user.id != friendship.user2_id:
-        print(f"ERROR: User {current_user.id} not authorized to delete friendship {friendship_id}")
+        log.debug("unfriend_rejected", user_id=current_user.id, friendship_id=friendship_id, reason="forbidden")
         raise HTTPException(403, f"You are not authorized to remove this friendship")
     
     # Get friend info for response BEFORE deleting friendship
@@ -436,7 +434,8 @@ async def remove_friend_by_friendship_id(
     # Store friend info early to avoid detached instance issues
     friend_username = friend_user.username if friend_user else "Unknown User"
     
-    print(f"SUCCESS: Deleting friendship {friendship.id} between users {friendship.user1_id} and {friendship.user2_id}")
+    log.debug("friendship_deleted", friendship_id=friendship.id,
+              user1_id=friendship.user1_id, user2_id=friendship.user2_id)
     await db.delete(friendship)
     await db.commit()
     
@@ -516,7 +515,7 @@ async def send_challenge(
         raise HTTPException(400, "Already has a pending challenge with this user")
     
     # Lấy game Caro
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
         raise HTTPException(500, "Caro game not found")
     
@@ -1,14 +1,20 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from app.core.cache import read_through
 from app.core.database import get_db
 from app.models.models import Game
 from app.schemas.game import GamePublic
 
 router = APIRouter(prefix="/api/games", tags=["Games"])
 
+GAMES_CACHE_NAMESPACE = "games"
+GAMES_CACHE_TTL = 300  # games gần như không đổi; tạo game mới -> bump_generation
+
 @router.get("/", response_model=list[GamePublic])
 async def list_games(db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(Game))
-    games = res.scalars().all()
-    return games
+    async def load():
+        res = await db.execute(select(Game.id, Game.name, Game.description, Game.thumbnail_url))
+        return [dict(row) for row in res.mappings()]
+
+    return await read_through(GAMES_CACHE_NAMESPACE, None, load, ttl=GAMES_CACHE_TTL)
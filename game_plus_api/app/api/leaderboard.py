@@ -2,109 +2,67 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, or_, and_, case, desc
+from sqlalchemy.orm import aliased
 from app.core.database import get_db
 from app.core.security import get_current_user
+from app.core import rank_service, user_stats
+from app.core.cache import read_through
+from app.core.game_catalog import get_game
 from app.models.models import (
-    User, Game, UserGameRating, MatchPlayer, Match, MatchStatus,
+    User, UserGameRating, MatchPlayer, Match, MatchStatus,
     Friend, FriendRequest, FriendRequestStatus
 )
 from app.schemas.leaderboard import LeaderboardEntry, UserProfileDetail
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime, timezone
+import os
 
 router = APIRouter(prefix="/api/leaderboard", tags=["leaderboard"])
 
+LEADERBOARD_CACHE_NAMESPACE = "leaderboard"
+LEADERBOARD_CACHE_TTL = int(os.getenv("LEADERBOARD_CACHE_TTL", "10"))  # giây; rating mới hiện sau tối đa TTL
+
 # ==== Helper Functions ====
 
-async def get_user_stats(db: AsyncSession, user_id: int, game_id: int) -> dict:
-    """Lấy thống kê wins/losses/draws của user."""
-    # Đếm số trận thắng
-    wins = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == user_id,
-            Match.game_id == game_id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == True
-        )
-    ) or 0
-    
-    # Đếm số trận thua
-    losses = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == user_id,
-            Match.game_id == game_id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == False
-        )
-    ) or 0
-    
-    # Đếm số trận hòa (is_winner = None nhưng match finished)
-    draws = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
+def friendship_flags(viewer_id: int, target_id):
+    """
+    2 cột EXISTS (is_friend, has_pending_request) giữa viewer và target_id.
+    Dùng trực tiếp trong SELECT của leaderboard để không phải query riêng cho từng dòng.
+    """
+    is_friend = (
+        select(Friend.id)
         .where(
-            MatchPlayer.user_id == user_id,
-            Match.game_id == game_id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == None
+            or_(
+                and_(Friend.user1_id == viewer_id, Friend.user2_id == target_id),
+                and_(Friend.user1_id == target_id, Friend.user2_id == viewer_id),
+            )
         )
-    ) or 0
-    
-    total_games = wins + losses + draws
-    win_rate = (wins / total_games * 100) if total_games > 0 else 0.0
-    
-    return {
-        "wins": wins,
-        "losses": losses,
-        "draws": draws,
-        "total_games": total_games,
-        "win_rate": round(win_rate, 2)
-    }
-
-async def check_friendship(db: AsyncSession, user1_id: int, user2_id: int) -> bool:
-    """Kiểm tra 2 người đã là bạn chưa."""
-    u1, u2 = (min(user1_id, user2_id), max(user1_id, user2_id))
-    friend = await db.scalar(
-        select(Friend).where(Friend.user1_id == u1, Friend.user2_id == u2)
+        .exists()
     )
-    return friend is not None
-
-async def check_pending_request(db: AsyncSession, user1_id: int, user2_id: int) -> bool:
-    """Kiểm tra có lời mời đang pending không."""
-    req = await db.scalar(
-        select(FriendRequest).where(
+    has_pending = (
+        select(FriendRequest.id)
+        .where(
             or_(
-                and_(FriendRequest.sender_id == user1_id, FriendRequest.receiver_id == user2_id),
-                and_(FriendRequest.sender_id == user2_id, FriendRequest.receiver_id == user1_id)
+                and_(FriendRequest.sender_id == viewer_id, FriendRequest.receiver_id == target_id),
+                and_(FriendRequest.sender_id == target_id, FriendRequest.receiver_id == viewer_id)
             ),
             FriendRequest.status == FriendRequestStatus.pending
         )
+        .exists()
     )
-    return req is not None
+    return is_friend.label("is_friend"), has_pending.label("has_pending_request")
 
-async def get_user_rank(db: AsyncSession, user_id: int, game_id: int) -> int:
-    """Tính rank của user dựa trên rating."""
-    # Đếm số người có rating cao hơn
-    higher_count = await db.scalar(
-        select(func.count())
-        .select_from(UserGameRating)
-        .where(
-            UserGameRating.game_id == game_id,
-            UserGameRating.rating > (
-                select(UserGameRating.rating)
-                .where(UserGameRating.user_id == user_id, UserGameRating.game_id == game_id)
-            )
-        )
-    ) or 0
-    
-    return higher_count + 1
+async def get_friendship_status(db: AsyncSession, viewer_id: int, user_id: int) -> Tuple[bool, bool]:
+    """Returns: (is_friend, has_pending_request) giữa 2 người trong 1 query."""
+    if viewer_id == user_id:
+        return False, False
+    is_friend, has_pending = friendship_flags(viewer_id, user_id)
+    row = (await db.execute(select(is_friend, has_pending))).one()
+    return bool(row[0]), bool(row[1])
+
+async def get_user_rank(db: AsyncSession, user_id: int, game_id: int, rating: Optional[int] = None) -> Optional[int]:
+    """Rank của user dựa trên rating (Redis ZSET, fallback DB)."""
+    return await rank_service.get_rank(db, user_id, game_id, rating)
 
 # ==== API Endpoints ====
 
@@ -126,62 +84,87 @@ async def get_leaderboard(
     - Hiển thị trạng thái kết bạn nếu user đã đăng nhập
     """
     # Tìm game
-    game = await db.scalar(select(Game).where(Game.name == game_name))
+    game = await get_game(db, game_name)
     if not game:
         raise HTTPException(404, f"Game '{game_name}' not found")
     
-    # Build query
-    query = (
-        select(UserGameRating, User)
-        .join(User, User.id == UserGameRating.user_id)
-        .where(UserGameRating.game_id == game.id)
-    )
-    
-    # Tìm kiếm theo username
-    if search:
-        query = query.where(User.username.ilike(f"%{search}%"))
-    
-    # Sắp xếp theo rating
-    query = query.order_by(desc(UserGameRating.rating))
-    
-    # Phân trang
-    query = query.offset(offset).limit(limit)
-    
-    # Execute
-    results = await db.execute(query)
-    results = results.all()
-    
-    # Build response
-    leaderboard = []
-    for idx, (rating_obj, user) in enumerate(results):
-        # Tính rank thực tế (không phải index trong page)
-        rank = offset + idx + 1
+    viewer_id = current_user.id if current_user else None
+    game_id = game.id
+
+    async def load_page() -> List[dict]:
+        # 1 query cho cả page: user + dòng stats/rating + rank (không phụ thuộc người xem)
+        columns = [
+            User.id, User.username, User.avatar_url, UserGameRating,
+        ]
+        if search:
+            # Khi tìm kiếm, vị trí trong page không phải rank thật -> đếm số người rating cao hơn
+            higher = aliased(UserGameRating)
+            columns.append(
+                (
+                    select(func.count())
+                    .select_from(higher)
+                    .where(higher.game_id == game_id, higher.rating > UserGameRating.rating)
+                    .scalar_subquery() + 1
+                ).label("rank")
+            )
+
+        query = (
+            select(*columns)
+            .join(User, User.id == UserGameRating.user_id)
+            .where(UserGameRating.game_id == game_id)
+        )
+        
+        # Tìm kiếm theo username
+        if search:
+            query = query.where(User.username.ilike(f"%{search}%"))
         
-        # Lấy stats
-        stats = await get_user_stats(db, user.id, game.id)
+        # Sắp xếp theo rating (id để thứ tự ổn định giữa các page)
+        query = query.order_by(desc(UserGameRating.rating), UserGameRating.user_id)
         
-        # Check friendship status
-        is_friend = False
-        has_pending = False
-        if current_user and current_user.id != user.id:
-            is_friend = await check_friendship(db, current_user.id, user.id)
-            has_pending = await check_pending_request(db, current_user.id, user.id)
+        # Phân trang
+        query = query.offset(offset).limit(limit)
         
+        rows = (await db.execute(query)).mappings().all()
+        page = []
+        for idx, row in enumerate(rows):
+            stats = user_stats.stats_from_row(row["UserGameRating"])
+            page.append({
+                "rank": row["rank"] if search else offset + idx + 1,
+                "user_id": row["id"],
+                "username": row["username"],
+                "avatar_url": row["avatar_url"],
+                "rating": stats["rating"],
+                "wins": stats["wins"],
+                "losses": stats["losses"],
+                "draws": stats["draws"],
+                "total_games": stats["total_games"],
+                "win_rate": stats["win_rate"],
+            })
+        return page
+
+    # Page dùng chung cho mọi người xem (cache theo game + page + search, TTL ngắn)
+    params = {"game_id": game_id, "limit": limit, "offset": offset, "search": search}
+    page = await read_through(LEADERBOARD_CACHE_NAMESPACE, params, load_page, ttl=LEADERBOARD_CACHE_TTL)
+
+    # Cờ bạn bè của người xem: 1 query cho cả page
+    flags = {}
+    others = [entry["user_id"] for entry in page if entry["user_id"] != viewer_id]
+    if viewer_id is not None and others:
+        flag_rows = await db.execute(
+            select(User.id, *friendship_flags(viewer_id, User.id)).where(User.id.in_(others))
+        )
+        flags = {row[0]: (bool(row[1]), bool(row[2])) for row in flag_rows}
+    
+    # Build response
+    leaderboard = []
+    for entry in page:
+        is_friend, has_pending = flags.get(entry["user_id"], (False, False))
         leaderboard.append(LeaderboardEntry(
-            rank=rank,
-            user_id=user.id,
-            username=user.username,
-            avatar_url=user.avatar_url,
-            rating=rating_obj.rating,
-            wins=stats["wins"],
-            losses=stats["losses"],
-            draws=stats["draws"],
-            total_games=stats["total_games"],
-            win_rate=stats["win_rate"],
-            is_current_user= user.id == current_user.id,
+            **entry,
+            is_current_user=entry["user_id"] == viewer_id,
             is_online=False,  # TODO: implement online status
             is_friend=is_friend,
-            has_pending_request=has_pending
+            has_pending_request=has_pending,
         ))
     
     return leaderboard
@@ -206,7 +189,7 @@ async def get_user_profile(
         raise HTTPException(404, "User not found")
     
     # Tìm game
-    game = await db.scalar(select(Game).where(Game.name == game_name))
+    game = await get_game(db, game_name)
     if not game:
         raise HTTPException(404, f"Game '{game_name}' not found")
     
@@ -215,25 +198,29 @@ async def get_user_profile(
         select(UserGameRating)
         .where(UserGameRating.user_id == user_id, UserGameRating.game_id == game.id)
     )
-    rating = rating_obj.rating if rating_obj else 1200
+    stats = user_stats.stats_from_row(rating_obj)
+    rating = stats["rating"]
     
     # Lấy rank
-    rank = await get_user_rank(db, user_id, game.id)
-    
-    # Lấy stats
-    stats = await get_user_stats(db, user_id, game.id)
+    rank = await get_user_rank(db, user_id, game.id, rating)
     
     # Check friendship
     is_friend = False
     has_pending = False
-    if current_user and current_user.id != user_id:
-        is_friend = await check_friendship(db, current_user.id, user_id)
-        has_pending = await check_pending_request(db, current_user.id, user_id)
+    if current_user:
+        is_friend, has_pending = await get_friendship_status(db, current_user.id, user_id)
     
-    # Lấy recent matches (10 trận gần nhất)
+    # Lấy recent matches (10 trận gần nhất) kèm tên đối thủ trong cùng 1 query
+    opponent_mp = aliased(MatchPlayer)
+    opponent_user = aliased(User)
     recent_matches_query = (
-        select(Match, MatchPlayer)
+        select(Match, MatchPlayer, opponent_user.username)
         .join(MatchPlayer, MatchPlayer.match_id == Match.id)
+        .outerjoin(
+            opponent_mp,
+            and_(opponent_mp.match_id == Match.id, opponent_mp.user_id != user_id)
+        )
+        .outerjoin(opponent_user, opponent_user.id == opponent_mp.user_id)
         .where(
             MatchPlayer.user_id == user_id,
             Match.game_id == game.id,
@@ -246,21 +233,8 @@ async def get_user_profile(
     recent_results = recent_results.all()
     
     recent_matches = []
-    for match, player in recent_results:
-        # Tìm opponent
-        opponent_player = await db.scalar(
-            select(MatchPlayer)
-            .where(
-                MatchPlayer.match_id == match.id,
-                MatchPlayer.user_id != user_id
-            )
-        )
-        
-        if opponent_player:
-            opponent = await db.scalar(select(User).where(User.id == opponent_player.user_id))
-            opponent_username = opponent.username if opponent else "Unknown"
-        else:
-            opponent_username = "Bot/Unknown"
+    for match, player, opponent_name in recent_results:
+        opponent_username = opponent_name or "Bot/Unknown"
         
         # Xác định kết quả
         if player.is_winner == True:
@@ -1,9 +1,12 @@
 # app/api/match_history.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, desc, func
+from sqlalchemy import select, and_, or_, desc, func, tuple_
+from sqlalchemy.orm import aliased
 from app.core.database import get_db
 from app.core.security import get_current_user
+from app.core import user_stats
+from app.core.game_catalog import get_game
 from app.models.models import (
     User, Game, Match, MatchPlayer, Move, MatchStatus, UserGameRating
 )
@@ -11,11 +14,14 @@ from app.schemas.match_history import (
     MatchHistoryItem, MatchDetailResponse, MoveDetail, 
     PlayerInfo, MatchHistoryFilter
 )
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime, timezone
+import base64
 
 router = APIRouter(prefix="/api/match-history", tags=["match-history"])
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 # ==== Helper Functions ====
 
 def build_board_from_moves(moves: List[Move], rows: int, cols: int) -> List[List[Optional[str]]]:
@@ -74,36 +80,59 @@ def calculate_duration(started_at: Optional[datetime], finished_at: Optional[dat
         return int((finished_at - started_at).total_seconds())
     return None
 
-# ==== API Endpoints ====
+def encode_cursor(created_at: datetime, match_id: int) -> str:
+    """Cursor dạng opaque cho trang tiếp theo: base64("created_at|match_id")."""
+    raw = f"{created_at.isoformat()}|{match_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-@router.get("/my-matches", response_model=List[MatchHistoryItem])
-async def get_my_match_history(
-    game_name: str = Query("Caro", description="Tên game"),
-    status: Optional[str] = Query(None, description="Filter theo status (finished, abandoned, etc.)"),
-    result: Optional[str] = Query(None, description="Filter theo kết quả (win, loss, draw)"),
-    limit: int = Query(10, ge=1, le=50, description="Số lượng trận tối đa"),
-    offset: int = Query(0, ge=0, description="Vị trí bắt đầu"),
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
-):
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, match_id = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), int(match_id)
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+async def fetch_match_history(
+    db: AsyncSession,
+    user_id: int,
+    game: Game,
+    status: Optional[str],
+    result: Optional[str],
+    limit: int,
+    offset: int,
+    cursor: Optional[str],
+) -> Tuple[List[MatchHistoryItem], Optional[str]]:
     """
-    Lấy lịch sử đấu của người dùng hiện tại.
-    
-    - Hiển thị 10 trận gần nhất (có thể tùy chỉnh)
-    - Filter theo status và result
-    - Sắp xếp theo thời gian mới nhất
+    Lịch sử đấu từ góc nhìn user_id, phân trang keyset trên (created_at, id).
+    Đối thủ + số nước đi lấy trong cùng 1 query nên trang sâu tốn như trang đầu.
+    Returns: (items, cursor của trang tiếp theo hoặc None)
     """
-    # Tìm game
-    game = await db.scalar(select(Game).where(Game.name == game_name))
-    if not game:
-        raise HTTPException(404, f"Game '{game_name}' not found")
-    
-    # Build query
+    opponent_mp = aliased(MatchPlayer)
+    opponent_user = aliased(User)
+    total_moves = (
+        select(func.count())
+        .select_from(Move)
+        .where(Move.match_id == Match.id)
+        .scalar_subquery()
+    )
     query = (
-        select(Match, MatchPlayer)
+        select(
+            Match,
+            MatchPlayer,
+            opponent_mp.symbol,
+            opponent_user.username,
+            opponent_user.avatar_url,
+            total_moves.label("total_moves"),
+        )
         .join(MatchPlayer, MatchPlayer.match_id == Match.id)
+        .outerjoin(
+            opponent_mp,
+            and_(opponent_mp.match_id == Match.id, opponent_mp.user_id != user_id)
+        )
+        .outerjoin(opponent_user, opponent_user.id == opponent_mp.user_id)
         .where(
-            MatchPlayer.user_id == current_user.id,
+            MatchPlayer.user_id == user_id,
             Match.game_id == game.id
         )
     )
@@ -128,53 +157,39 @@ async def get_my_match_history(
         else:
             raise HTTPException(400, f"Invalid result: {result}. Must be 'win', 'loss' (or 'lose'), or 'draw'")
     
-    # Sắp xếp và phân trang
-    query = query.order_by(desc(Match.created_at)).offset(offset).limit(limit)
+    # Keyset: chỉ lấy các trận "cũ hơn" cursor; offset giữ lại cho client cũ
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.where(tuple_(Match.created_at, Match.id) < (cursor_created_at, cursor_id))
+    elif offset:
+        query = query.offset(offset)
+    
+    # Lấy dư 1 dòng để biết còn trang sau không
+    query = query.order_by(desc(Match.created_at), desc(Match.id)).limit(limit + 1)
     
-    # Execute
-    results = await db.execute(query)
-    results = results.all()
+    rows = (await db.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
-    # Build response
     history = []
-    for match, my_player in results:
-        # Tìm opponent
-        opponent_player = await db.scalar(
-            select(MatchPlayer)
-            .where(
-                MatchPlayer.match_id == match.id,
-                MatchPlayer.user_id != current_user.id
-            )
-        )
-        
-        if opponent_player:
-            opponent = await db.scalar(select(User).where(User.id == opponent_player.user_id))
-            opponent_username = opponent.username if opponent else "Unknown"
-            opponent_avatar = opponent.avatar_url if opponent else None
-            opponent_symbol = opponent_player.symbol
+    for match, player, opponent_symbol, opponent_username, opponent_avatar, moves_count in rows:
+        if opponent_symbol is not None:
+            opponent_username = opponent_username or "Unknown"
         else:
             opponent_username = "Bot/Unknown"
             opponent_avatar = None
-            opponent_symbol = "O" if my_player.symbol == "X" else "X"
+            opponent_symbol = "O" if player.symbol == "X" else "X"
         
         # Xác định result
         result_str = None
         if match.status == MatchStatus.finished:
-            if my_player.is_winner == True:
+            if player.is_winner == True:
                 result_str = "win"
-            elif my_player.is_winner == False:
+            elif player.is_winner == False:
                 result_str = "loss"
             else:
                 result_str = "draw"
         
-        # Đếm số nước đi
-        total_moves = await db.scalar(
-            select(func.count()).select_from(Move).where(Move.match_id == match.id)
-        ) or 0
-        
-        # Tính duration
-        duration = calculate_duration(match.started_at, match.finished_at)
-        
         history.append(MatchHistoryItem(
             match_id=match.id,
             game_name=game.name,
@@ -183,26 +198,66 @@ async def get_my_match_history(
             opponent_username=opponent_username,
             opponent_avatar_url=opponent_avatar,
             opponent_symbol=opponent_symbol,
-            my_symbol=my_player.symbol,
+            my_symbol=player.symbol,
             board_rows=match.board_rows,
             board_cols=match.board_cols,
-            total_moves=total_moves,
+            total_moves=moves_count or 0,
             created_at=match.created_at,
             started_at=match.started_at,
             finished_at=match.finished_at,
-            duration_seconds=duration
+            duration_seconds=calculate_duration(match.started_at, match.finished_at)
         ))
     
+    next_cursor = None
+    if has_more and rows:
+        last_match = rows[-1][0]
+        next_cursor = encode_cursor(last_match.created_at, last_match.id)
+    return history, next_cursor
+
+# ==== API Endpoints ====
+
+@router.get("/my-matches", response_model=List[MatchHistoryItem])
+async def get_my_match_history(
+    response: Response,
+    game_name: str = Query("Caro", description="Tên game"),
+    status: Optional[str] = Query(None, description="Filter theo status (finished, abandoned, etc.)"),
+    result: Optional[str] = Query(None, description="Filter theo kết quả (win, loss, draw)"),
+    limit: int = Query(10, ge=1, le=50, description="Số lượng trận tối đa"),
+    offset: int = Query(0, ge=0, description="Vị trí bắt đầu (deprecated, dùng cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor từ header X-Next-Cursor của trang trước"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Lấy lịch sử đấu của người dùng hiện tại.
+    
+    - Hiển thị 10 trận gần nhất (có thể tùy chỉnh)
+    - Filter theo status và result
+    - Sắp xếp theo thời gian mới nhất
+    - Trang tiếp theo: truyền lại header X-Next-Cursor vào ?cursor=
+    """
+    # Tìm game
+    game = await get_game(db, game_name)
+    if not game:
+        raise HTTPException(404, f"Game '{game_name}' not found")
+    
+    history, next_cursor = await fetch_match_history(
+        db, current_user.id, game, status, result, limit, offset, cursor
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return history
 
 @router.get("/user/{user_id}", response_model=List[MatchHistoryItem])
 async def get_user_match_history(
     user_id: int,
+    response: Response,
     game_name: str = Query("Caro", description="Tên game"),
     status: Optional[str] = Query(None, description="Filter theo status"),
     result: Optional[str] = Query(None, description="Filter theo kết quả"),
     limit: int = Query(10, ge=1, le=50, description="Số lượng trận tối đa"),
-    offset: int = Query(0, ge=0, description="Vị trí bắt đầu"),
+    offset: int = Query(0, ge=0, description="Vị trí bắt đầu (deprecated, dùng cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor từ header X-Next-Cursor của trang trước"),
     current_user: Optional[User] = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
@@ -218,104 +273,15 @@ async def get_user_match_history(
         raise HTTPException(404, "User not found")
     
     # Tìm game
-    game = await db.scalar(select(Game).where(Game.name == game_name))
+    game = await get_game(db, game_name)
     if not game:
         raise HTTPException(404, f"Game '{game_name}' not found")
     
-    # Build query (giống như my-matches nhưng với user_id khác)
-    query = (
-        select(Match, MatchPlayer)
-        .join(MatchPlayer, MatchPlayer.match_id == Match.id)
-        .where(
-            MatchPlayer.user_id == user_id,
-            Match.game_id == game.id
-        )
+    history, next_cursor = await fetch_match_history(
+        db, user_id, game, status, result, limit, offset, cursor
     )
-    
-    # Filter
-    if status:
-        try:
-            match_status = MatchStatus(status)
-            query = query.where(Match.status == match_status)
-        except ValueError:
-            raise HTTPException(400, f"Invalid status: {status}")
-    
-    if result:
-        result_lower = result.lower()
-        if result_lower == "win":
-            query = query.where(MatchPlayer.is_winner == True)
-        elif result_lower in ["loss", "lose"]:  # Accept both "loss" and "lose"
-            query = query.where(MatchPlayer.is_winner == False)
-        elif result_lower == "draw":
-            query = query.where(MatchPlayer.is_winner == None, Match.status == MatchStatus.finished)
-        else:
-            raise HTTPException(400, f"Invalid result: {result}. Must be 'win', 'loss' (or 'lose'), or 'draw'")
-    
-    # Sắp xếp và phân trang
-    query = query.order_by(desc(Match.created_at)).offset(offset).limit(limit)
-    
-    # Execute
-    results = await db.execute(query)
-    results = results.all()
-    
-    # Build response
-    history = []
-    for match, player in results:
-        # Tìm opponent
-        opponent_player = await db.scalar(
-            select(MatchPlayer)
-            .where(
-                MatchPlayer.match_id == match.id,
-                MatchPlayer.user_id != user_id
-            )
-        )
-        
-        if opponent_player:
-            opponent = await db.scalar(select(User).where(User.id == opponent_player.user_id))
-            opponent_username = opponent.username if opponent else "Unknown"
-            opponent_avatar = opponent.avatar_url if opponent else None
-            opponent_symbol = opponent_player.symbol
-        else:
-            opponent_username = "Bot/Unknown"
-            opponent_avatar = None
-            opponent_symbol = "O" if player.symbol == "X" else "X"
-        
-        # Xác định result
-        result_str = None
-        if match.status == MatchStatus.finished:
-            if player.is_winner == True:
-                result_str = "win"
-            elif player.is_winner == False:
-                result_str = "loss"
-            else:
-                result_str = "draw"
-        
-        # Đếm số nước đi
-        total_moves = await db.scalar(
-            select(func.count()).select_from(Move).where(Move.match_id == match.id)
-        ) or 0
-        
-        # Tính duration
-        duration = calculate_duration(match.started_at, match.finished_at)
-        
-        history.append(MatchHistoryItem(
-            match_id=match.id,
-            game_name=game.name,
-            status=match.status.value,
-            result=result_str,
-            opponent_username=opponent_username,
-            opponent_avatar_url=opponent_avatar,
-            opponent_symbol=opponent_symbol,
-            my_symbol=player.symbol,
-            board_rows=match.board_rows,
-            board_cols=match.board_cols,
-            total_moves=total_moves,
-            created_at=match.created_at,
-            started_at=match.started_at,
-            finished_at=match.finished_at,
-            duration_seconds=duration
-        ))
-    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return history
 
 @router.get("/match/{match_id}", response_model=MatchDetailResponse)
@@ -432,63 +398,12 @@ async def get_match_stats_summary(
     - Trận gần nhất
     """
     # Tìm game
-    game = await db.scalar(select(Game).where(Game.name == game_name))
+    game = await get_game(db, game_name)
     if not game:
         raise HTTPException(404, f"Game '{game_name}' not found")
     
-    # Đếm tổng số trận
-    total_matches = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == current_user.id,
-            Match.game_id == game.id,
-            Match.status == MatchStatus.finished
-        )
-    ) or 0
-    
-    # Đếm wins
-    wins = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == current_user.id,
-            Match.game_id == game.id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == True
-        )
-    ) or 0
-    
-    # Đếm losses
-    losses = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == current_user.id,
-            Match.game_id == game.id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == False
-        )
-    ) or 0
-    
-    # Đếm draws
-    draws = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == current_user.id,
-            Match.game_id == game.id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == None
-        )
-    ) or 0
-    
-    # Tính win rate
-    win_rate = (wins / total_matches * 100) if total_matches > 0 else 0.0
+    # Stats tổng hợp: 1 dòng user_game_ratings
+    stats = await user_stats.get_stats(db, current_user.id, game.id)
     
     # Lấy trận gần nhất
     latest_match = await db.execute(
@@ -504,11 +419,13 @@ async def get_match_stats_summary(
     latest_match = latest_match.scalar_one_or_none()
     
     return {
-        "total_matches": total_matches,
-        "wins": wins,
-        "losses": losses,
-        "draws": draws,
-        "win_rate": round(win_rate, 2),
+        "total_matches": stats["total_games"],
+        "wins": stats["wins"],
+        "losses": stats["losses"],
+        "draws": stats["draws"],
+        "win_rate": stats["win_rate"],
+        "current_streak": stats["current_streak"],
+        "best_win_streak": stats["best_win_streak"],
         "latest_match_id": latest_match.id if latest_match else None,
         "latest_match_date": latest_match.created_at.isoformat() if latest_match else None
     }
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert, update, desc, func
+from sqlalchemy import select, insert, update, desc
 from app.core.database import get_db
-from app.models.models import Match, MatchPlayer, Game, MatchStatus, User, UserGameRating, Move
+from app.models.models import Match, MatchPlayer, MatchStatus, User, UserGameRating, Move
 from app.core.security import get_current_user
+from app.core import rank_service, user_stats
+from app.core.game_catalog import get_game
 from datetime import datetime, timezone
 from typing import List, Optional
 
@@ -16,7 +18,7 @@ async def quick_join_match(
     current_user=Depends(get_current_user)
 ):
     # Lấy game Caro
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
         raise HTTPException(status_code=404, detail="Game 'Caro' not found")
 
@@ -225,7 +227,7 @@ async def get_leaderboard(
 ):
     """Bảng xếp hạng game Caro."""
     # Lấy game Caro
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
         raise HTTPException(status_code=404, detail="Game 'Caro' not found")
     
@@ -270,7 +272,7 @@ async def get_my_stats(
 ):
     """Thống kê của bản thân."""
     # Lấy game Caro
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
         raise HTTPException(status_code=404, detail="Game 'Caro' not found")
     
@@ -281,41 +283,12 @@ async def get_my_stats(
             UserGameRating.game_id == game.id
         )
     )
-    
-    if not rating:
-        return {
-            "rating": 1000,
-            "wins": 0,
-            "losses": 0,
-            "draws": 0,
-            "total_games": 0,
-            "win_rate": 0.0,
-            "rank": None
-        }
-    
-    total_games = rating.wins + rating.losses + rating.draws
-    win_rate = (rating.wins / total_games * 100) if total_games > 0 else 0
-    
-    # Tính rank
-    rank_result = await db.scalar(
-        select(func.count())
-        .select_from(UserGameRating)
-        .where(
-            UserGameRating.game_id == game.id,
-            UserGameRating.rating > rating.rating
-        )
-    )
-    rank = (rank_result or 0) + 1
-    
-    return {
-        "rating": rating.rating,
-        "wins": rating.wins,
-        "losses": rating.losses,
-        "draws": rating.draws,
-        "total_games": total_games,
-        "win_rate": round(win_rate, 1),
-        "rank": rank
-    }
+    stats = user_stats.stats_from_row(rating)
+
+    # Tính rank (Redis ZSET, fallback DB)
+    rank = await rank_service.get_rank(db, current_user.id, game.id, rating.rating) if rating else None
+
+    return {**stats, "rank": rank}
 
 
 @router.get("/rating/{user_id}")
@@ -325,7 +298,7 @@ async def get_user_rating(
 ):
     """Lấy rating của một user cụ thể."""
     # Lấy game Caro
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
         raise HTTPException(status_code=404, detail="Game 'Caro' not found")
     
@@ -341,44 +314,15 @@ async def get_user_rating(
             UserGameRating.game_id == game.id
         )
     )
-    
-    if not rating:
-        return {
-            "user_id": user_id,
-            "username": user.username,
-            "avatar_url": user.avatar_url,
-            "rating": 1000,
-            "wins": 0,
-            "losses": 0,
-            "draws": 0,
-            "total_games": 0,
-            "win_rate": 0.0,
-            "rank": None
-        }
-    
-    total_games = rating.wins + rating.losses + rating.draws
-    win_rate = (rating.wins / total_games * 100) if total_games > 0 else 0
-    
-    # Tính rank
-    rank_result = await db.scalar(
-        select(func.count())
-        .select_from(UserGameRating)
-        .where(
-            UserGameRating.game_id == game.id,
-            UserGameRating.rating > rating.rating
-        )
-    )
-    rank = (rank_result or 0) + 1
-    
+    stats = user_stats.stats_from_row(rating)
+
+    # Tính rank (Redis ZSET, fallback DB)
+    rank = await rank_service.get_rank(db, user_id, game.id, rating.rating) if rating else None
+
     return {
         "user_id": user_id,
         "username": user.username,
         "avatar_url": user.avatar_url,
-        "rating": rating.rating,
-        "wins": rating.wins,
-        "losses": rating.losses,
-        "draws": rating.draws,
-        "total_games": total_games,
-        "win_rate": round(win_rate, 1),
+        **stats,
         "rank": rank
     }
\ No newline at end of file
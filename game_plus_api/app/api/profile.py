@@ -4,9 +4,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, or_, and_
 from app.core.database import get_db
 from app.core.security import get_current_user, hash_password, verify_password
+from app.core import auth_cache, user_stats
+from app.core.cache import bump_generation
+from app.api.leaderboard import LEADERBOARD_CACHE_NAMESPACE
 from app.models.models import (
-    User, UserGameRating, Game, MatchPlayer, Match, MatchStatus,
-    Friend
+    User, UserGameRating, Game, Friend
 )
 from app.schemas.user import (
     UserProfileDetail, UserUpdate, ChangePasswordRequest,
@@ -28,78 +30,29 @@ async def get_user_from_auth(current_user, db: AsyncSession) -> User:
         raise HTTPException(404, "User not found")
     return user
 
+async def invalidate_user_caches(user_id: int, deleted: bool = False):
+    """
+    Gọi sau khi commit đổi / xóa user: bỏ auth cache ở mọi worker (xóa -> token cũ hết hiệu lực)
+    và leaderboard (hiển thị username / avatar).
+    """
+    await auth_cache.invalidate_user(user_id, deleted=deleted)
+    await bump_generation(LEADERBOARD_CACHE_NAMESPACE)
+
 async def get_user_stats(db: AsyncSession, user_id: int, game_name: str = "Caro") -> dict:
-    """Lấy thống kê của user."""
-    # Tìm game
-    game = await db.scalar(select(Game).where(Game.name == game_name))
-    if not game:
-        return {
-            "rating": 1200,
-            "total_matches": 0,
-            "wins": 0,
-            "losses": 0,
-            "draws": 0,
-            "win_rate": 0.0
-        }
-    
-    # Lấy rating
-    rating_obj = await db.scalar(
-        select(UserGameRating.rating)
-        .where(UserGameRating.user_id == user_id)
-        .where(UserGameRating.game_id == game.id)
-    )
-    rating = rating_obj if rating_obj is not None else 1200
-    
-    # Đếm wins
-    wins = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == user_id,
-            Match.game_id == game.id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == True
+    """Lấy thống kê của user (đọc 1 dòng user_game_ratings, không COUNT lịch sử)."""
+    # Tìm game + dòng stats trong 1 query
+    row = (await db.execute(
+        select(Game.id, UserGameRating)
+        .outerjoin(
+            UserGameRating,
+            and_(UserGameRating.game_id == Game.id, UserGameRating.user_id == user_id)
         )
-    ) or 0
+        .where(Game.name == game_name)
+    )).first()
     
-    # Đếm losses
-    losses = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == user_id,
-            Match.game_id == game.id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == False
-        )
-    ) or 0
-    
-    # Đếm draws
-    draws = await db.scalar(
-        select(func.count())
-        .select_from(MatchPlayer)
-        .join(Match, Match.id == MatchPlayer.match_id)
-        .where(
-            MatchPlayer.user_id == user_id,
-            Match.game_id == game.id,
-            Match.status == MatchStatus.finished,
-            MatchPlayer.is_winner == None
-        )
-    ) or 0
-    
-    total_matches = wins + losses + draws
-    win_rate = (wins / total_matches * 100) if total_matches > 0 else 0.0
-    
-    return {
-        "rating": rating,
-        "total_matches": total_matches,
-        "wins": wins,
-        "losses": losses,
-        "draws": draws,
-        "win_rate": round(win_rate, 2)
-    }
+    stats = user_stats.stats_from_row(row[1] if row else None)
+    stats["total_matches"] = stats.pop("total_games")
+    return stats
 
 async def get_total_friends(db: AsyncSession, user_id: int) -> int:
     """Đếm số lượng bạn bè."""
@@ -189,6 +142,7 @@ async def update_profile(
     user.updated_at = datetime.now(timezone.utc)
     await db.commit()
     await db.refresh(user)
+    await invalidate_user_caches(user.id)
     
     # Return updated profile
     return await get_my_profile(current_user, db)
@@ -211,6 +165,7 @@ async def update_avatar(
     user.updated_at = datetime.now(timezone.utc)
     await db.commit()
     await db.refresh(user)
+    await invalidate_user_caches(user.id)
     
     return await get_my_profile(current_user, db)
 
@@ -242,7 +197,7 @@ async def change_password(
         raise HTTPException(400, "This account doesn't have a password set")
     
     # Verify mật khẩu cũ
-    if not verify_password(data.old_password, user.hashed_password):
+    if not await verify_password(data.old_password, user.hashed_password):
         raise HTTPException(400, "Incorrect old password")
     
     # Kiểm tra mật khẩu mới khác mật khẩu cũ
@@ -250,7 +205,7 @@ async def change_password(
         raise HTTPException(400, "New password must be different from old password")
     
     # Update mật khẩu
-    user.hashed_password = hash_password(data.new_password)
+    user.hashed_password = await hash_password(data.new_password)
     user.updated_at = datetime.now(timezone.utc)
     await db.commit()
     
@@ -282,12 +237,13 @@ async def delete_account(
         if not user.hashed_password:
             raise HTTPException(400, "This account doesn't have a password set")
         
-        if not verify_password(password, user.hashed_password):
+        if not await verify_password(password, user.hashed_password):
             raise HTTPException(400, "Incorrect password")
     
     # Xóa user (cascade sẽ xóa tất cả dữ liệu liên quan)
     await db.delete(user)
     await db.commit()
+    await invalidate_user_caches(user.id, deleted=True)
     
     return {
         "message": "Account deleted successfully",
@@ -310,7 +266,6 @@ async def get_detailed_stats(
     
     # TODO: Thêm các stats khác nếu cần
     # - Average game duration
-    # - Longest winning streak
     # - Favorite opponent
     # etc.
     
@@ -1,40 +1,61 @@
 ﻿# app/api/realtime.py
 from __future__ import annotations
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends
-from jose import jwt, JWTError
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert, update
+from sqlalchemy import select, update, case, func, type_coerce, JSON
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from app.core.database import get_db
-from app.core.cache import cache_get, cache_set, cache_delete_pattern
+from app.core.database import AsyncSessionLocal
 from app.models.models import Match, MatchPlayer, Move, MatchStatus, User, UserGameRating
-from datetime import datetime, timezone
+from app.core.caro_board import CaroBoard
+from app.core.security import decode_user_id, get_user_projection
+from app.core.turn_scheduler import TimeControl, scheduler as turn_scheduler
+from app.core.game_catalog import get_game
+from app.core.log import SAMPLE_RATE as LOG_SAMPLE_RATE, get_logger
+from app.core import drain, fanout, match_bus, match_snapshots, matchmaking, metrics, rank_service, rating_engine, room_directory, spectators
+from app.api.realtime_helpers import add_move_to_batch, flush_move_batch, fetch_rooms_list_cached, retry_after_flush
+from datetime import datetime, timedelta, timezone
 import asyncio
 import json
 import os
-from typing import Dict, Tuple, List
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Tuple
 
 router = APIRouter(prefix="/ws", tags=["realtime"])
+log = get_logger("realtime")
 
 SECRET_KEY = os.getenv("SECRET_KEY", "changeme")
 ALGORITHM = "HS256"
 
 
 MOVE_TIMEOUT = 30  # seconds per move
+EVENT_BUFFER_SIZE = int(os.getenv("MATCH_EVENT_BUFFER", "256"))  # số event giữ lại cho resync
+RESTORE_GRACE = float(os.getenv("MATCH_RESTORE_GRACE", "5"))  # giây bù cho lượt đang chạy khi warm start
+SLOW_MOVE_SECONDS = float(os.getenv("SLOW_MOVE_MS", "250")) / 1000  # nước đi chậm hơn -> log warning
+RESULT_EVENTS = ("win", "draw", "surrender", "timeout", "disconnect")
 
 class Connection:
     def __init__(self, ws: WebSocket, user_id: int):
         self.ws = ws
         self.user_id = user_id
         self.last_ping = datetime.now(timezone.utc)
+        # Mọi message gửi cho client đi qua outbox (đúng thứ tự, không chờ mạng).
+        # Đầy -> bỏ event cũ nhất; client thấy lỗ hổng seq và xin resync.
+        self.outbox = fanout.Outbox(ws, name=f"match user {user_id}", policy=fanout.POLICY_DROP)
 
 class RoomState:
-    def __init__(self, match_id: int, board_rows: int, board_cols: int, win_len: int):
+    def __init__(
+        self, match_id: int, board_rows: int, board_cols: int, win_len: int,
+        time_control: TimeControl | None = None,
+    ):
         self.match_id = match_id
         self.board_rows = board_rows
         self.board_cols = board_cols
         self.win_len = win_len
-        self.board = [["" for _ in range(board_cols)] for _ in range(board_rows)]
+        self.game_id: int | None = None  # set khi load_room_from_db
+        self.board = CaroBoard(board_rows, board_cols, win_len)
         self.turn_symbol = "X"
         self.turn_no = 0
         self.status: str = "waiting"  # waiting | playing | finished
@@ -44,15 +65,27 @@ class RoomState:
         self.lock = asyncio.Lock()
         self.loaded_from_db = False  # Ä‘Ã£ khÃ´i phá»¥c bÃ n tá»« DB chÆ°a?
         self.turn_start_time: datetime | None = None  # thá»i Ä‘iá»ƒm báº¯t Ä‘áº§u lÆ°á»£t hiện tại
-        self.timeout_task: asyncio.Task | None = None  # task Ä‘áº¿m thá»i gian
+        # Time control của trận: deadline nằm trong turn_scheduler, không còn task riêng
+        self.time_control = time_control or TimeControl.from_env(MOVE_TIMEOUT)
+        self.clocks: Dict[str, float] = self.time_control.new_clocks()  # quỹ giờ Fischer theo symbol
+        self.turn_limit: float = self.time_control.per_move  # giới hạn của lượt hiện tại
         self.rematch_requests: set[int] = set()  # user_ids Ä‘Ã£ gá»­i yÃªu cáº§u rematch
-
-    def snapshot(self, you_id: int):
-        time_left = None
+        # Event stream có đánh số: client mất kết nối chỉ cần xin "events since N"
+        self.epoch = uuid.uuid4().hex[:8]  # đổi khi room được tạo lại (worker restart)
+        self.seq = 0
+        self.events: Deque[Tuple[int, str]] = deque(maxlen=EVENT_BUFFER_SIZE)  # (seq, json)
+        # Cho spectator frame
+        self.last_move: dict | None = None
+        self.result: dict | None = None          # event kết thúc trận (win/draw/...)
+        self.next_match_id: int | None = None    # trận rematch
+
+    def time_left(self) -> float | None:
         if self.status == "playing" and self.turn_start_time:
             elapsed = (datetime.now(timezone.utc) - self.turn_start_time).total_seconds()
-            time_left = max(0, MOVE_TIMEOUT - elapsed)
-        
+            return max(0, self.turn_limit - elapsed)
+        return None
+
+    def players_list(self) -> List[dict]:
         # Tạo danh sÃ¡ch players vá»›i Ä'áº§y Ä'á»§ thÃ´ng tin
         players_list = []
         for uid, sym in self.players.items():
@@ -60,224 +93,249 @@ class RoomState:
             if uid in self.player_info:
                 player_data.update(self.player_info[uid])
             players_list.append(player_data)
-        
+        return players_list
+
+    def snapshot(self, you_id: int):
         return {
             "type": "joined",
             "payload": {
                 "you": {"user_id": you_id, "symbol": self.players.get(you_id)},
-                "players": players_list,
+                "players": self.players_list(),
                 "turn": self.turn_symbol,
                 "turn_no": self.turn_no,
                 "status": self.status,
-                "time_left": time_left,
-                "board": [[cell for cell in row] for row in self.board],  # gá»­i cáº£ bÃ n cá»
+                "time_left": self.time_left(),
+                "time_control": self.time_control.to_dict(),
+                "epoch": self.epoch,
+                "seq": self.seq,
+                "clocks": self.clocks,
+                "board": self.board.to_rows(),  # cache dùng chung tới nước đi tiếp theo
+                "board_flat": self.board.to_flat(),  # rows*cols ký tự, "." = ô trống
+            },
+        }
+
+    def spectator_frame(self) -> dict:
+        """Trạng thái gọn cho spectator (bàn cờ dạng chuỗi, không có chat / rating)."""
+        return {
+            "type": "spectate",
+            "payload": {
+                "match_id": self.match_id,
+                "seq": self.seq,
+                "turn_no": self.turn_no,
+                "turn": self.turn_symbol,
+                "status": self.status,
+                "players": self.players_list(),
+                "board_flat": self.board.to_flat(),
+                "rows": self.board_rows,
+                "cols": self.board_cols,
+                "last_move": self.last_move,
+                "time_left": self.time_left(),
+                "clocks": self.clocks,
+                "result": self.result,
+                "next_match_id": self.next_match_id,
             },
         }
 
+    def to_snapshot(self) -> dict:
+        """Trạng thái đủ để dựng lại room sau khi worker restart (match_snapshots)."""
+        return {
+            "match_id": self.match_id,
+            "rows": self.board_rows,
+            "cols": self.board_cols,
+            "win_len": self.win_len,
+            "game_id": self.game_id,
+            "status": self.status,
+            "board_flat": self.board.to_flat(),
+            "turn": self.turn_symbol,
+            "turn_no": self.turn_no,
+            "players": self.players,
+            "player_info": self.player_info,
+            "time_control": self.time_control.to_dict(),
+            "clocks": self.clocks,
+            "turn_limit": self.turn_limit,
+            "turn_started_at": self.turn_start_time.timestamp() if self.turn_start_time else None,
+            "last_move": self.last_move,
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> "RoomState":
+        state = cls(
+            data["match_id"], data["rows"], data["cols"], data["win_len"],
+            TimeControl.from_dict(data.get("time_control"), MOVE_TIMEOUT),
+        )
+        state.board = CaroBoard.from_flat(data["board_flat"], data["rows"], data["cols"], data["win_len"])
+        state.game_id = data["game_id"]
+        state.status = data["status"]
+        state.turn_symbol = data["turn"]
+        state.turn_no = data["turn_no"]
+        # JSON biến key int thành str
+        state.players = {int(uid): sym for uid, sym in data["players"].items()}
+        state.player_info = {int(uid): info for uid, info in data["player_info"].items()}
+        state.clocks = data["clocks"]
+        state.turn_limit = data["turn_limit"]
+        if data["turn_started_at"] is not None:
+            state.turn_start_time = datetime.fromtimestamp(data["turn_started_at"], tz=timezone.utc)
+        state.last_move = data["last_move"]
+        state.loaded_from_db = True  # đã khôi phục, không replay moves
+        return state
+
+    def record_event(self, message: dict) -> str:
+        """Gắn seq + turn_no cho event, serialize 1 lần và lưu vào ring buffer."""
+        self.seq += 1
+        message["seq"] = self.seq
+        message.setdefault("turn_no", self.turn_no)
+        data = json.dumps(message)
+        self.events.append((self.seq, data))
+        return data
+
+    def events_since(self, since: int, epoch: str | None) -> List[str] | None:
+        """Các event sau seq `since`; None nếu buffer không đủ (caller gửi snapshot)."""
+        if epoch != self.epoch or since < 0 or since > self.seq:
+            return None
+        if since == self.seq:
+            return []
+        if not self.events or self.events[0][0] > since + 1:
+            return None
+        return [data for seq, data in self.events if seq > since]
+
+    def resync_message(self, since: int, events: List[str]) -> str:
+        # Ghép chuỗi JSON đã serialize sẵn, không dump lại từng event
+        return (
+            '{"type": "resync", "payload": {"epoch": %s, "since": %d, "seq": %d, "events": [%s]}}'
+            % (json.dumps(self.epoch), since, self.seq, ", ".join(events))
+        )
+
 rooms: Dict[int, RoomState] = {}
 
 
 async def decode_token(token: str) -> int:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        sub = payload.get("sub")
-        return int(sub)
+        return decode_user_id(token)  # token đã verify được cache tới khi hết hạn
     except Exception as e:
         raise ValueError(f"Invalid token: {e}")
 
-def check_win(board: List[List[str]], x: int, y: int, win_len: int, symbol: str) -> List[Tuple[int,int]] | None:
-    H, W = len(board), len(board[0])
-    dirs = [(1,0),(0,1),(1,1),(1,-1)]
-    for dx,dy in dirs:
-        line = [(x,y)]
-        i,j = x+dx, y+dy
-        while 0 <= i < H and 0 <= j < W and board[i][j] == symbol:
-            line.append((i,j)); i += dx; j += dy
-        i,j = x-dx, y-dy
-        while 0 <= i < H and 0 <= j < W and board[i][j] == symbol:
-            line.insert(0,(i,j)); i -= dx; j -= dy
-        if len(line) >= win_len:
-            return line
-    return None
-
 async def broadcast(state: RoomState, message: dict):
-    data = json.dumps(message)
-    for conn in list(state.connections.values()):
-        try:
-            await conn.ws.send_text(data)
-        except Exception:
-            pass
+    data = state.record_event(message)
+    fanout.publish([conn.outbox for conn in state.connections.values()], data)
+
+    # Spectator không nhận từng event: chỉ hẹn 1 frame gộp (throttle)
+    mtype = message.get("type")
+    if mtype in RESULT_EVENTS:
+        payload = message.get("payload", {})
+        state.result = {"type": mtype, **{k: v for k, v in payload.items() if k != "rating_changes"}}
+    elif mtype == "rematch_accepted":
+        state.next_match_id = message["payload"].get("new_match_id")
+    spectators.mark_dirty(state.match_id, state.spectator_frame)
+
+    # Snapshot cho warm start khi worker restart; trận xong thì DB là đủ
+    if state.status == "finished":
+        await match_snapshots.discard(state.match_id)
+    else:
+        match_snapshots.mark_dirty(state.match_id, state.to_snapshot)
+
+async def end_match(state: RoomState, db: AsyncSession, winner_id: int | None, reason: str, result: dict):
+    """
+    Kết thúc trận: chốt DB rồi mới broadcast `result` (payload được gắn rating_changes).
+    Chốt lỗi (moves chưa ghi / DB lỗi) -> trận giữ trạng thái chờ chốt, move journal
+    thử lại sau mỗi lần flush; kết quả chỉ được công bố khi đã lưu.
+    """
+    log.debug("match_ending", match_id=state.match_id, winner_id=winner_id, reason=reason)
 
-async def end_match(state: RoomState, db: AsyncSession, winner_id: int | None, reason: str = "normal"):
-    """Káº¿t thÃºc tráº­n Ä‘áº¥u vÃ  Update database."""
-    print(f"ðŸ Ending match {state.match_id}, winner: {winner_id}, reason: {reason}")
-    
     state.status = "finished"
-    
-    # Cancel timeout task 
-    if state.timeout_task and not state.timeout_task.done():
-        state.timeout_task.cancel()
-    
-    try:
-        # cập nhật match status
-        result = await db.execute(
-            update(Match).where(Match.id == state.match_id).values(
-                status=MatchStatus.finished,
-                finished_at=datetime.now(timezone.utc)
-            )
-        )
-        print(f"âœ… Updated match {state.match_id} status to finished (rows affected: {result.rowcount})")
-        
-        # Update winner/loser
-        if winner_id:
-            result = await db.execute(
-                update(MatchPlayer)
-                .where(MatchPlayer.match_id == state.match_id, MatchPlayer.user_id == winner_id)
-                .values(is_winner=True)
-            )
-            print(f"âœ… Set winner {winner_id} (rows: {result.rowcount})")
-            
-            loser_ids = [uid for uid in state.players.keys() if uid != winner_id]
-            if loser_ids:
-                result2 = await db.execute(
-                    update(MatchPlayer)
-                    .where(MatchPlayer.match_id == state.match_id, MatchPlayer.user_id.in_(loser_ids))
-                    .values(is_winner=False)
-                )
-                print(f"âœ… Set losers {loser_ids} (rows: {result2.rowcount})")
-        else:
-            # Draw
-            result = await db.execute(
-                update(MatchPlayer)
-                .where(MatchPlayer.match_id == state.match_id)
-                .values(is_winner=None)
-            )
-            print(f"âœ… Set draw (rows: {result.rowcount})")
-        
-        print(f"ðŸ’¾ About to COMMIT match {state.match_id}...")
-        await db.commit()
-        print(f"âœ… COMMITTED match {state.match_id} to database!")
-        
-        # Update rating
-        print(f"ðŸ“Š Updating ratings for match {state.match_id}...")
-        rating_changes = await update_ratings(state, db, winner_id)
-        print(f"âœ… Ratings updated for match {state.match_id}")
-        
-        return rating_changes
-        
-    except Exception as e:
-        print(f"âŒ ERROR in end_match: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        await db.rollback()
-        return {}
 
-async def update_ratings(state: RoomState, db: AsyncSession, winner_id: int | None):
-    """Update ELO rating sau tráº­n Ä‘áº¥u."""
-    from app.models.models import UserGameRating
-    
+    # Hủy deadline của lượt hiện tại
+    turn_scheduler.cancel(state.match_id)
+
     try:
-        print(f"ðŸ“Š Starting update_ratings for match {state.match_id}, winner: {winner_id}")
-        
-        # Lấy game_id
-        match = await db.scalar(select(Match).where(Match.id == state.match_id))
-        if not match:
-            print(f"âš ï¸  Match {state.match_id} not found!")
-            return
-        
-        player_ids = list(state.players.keys())
-        if len(player_ids) != 2:
-            print(f"âš ï¸  Not exactly 2 players: {player_ids}")
-            return
-        
-        print(f"ðŸ‘¥ Players: {player_ids}")
-        
-        # Lấy rating hiện tại
-        ratings = {}
-        for uid in player_ids:
-            rating_obj = await db.scalar(
-                select(UserGameRating).where(
-                    UserGameRating.user_id == uid,
-                    UserGameRating.game_id == match.game_id
-                )
-            )
-            if not rating_obj:
-                # Tạo rating má»›i
-                rating_obj = UserGameRating(
-                    user_id=uid,
-                    game_id=match.game_id,
-                    rating=1200,
-                    wins=0,
-                    losses=0,
-                    draws=0
-                )
-                db.add(rating_obj)
-                await db.flush()
-            ratings[uid] = rating_obj
-        
-        print(f"ðŸ“ˆ Current ratings: {[(uid, r.rating) for uid, r in ratings.items()]}")
-        
-        # TÃ­nh ELO má»›i
-        K = 32  # K-factor
-        player1_id, player2_id = player_ids[0], player_ids[1]
-        r1, r2 = ratings[player1_id].rating, ratings[player2_id].rating
-        
-        # Expected scores
-        e1 = 1 / (1 + 10 ** ((r2 - r1) / 400))
-        e2 = 1 / (1 + 10 ** ((r1 - r2) / 400))
-        
-        # Actual scores
-        if winner_id == player1_id:
-            s1, s2 = 1.0, 0.0
-            ratings[player1_id].wins += 1
-            ratings[player2_id].losses += 1
-        elif winner_id == player2_id:
-            s1, s2 = 0.0, 1.0
-            ratings[player1_id].losses += 1
-            ratings[player2_id].wins += 1
-        else:
-            s1, s2 = 0.5, 0.5
-            ratings[player1_id].draws += 1
-            ratings[player2_id].draws += 1
-        
-        # Update ratings
-        new_r1 = int(r1 + K * (s1 - e1))
-        new_r2 = int(r2 + K * (s2 - e2))
-        
-        ratings[player1_id].rating = new_r1
-        ratings[player2_id].rating = new_r2
-        
-        # Tính rating changes
-        rating_changes = {
-            str(player1_id): new_r1 - r1,
-            str(player2_id): new_r2 - r2
-        }
-        
-        print(f"📈 New ratings: {player1_id}:{r1}->{new_r1} ({rating_changes[str(player1_id)]:+d}), {player2_id}:{r2}->{new_r2} ({rating_changes[str(player2_id)]:+d})")
-        
-        print(f"ðŸ’¾ Committing ratings...")
-        await db.commit()
-        print(f"âœ… Ratings committed!")
-        
-        return rating_changes
-        
+        # Đảm bảo mọi nước đi của trận đã được ghi trước khi chốt kết quả
+        await flush_move_batch(state.match_id)
+        rating_changes = await finish_match(state, db, winner_id)
     except Exception as e:
-        print(f"âŒ ERROR in update_ratings: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
+        log.warning("end_match_deferred", match_id=state.match_id, reason=reason, error=e)
         await db.rollback()
-        return {}
+        retry_after_flush(state.match_id, lambda: _retry_end_match(state, winner_id, result))
+        return
+
+    result["payload"]["rating_changes"] = rating_changes
+    await broadcast(state, result)
+
+async def _retry_end_match(state: RoomState, winner_id: int | None, result: dict):
+    """Move journal gọi lại sau khi flush; raise -> giữ trong hàng chờ, lần flush sau thử tiếp."""
+    async with state.lock:
+        await flush_move_batch(state.match_id)
+        async with AsyncSessionLocal() as db:
+            rating_changes = await finish_match(state, db, winner_id)
+        result["payload"]["rating_changes"] = rating_changes
+        await broadcast(state, result)
+
+async def finish_match(state: RoomState, db: AsyncSession, winner_id: int | None) -> dict:
+    """
+    Chốt kết quả trận + rating + stats trong 1 transaction (1 lần commit).
+    Returns: rating_changes {"user_id": delta}
+    """
+    now = datetime.now(timezone.utc)
+
+    # cập nhật match status, lấy luôn game_id
+    game_id = await db.scalar(
+        update(Match).where(Match.id == state.match_id).values(
+            status=MatchStatus.finished,
+            finished_at=now
+        ).returning(Match.game_id)
+    )
+
+    # Update winner/loser (hoặc hòa) trong 1 câu
+    if winner_id:
+        is_winner = case((MatchPlayer.user_id == winner_id, True), else_=False)
+    else:
+        is_winner = None
+    await db.execute(
+        update(MatchPlayer)
+        .where(MatchPlayer.match_id == state.match_id)
+        .values(is_winner=is_winner)
+    )
+
+    rating_changes, new_ratings = {}, {}
+    if game_id is not None:
+        rating_changes, new_ratings = await update_ratings(state, db, game_id, winner_id, now)
 
-async def handle_timeout(state: RoomState):
+    await db.commit()
+    log.info("match_finished", sample=LOG_SAMPLE_RATE,
+             match_id=state.match_id, game_id=game_id, winner_id=winner_id)
+
+    # Đồng bộ bảng rank trong Redis
+    if new_ratings:
+        await rank_service.sync_ratings(game_id, new_ratings)
+
+    return rating_changes
+
+async def update_ratings(state: RoomState, db: AsyncSession, game_id: int, winner_id: int | None, played_at: datetime):
+    """
+    Áp kết quả vào rating + stats qua rating engine (không commit, caller commit).
+    Returns: (rating_changes, new_ratings)
+    """
+    player_ids = list(state.players.keys())
+    if len(player_ids) != 2:
+        log.warning("ratings_skipped_player_count", match_id=state.match_id, players=len(player_ids))
+        return {}, {}
+
+    moves = {uid: state.board.count(sym) for uid, sym in state.players.items()}
+    rating_changes, new_ratings = await rating_engine.apply_match_result(
+        db, game_id, (player_ids[0], player_ids[1]), winner_id, moves, played_at
+    )
+    log.debug("ratings_updated", match_id=state.match_id, changes=rating_changes)
+    return rating_changes, new_ratings
+
+async def handle_timeout(state: RoomState, turn_no: int):
     """Xá»­ lÃ½ khi háº¿t thá»i gian - ngÆ°á»i chÆ¡i hiện tại thua."""
-    from app.core.database import AsyncSessionLocal, engine
-    from sqlalchemy import text
     
-    print(f"â° TIMEOUT for match {state.match_id}, current turn: {state.turn_symbol}")
+    log.debug("turn_timeout", match_id=state.match_id, turn_no=turn_no, symbol=state.turn_symbol)
     
     async with state.lock:
         if state.status != "playing":
-            print(f"âš ï¸  Match {state.match_id} not playing anymore, skip timeout")
+            log.debug("turn_timeout_skipped", match_id=state.match_id, status=state.status)
+            return
+        if state.turn_no != turn_no:
+            # Nước đi vừa tới trước khi timeout kịp lấy lock
             return
         
         state.status = "finished"
@@ -291,185 +349,237 @@ async def handle_timeout(state: RoomState):
             else:
                 winner_id = uid
         
-        print(f"â° Timeout: loser={loser_id}, winner={winner_id}")
-        
-        # Update trá»±c tiáº¿p báº±ng raw SQL Ä‘á»ƒ trÃ¡nh session issues
         try:
-            async with engine.begin() as conn:
-                now = datetime.now(timezone.utc)
-                
-                # Update match
-                await conn.execute(
-                    text("UPDATE matches SET status = 'finished', finished_at = :now WHERE id = :match_id"),
-                    {"now": now, "match_id": state.match_id}
-                )
-                print(f"âœ… Updated match {state.match_id} to finished")
-                
-                # Update winner
-                if winner_id:
-                    await conn.execute(
-                        text("UPDATE match_players SET is_winner = true WHERE match_id = :match_id AND user_id = :user_id"),
-                        {"match_id": state.match_id, "user_id": winner_id}
-                    )
-                    print(f"âœ… Set winner {winner_id}")
-                    
-                    # Update loser
-                    if loser_id:
-                        await conn.execute(
-                            text("UPDATE match_players SET is_winner = false WHERE match_id = :match_id AND user_id = :user_id"),
-                            {"match_id": state.match_id, "user_id": loser_id}
-                        )
-                        print(f"âœ… Set loser {loser_id}")
-                
-                print(f"âœ… Transaction committed for match {state.match_id}")
-            
-            # Update ratings sau khi commit match
+            # Chốt trận + rating (session riêng) rồi mới broadcast kết quả
             async with AsyncSessionLocal() as db:
-                rating_changes = await update_ratings(state, db, winner_id)
-            
-            # Broadcast káº¿t quáº£
-            await broadcast(state, {
-                "type": "timeout",
-                "payload": {
-                    "reason": "timeout",
-                    "winner_user_id": winner_id,
-                    "loser_user_id": loser_id,
-                    "rating_changes": rating_changes,
-                }
-            })
-            print(f"âœ… Timeout handled for match {state.match_id}")
-            
-        except Exception as e:
-            print(f"âŒ Error in handle_timeout: {e}")
-            import traceback
-            traceback.print_exc()
+                await end_match(state, db, winner_id, "timeout", {
+                    "type": "timeout",
+                    "payload": {
+                        "reason": "timeout",
+                        "winner_user_id": winner_id,
+                        "loser_user_id": loser_id,
+                    }
+                })
+            log.debug("turn_timeout_handled", match_id=state.match_id, winner_id=winner_id, loser_id=loser_id)
+
+        except Exception:
+            log.exception("turn_timeout_failed", match_id=state.match_id)
 
 async def start_turn_timer(state: RoomState):
-    """Báº¯t Ä‘áº§u Ä‘áº¿m thá»i gian cho lÆ°á»£t chÆ¡i."""
-    if state.timeout_task and not state.timeout_task.done():
-        state.timeout_task.cancel()
-    
-    state.turn_start_time = datetime.now(timezone.utc)
-    
-    async def timer():
-        try:
-            await asyncio.sleep(MOVE_TIMEOUT)
-            await handle_timeout(state)
-        except asyncio.CancelledError:
-            pass
-    
-    state.timeout_task = asyncio.create_task(timer())
+    """
+    Bắt đầu lượt mới: trừ giờ của người vừa đi (Fischer) và đặt deadline trong turn_scheduler.
+    """
+    now = datetime.now(timezone.utc)
+    if state.turn_start_time is not None and state.turn_no > 0:
+        # Người vừa đi là symbol khác với lượt hiện tại
+        mover = "O" if state.turn_symbol == "X" else "X"
+        elapsed = (now - state.turn_start_time).total_seconds()
+        state.time_control.consume(state.clocks, mover, elapsed)
 
-async def load_room_from_db(state: RoomState, db: AsyncSession):
-    """KhÃ´i phá»¥c bÃ n cá», lÆ°á»£t, tráº¡ng thÃ¡i tá»« DB (moves + match.status)."""
-    if state.loaded_from_db:
-        return
-    match = await db.scalar(select(Match).where(Match.id == state.match_id))
-    if not match:
+    state.turn_start_time = now
+    state.turn_limit = state.time_control.turn_limit(state.clocks, state.turn_symbol)
+
+    turn_no = state.turn_no
+    turn_scheduler.schedule(state.match_id, state.turn_limit, lambda: handle_timeout(state, turn_no))
+
+def resume_turn_timer(state: RoomState):
+    """
+    Room dựng từ snapshot: đặt lại deadline của lượt đang chạy.
+    Còn ít hơn RESTORE_GRACE giây (thời gian worker restart) thì được bù lên RESTORE_GRACE.
+    """
+    if state.status != "playing" or state.turn_start_time is None:
         return
-    state.status = match.status.value if hasattr(match.status, "value") else str(match.status)
-    
-    # load players vÃ  user info
-    mp_rows = (await db.execute(
-        select(MatchPlayer, User)
+    remaining = state.time_left() or 0
+    if remaining < RESTORE_GRACE:
+        remaining = min(RESTORE_GRACE, state.turn_limit)
+        state.turn_start_time = datetime.now(timezone.utc) - timedelta(seconds=state.turn_limit - remaining)
+    turn_no = state.turn_no
+    turn_scheduler.schedule(state.match_id, remaining, lambda: handle_timeout(state, turn_no))
+
+
+async def snapshot_live_rooms():
+    """Shutdown / worker bị recycle: ghi snapshot mới nhất của mọi trận chưa xong."""
+    for state in list(rooms.values()):
+        if state.status != "finished":
+            match_snapshots.mark_dirty(state.match_id, state.to_snapshot)
+    await match_snapshots.flush()
+
+
+async def find_match(match_id: int) -> Tuple[dict | None, dict | None]:
+    """
+    Room chưa có trong RAM: snapshot Redis (warm start, không chạm DB) hoặc record từ DB.
+    Returns: (snapshot, record); cả 2 None = trận không tồn tại.
+    """
+    snapshot = await match_snapshots.load(match_id)
+    if snapshot is not None:
+        return snapshot, None
+    async with AsyncSessionLocal() as db:
+        return None, await fetch_match_record(db, match_id)
+
+
+def install_room(match_id: int, snapshot: dict | None, record: dict | None) -> RoomState:
+    """Lấy room trong RAM, chưa có thì tạo từ snapshot (kèm deadline lượt) hoặc record DB."""
+    state = rooms.get(match_id)
+    if state is None:
+        if snapshot is not None:
+            state = RoomState.from_snapshot(snapshot)
+            match_snapshots.restored(match_id)
+            resume_turn_timer(state)
+            log.info("room_warm_started", match_id=match_id, turn_no=state.turn_no)
+        else:
+            state = RoomState(
+                match_id, record["board_rows"], record["board_cols"], record["win_len"],
+                TimeControl.from_dict(record["time_control"], MOVE_TIMEOUT),
+            )
+        rooms[match_id] = state
+    return state
+
+
+async def fetch_match_record(db: AsyncSession, match_id: int) -> dict | None:
+    """
+    Header trận + người chơi (username, avatar, rating) + toàn bộ moves trong 1 query.
+    Returns: dict (board_rows, board_cols, win_len, time_control, game_id, status, players, moves) hoặc None.
+    """
+    players = (
+        select(func.json_agg(func.json_build_object(
+            "user_id", MatchPlayer.user_id,
+            "symbol", MatchPlayer.symbol,
+            "username", User.username,
+            "avatar_url", User.avatar_url,
+            "rating", UserGameRating.rating,
+        )))
+        .select_from(MatchPlayer)
         .join(User, User.id == MatchPlayer.user_id)
-        .where(MatchPlayer.match_id == state.match_id)
-    )).all()
-    for mp, user in mp_rows:
-        state.players[mp.user_id] = mp.symbol
-        
-        # Lấy rating
-        rating = None
-        rating_obj = await db.scalar(
-            select(UserGameRating.rating)
-            .where(UserGameRating.user_id == mp.user_id)
-            .where(UserGameRating.game_id == match.game_id)
+        .outerjoin(
+            UserGameRating,
+            (UserGameRating.user_id == MatchPlayer.user_id) & (UserGameRating.game_id == Match.game_id),
         )
-        rating = rating_obj if rating_obj is not None else 1200
-        
-        state.player_info[mp.user_id] = {
-            "username": user.username,
-            "avatar_url": user.avatar_url,
-            "rating": rating,
+        .where(MatchPlayer.match_id == Match.id)
+        .correlate(Match)
+        .scalar_subquery()
+    )
+    moves = (
+        select(func.json_agg(aggregate_order_by(
+            func.json_build_array(Move.x, Move.y, Move.symbol, Move.turn_no), Move.turn_no.asc()
+        )))
+        .where(Move.match_id == Match.id)
+        .correlate(Match)
+        .scalar_subquery()
+    )
+    row = (await db.execute(
+        select(
+            Match.board_rows, Match.board_cols, Match.win_len, Match.game_id, Match.status,
+            Match.time_per_move, Match.time_initial, Match.time_increment,
+            type_coerce(players, JSON).label("players"),
+            type_coerce(moves, JSON).label("moves"),
+        ).where(Match.id == match_id)
+    )).mappings().first()
+    if row is None:
+        return None
+    record = dict(row)
+    record["status"] = record["status"].value if hasattr(record["status"], "value") else str(record["status"])
+    time_control = {
+        "per_move": record.pop("time_per_move"),
+        "initial": record.pop("time_initial"),
+        "increment": record.pop("time_increment"),
+    }
+    record["time_control"] = time_control if any(v is not None for v in time_control.values()) else None
+    for key in ("players", "moves"):
+        value = record[key]
+        record[key] = json.loads(value) if isinstance(value, str) else (value or [])
+    return record
+
+
+def hydrate_room(state: RoomState, record: dict):
+    """Khôi phục người chơi, bàn cờ, lượt, trạng thái từ fetch_match_record()."""
+    state.game_id = record["game_id"]
+    state.status = record["status"]
+    for player in record["players"]:
+        state.players[player["user_id"]] = player["symbol"]
+        state.player_info[player["user_id"]] = {
+            "username": player["username"],
+            "avatar_url": player["avatar_url"],
+            "rating": player["rating"] if player["rating"] is not None else 1200,
         }
-    
-    # load moves theo turn_no
-    mv_rows = (await db.execute(
-        select(Move).where(Move.match_id == state.match_id).order_by(Move.turn_no.asc())
-    )).scalars().all()
-    for mv in mv_rows:
-        if 0 <= mv.x < state.board_rows and 0 <= mv.y < state.board_cols and not state.board[mv.x][mv.y]:
-            state.board[mv.x][mv.y] = mv.symbol
-            state.turn_no = mv.turn_no
-            state.turn_symbol = 'O' if mv.symbol == 'X' else 'X'
+    for x, y, symbol, turn_no in record["moves"]:
+        if state.board.in_bounds(x, y) and state.board.is_empty(x, y):
+            state.board.place(x, y, symbol)
+            state.turn_no = turn_no
+            state.turn_symbol = 'O' if symbol == 'X' else 'X'
     state.loaded_from_db = True
 
+
+async def load_player_info(db: AsyncSession, user_id: int, game_id: int | None) -> dict | None:
+    """username / avatar_url (auth cache, thường không chạm DB) + rating của game hiện tại."""
+    user = await get_user_projection(db, user_id)
+    if user is None:
+        return None
+    rating = await db.scalar(
+        select(UserGameRating.rating)
+        .where(UserGameRating.user_id == user_id)
+        .where(UserGameRating.game_id == game_id)
+    )
+    return {
+        "username": user["username"],
+        "avatar_url": user["avatar_url"],
+        "rating": rating if rating is not None else 1200,
+    }
+
+
+async def load_room_from_db(state: RoomState, db: AsyncSession, record: dict | None = None):
+    """Khôi phục room từ DB (1 query). `record`: kết quả fetch_match_record() đã có sẵn."""
+    if state.loaded_from_db:
+        return
+    if record is None:
+        record = await fetch_match_record(db, state.match_id)
+    if record is None:
+        return
+    hydrate_room(state, record)
+
 # â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 # WebSocket handler
 # â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
-@router.websocket("/match/{match_id}")
-async def websocket_match(
-    websocket: WebSocket,
-    match_id: int,
-    token: str = Query(...),
-    db: AsyncSession = Depends(get_db),
-):
-    # 1) Auth
-    try:
-        user_id = await decode_token(token)
-    except ValueError:
-        await websocket.close(code=4001)
-        return
+def resync_data(state: RoomState, user_id: int, since: int | None, epoch: str | None) -> str:
+    """Event từ `since` nếu còn trong ring buffer, không thì snapshot đầy đủ (đã serialize)."""
+    if since is not None:
+        events = state.events_since(since, epoch)
+        if events is not None:
+            return state.resync_message(since, events)
+    return json.dumps(state.snapshot(user_id))
 
-    await websocket.accept()
 
-    # 2) Match tá»“n táº¡i khÃ´ng?
-    match_obj = await db.scalar(select(Match).where(Match.id == match_id))
-    if not match_obj:
-        await websocket.send_text(json.dumps({"type": "error", "payload": "Match not found"}))
-        await websocket.close()
-        return
+async def send_resync(state: RoomState, websocket, user_id: int, since: int | None, epoch: str | None):
+    """Gửi resync / snapshot; gọi khi đang giữ state.lock để không xen với broadcast."""
+    await websocket.send_text(resync_data(state, user_id, since, epoch))
 
-    # 3) Lấy / Tạo room + khÃ´i phá»¥c bÃ n tá»« DB náº¿u cáº§n
-    if match_id not in rooms:
-        rooms[match_id] = RoomState(match_id, match_obj.board_rows, match_obj.board_cols, match_obj.win_len)
-    state = rooms[match_id]
-    await load_room_from_db(state, db)
 
-    conn = Connection(websocket, user_id)
+async def join_match(
+    state: RoomState, conn: Connection, db: AsyncSession,
+    since: int | None = None, epoch: str | None = None,
+):
+    """
+    Đưa connection vào room: gán quân, chuyển playing khi đủ 2 người.
+    Reconnect có `since` + `epoch` -> chỉ gửi các event bị lỡ; ngược lại gửi snapshot.
+    """
+    user_id = conn.user_id
+    match_id = state.match_id
 
-    # 4) Join room
     async with state.lock:
         # Náº¿u user Ä'Ã£ cÃ³ connection cÅ© (reconnect), Ä'Ã³ng connection cÅ© 
         if user_id in state.connections:
             old_conn = state.connections[user_id]
+            old_conn.outbox.close()
             try:
                 await old_conn.ws.close()
-                print(f"🔄 Closed old connection for user {user_id}")
+                log.debug("old_connection_closed", match_id=match_id, user_id=user_id)
             except Exception as e:
-                print(f"⚠️ Failed to close old connection: {e}")
-        
-        state.connections[user_id] = conn
+                log.debug("old_connection_close_failed", match_id=match_id, user_id=user_id, error=e)
 
-        # Lấy thÃ´ng tin user náº¿u chÆ°a cÃ³
+        # Thông tin người mới vào: profile lấy từ auth cache, rating 1 query
         if user_id not in state.player_info:
-            user_obj = await db.scalar(select(User).where(User.id == user_id))
-            if user_obj:
-                # Lấy rating cho game hiện tại
-                from app.models.models import Game
-                rating = None
-                rating_obj = await db.scalar(
-                    select(UserGameRating.rating)
-                    .where(UserGameRating.user_id == user_id)
-                    .where(UserGameRating.game_id == match_obj.game_id)
-                )
-                rating = rating_obj if rating_obj is not None else 1200
-                
-                state.player_info[user_id] = {
-                    "username": user_obj.username,
-                    "avatar_url": user_obj.avatar_url,
-                    "rating": rating,
-                }
+            info = await load_player_info(db, user_id, state.game_id)
+            if info:
+                state.player_info[user_id] = info
 
         # Chá»‰ cho tá»'i Ä'a 2 player cáº§m quÃ¢n (cÃ²n láº¡i lÃ  spectator)
         if user_id not in state.players and len(state.players) < 2 and state.status != "finished":
@@ -511,306 +621,572 @@ async def websocket_match(
                 "payload": {
                     "turn": state.turn_symbol,
                     "players": players_with_info,
-                    "time_limit": MOVE_TIMEOUT,
+                    "time_limit": state.turn_limit,
+                    "clocks": state.clocks,
                 },
             })
 
-    # Gá»­i snapshot cho client vá»«a join
-    await websocket.send_text(json.dumps(state.snapshot(user_id)))
+        # Xếp snapshot / resync vào outbox rồi đăng ký connection, không await ở giữa:
+        # broadcast không chen được vào giữa -> client không lỡ cũng không nhận trùng event
+        conn.outbox.send(resync_data(state, user_id, since, epoch))
+        state.connections[user_id] = conn
+
+
+async def handle_match_message(state: RoomState, conn: Connection, raw: str, db: AsyncSession):
+    """Xử lý 1 message của client trong trận (local socket hoặc proxy từ worker khác)."""
+    received = time.perf_counter()
+    websocket = conn.outbox  # trả lời cùng hàng đợi với broadcast để giữ thứ tự
+    user_id = conn.user_id
+    match_id = state.match_id
 
-    # 5) Main loop
     try:
-        while True:
-            raw = await websocket.receive_text()
-            try:
-                msg = json.loads(raw)
-            except Exception:
-                await websocket.send_text(json.dumps({"type": "error", "payload": "Invalid JSON"}))
-                continue
+        msg = json.loads(raw)
+    except Exception:
+        await websocket.send_text(json.dumps({"type": "error", "payload": "Invalid JSON"}))
+        return
 
-            mtype = msg.get("type")
-            payload = msg.get("payload", {})
+    mtype = msg.get("type")
+    payload = msg.get("payload", {})
 
-            async with state.lock:
-                # Ä‘Ã£ káº¿t thÃºc thÃ¬ chá»‰ cho chat
-                if mtype == "move" and state.status != "playing":
-                    await websocket.send_text(json.dumps({"type":"error","payload":"Match is not in playing state"}))
-                    continue
+    async with state.lock:
+        # Ä‘Ã£ káº¿t thÃºc thÃ¬ chá»‰ cho chat
+        if mtype == "move" and state.status != "playing":
+            await websocket.send_text(json.dumps({"type":"error","payload":"Match is not in playing state"}))
+            return
 
-                if mtype == "move":
-                    # ✅ Rate limiting: Giới hạn 1 move/giây để tránh spam
-                    from app.api.realtime_helpers import check_rate_limit
-                    if not check_rate_limit(user_id, min_interval=1.0):
-                        await websocket.send_text(json.dumps({
+        if mtype == "move":
+            # ✅ Rate limiting: Giới hạn 1 move/giây để tránh spam
+            from app.api.realtime_helpers import check_rate_limit
+            if not check_rate_limit(user_id, min_interval=1.0):
+                await websocket.send_text(json.dumps({
+                    "type": "error",
+                    "payload": "Too fast! Wait 1 second between moves"
+                }))
+                return
+            
+            if state.status != "playing":
+                await websocket.send_text(
+                    json.dumps({
                             "type": "error",
-                            "payload": "Too fast! Wait 1 second between moves"
-                        }))
-                        continue
-                    
-                    if state.status != "playing":
-                        await websocket.send_text(
-                            json.dumps({
-                                    "type": "error",
-                                    "payload": "Match already finished"
-                            })
-                        )
-                        continue
-                    sym = state.players.get(user_id)
-                    if sym not in ("X","O"):
-                        await websocket.send_text(json.dumps({"type":"error","payload":"Spectator cannot move"}))
-                        continue
-                    if sym != state.turn_symbol:
-                        await websocket.send_text(json.dumps({"type":"error","payload":"Not your turn"}))
-                        continue
-
-                    try:
-                        x = int(payload["x"]); y = int(payload["y"])
-                    except Exception:
-                        await websocket.send_text(json.dumps({"type":"error","payload":"Invalid coordinates"}))
-                        continue
-
-                    if not (0 <= x < state.board_rows and 0 <= y < state.board_cols) or state.board[x][y]:
-                        await websocket.send_text(json.dumps({"type":"error","payload":"Invalid cell"}))
-                        continue
-
-                    # Apply move
-                    state.board[x][y] = sym
-                    state.turn_no += 1
-
-                    await db.execute(insert(Move).values(
-                        match_id=match_id, turn_no=state.turn_no, user_id=user_id, x=x, y=y, symbol=sym
-                    ))
-                    await db.commit()
-
-                    # Win / Draw
-                    win_line = check_win(state.board, x, y, state.win_len, sym)
-                    if win_line:
-                        rating_changes = await end_match(state, db, user_id, "win")
-                        
-                        await broadcast(state, {
-                            "type": "win",
-                            "payload": {
-                                "winner_user_id": user_id,
-                                "symbol": sym,
-                                "line": [{"x": i, "y": j} for i, j in win_line],
-                                "rating_changes": rating_changes,
-                            },
-                        })
-                    elif state.turn_no == state.board_rows * state.board_cols:
-                        rating_changes = await end_match(state, db, None, "draw")
-                        await broadcast(state, {
-                            "type": "draw",
-                            "payload": {
-                                "reason": "board_full",
-                                "rating_changes": rating_changes,
-                            }
-                        })
-                    else:
-                        # Chuyá»ƒn lÆ°á»£t
-                        state.turn_symbol = "O" if sym == "X" else "X"
-                        await start_turn_timer(state)
-                        
-                        await broadcast(state, {
-                            "type": "move",
-                            "payload": {
-                                "x": x, "y": y, "symbol": sym,
-                                "turn_no": state.turn_no,
-                                "next_turn": state.turn_symbol,
-                                "time_limit": MOVE_TIMEOUT,
-                            },
-                        })
-
-                elif mtype == "surrender":
-                    # Äáº§u hÃ ng - Ä‘á»‘i thá»§ tháº¯ng
-                    if user_id not in state.players:
-                        await websocket.send_text(json.dumps({"type":"error","payload":"You are not a player"}))
-                        continue
-                    
-                    if state.status != "playing":
-                        await websocket.send_text(json.dumps({"type":"error","payload":"Match is not playing"}))
-                        continue
-                    
-                    # TÃ¬m Ä‘á»‘i thá»§
-                    winner_id = None
-                    for uid in state.players.keys():
-                        if uid != user_id:
-                            winner_id = uid
-                            break
-                    
-                    rating_changes = await end_match(state, db, winner_id, "surrender")
-                    
-                    await broadcast(state, {
-                        "type": "surrender",
-                        "payload": {
-                            "surrendered_user_id": user_id,
-                            "winner_user_id": winner_id,
-                            "rating_changes": rating_changes,
-                        },
+                            "payload": "Match already finished"
                     })
+                )
+                return
+            sym = state.players.get(user_id)
+            if sym not in ("X","O"):
+                await websocket.send_text(json.dumps({"type":"error","payload":"Spectator cannot move"}))
+                return
+            if sym != state.turn_symbol:
+                await websocket.send_text(json.dumps({"type":"error","payload":"Not your turn"}))
+                return
 
-                elif mtype == "chat":
-                    msgtxt = str(payload.get("message","")).strip()
-                    if not msgtxt:
-                        continue
-                    if len(msgtxt) > 300:
-                        msgtxt = msgtxt[:300]
-                    await broadcast(state, {
-                        "type": "chat",
-                        "payload": {
-                            "from": user_id,
-                            "message": msgtxt,
-                            "time": datetime.now(timezone.utc).isoformat(),
-                        },
-                    })
+            try:
+                x = int(payload["x"]); y = int(payload["y"])
+            except Exception:
+                await websocket.send_text(json.dumps({"type":"error","payload":"Invalid coordinates"}))
+                return
+
+            if not state.board.in_bounds(x, y) or not state.board.is_empty(x, y):
+                await websocket.send_text(json.dumps({"type":"error","payload":"Invalid cell"}))
+                return
+
+            validated = time.perf_counter()
+
+            # Apply move
+            state.board.place(x, y, sym)
+            state.turn_no += 1
+            state.last_move = {"x": x, "y": y, "symbol": sym}
+
+            # Ghi vào move journal, background task sẽ bulk insert
+            await add_move_to_batch(match_id, state.turn_no, user_id, x, y, sym)
+            persisted = time.perf_counter()
+
+            # Win / Draw
+            win_line = state.board.winning_line(x, y)
+            outcome = "win" if win_line else "draw" if state.board.is_full() else "move"
+            if win_line:
+                await end_match(state, db, user_id, "win", {
+                    "type": "win",
+                    "payload": {
+                        "winner_user_id": user_id,
+                        "symbol": sym,
+                        "line": [{"x": i, "y": j} for i, j in win_line],
+                    },
+                })
+            elif state.board.is_full():
+                await end_match(state, db, None, "draw", {
+                    "type": "draw",
+                    "payload": {
+                        "reason": "board_full",
+                    }
+                })
+            else:
+                # Chuyá»ƒn lÆ°á»£t
+                state.turn_symbol = "O" if sym == "X" else "X"
+                await start_turn_timer(state)
+                
+                await broadcast(state, {
+                    "type": "move",
+                    "payload": {
+                        "x": x, "y": y, "symbol": sym,
+                        "turn_no": state.turn_no,
+                        "next_turn": state.turn_symbol,
+                        "time_limit": state.turn_limit,
+                        "clocks": state.clocks,
+                    },
+                })
 
-                elif mtype == "ping":
-                    await websocket.send_text(json.dumps({"type":"pong"}))
+            done = time.perf_counter()
+            metrics.MOVE_STAGE_SECONDS.observe(validated - received, stage="validate", outcome=outcome)
+            metrics.MOVE_STAGE_SECONDS.observe(persisted - validated, stage="persist", outcome=outcome)
+            metrics.MOVE_STAGE_SECONDS.observe(done - persisted, stage="broadcast", outcome=outcome)
+            metrics.MOVE_STAGE_SECONDS.observe(done - received, stage="total", outcome=outcome)
+            if done - received >= SLOW_MOVE_SECONDS:
+                log.warning(
+                    "slow_move", match_id=state.match_id, turn_no=state.turn_no, outcome=outcome,
+                    validate_ms=round((validated - received) * 1000, 1),
+                    persist_ms=round((persisted - validated) * 1000, 1),
+                    broadcast_ms=round((done - persisted) * 1000, 1),
+                )
 
-                elif mtype == "rematch":
-                    # YÃªu cáº§u chÆ¡i láº¡i
-                    if user_id not in state.players:
-                        await websocket.send_text(json.dumps({"type":"error","payload":"You are not a player"}))
-                        continue
+        elif mtype == "surrender":
+            # Äáº§u hÃ ng - Ä‘á»‘i thá»§ tháº¯ng
+            if user_id not in state.players:
+                await websocket.send_text(json.dumps({"type":"error","payload":"You are not a player"}))
+                return
+            
+            if state.status != "playing":
+                await websocket.send_text(json.dumps({"type":"error","payload":"Match is not playing"}))
+                return
+            
+            # TÃ¬m Ä‘á»‘i thá»§
+            winner_id = None
+            for uid in state.players.keys():
+                if uid != user_id:
+                    winner_id = uid
+                    break
+            
+            await end_match(state, db, winner_id, "surrender", {
+                "type": "surrender",
+                "payload": {
+                    "surrendered_user_id": user_id,
+                    "winner_user_id": winner_id,
+                },
+            })
+
+        elif mtype == "chat":
+            msgtxt = str(payload.get("message","")).strip()
+            if not msgtxt:
+                return
+            if len(msgtxt) > 300:
+                msgtxt = msgtxt[:300]
+            await broadcast(state, {
+                "type": "chat",
+                "payload": {
+                    "from": user_id,
+                    "message": msgtxt,
+                    "time": datetime.now(timezone.utc).isoformat(),
+                },
+            })
+
+        elif mtype == "ping":
+            await websocket.send_text(json.dumps({"type":"pong"}))
+
+        elif mtype == "resync":
+            # Client phát hiện lỗ hổng seq -> xin lại event từ N
+            since = payload.get("since") if isinstance(payload, dict) else None
+            epoch = payload.get("epoch") if isinstance(payload, dict) else None
+            await send_resync(state, websocket, user_id, since if isinstance(since, int) else None, epoch)
+
+        elif mtype == "rematch":
+            # YÃªu cáº§u chÆ¡i láº¡i
+            if user_id not in state.players:
+                await websocket.send_text(json.dumps({"type":"error","payload":"You are not a player"}))
+                return
+            
+            if state.status != "finished":
+                await websocket.send_text(json.dumps({"type":"error","payload":"Match is not finished yet"}))
+                return
+            
+            # ThÃªm user vÃ o danh sÃ¡ch yÃªu cáº§u rematch
+            state.rematch_requests.add(user_id)
+            
+            # Broadcast yÃªu cáº§u rematch
+            await broadcast(state, {
+                "type": "rematch_request",
+                "payload": {
+                    "from_user_id": user_id,
+                    "total_requests": len(state.rematch_requests),
+                    "total_players": len(state.players)
+                }
+            })
+            
+            # Náº¿u cáº£ 2 ngÆ°á»i chÆ¡i Ä‘á»u Ä‘á»“ng Ã½ -> Tạo tráº­n má»›i
+            if len(state.rematch_requests) == len(state.players) and len(state.players) == 2:
+                # Tạo match má»›i
+                game = await get_game(db, "Caro")
+                if game:
+                    new_match = Match(
+                        game_id=game.id,
+                        board_rows=state.board_rows,
+                        board_cols=state.board_cols,
+                        win_len=state.win_len,
+                        time_per_move=state.time_control.per_move,
+                        time_initial=state.time_control.initial,
+                        time_increment=state.time_control.increment,
+                        status=MatchStatus.waiting,
+                        created_at=datetime.now(timezone.utc),
+                    )
+                    db.add(new_match)
+                    await db.flush()
+                    
+                    new_match_id = new_match.id
                     
-                    if state.status != "finished":
-                        await websocket.send_text(json.dumps({"type":"error","payload":"Match is not finished yet"}))
-                        continue
+                    # KHÃNG thÃªm players tá»± Ä'á»™ng - Ä'á»ƒ clients tá»± join khi reconnect
+                    # VÃ¬ náº¿u thÃªm sáºµn 2 players, client thá»© 2 join sáº½ trigger "playing" ngay
                     
-                    # ThÃªm user vÃ o danh sÃ¡ch yÃªu cáº§u rematch
-                    state.rematch_requests.add(user_id)
+                    await db.commit()
                     
-                    # Broadcast yÃªu cáº§u rematch
+                    # Broadcast thÃ´ng bÃ¡o match má»›i
                     await broadcast(state, {
-                        "type": "rematch_request",
+                        "type": "rematch_accepted",
                         "payload": {
-                            "from_user_id": user_id,
-                            "total_requests": len(state.rematch_requests),
-                            "total_players": len(state.players)
+                            "new_match_id": new_match_id,
+                            "message": "Both players accepted! New match created."
                         }
                     })
                     
-                    # Náº¿u cáº£ 2 ngÆ°á»i chÆ¡i Ä‘á»u Ä‘á»“ng Ã½ -> Tạo tráº­n má»›i
-                    if len(state.rematch_requests) == len(state.players) and len(state.players) == 2:
-                        # Tạo match má»›i
-                        from app.models.models import Game
-                        
-                        game = await db.scalar(select(Game).where(Game.name == "Caro"))
-                        if game:
-                            new_match = Match(
-                                game_id=game.id,
-                                board_rows=state.board_rows,
-                                board_cols=state.board_cols,
-                                win_len=state.win_len,
-                                status=MatchStatus.waiting,
-                                created_at=datetime.now(timezone.utc),
-                            )
-                            db.add(new_match)
-                            await db.flush()
-                            
-                            new_match_id = new_match.id
-                            
-                            # KHÃNG thÃªm players tá»± Ä'á»™ng - Ä'á»ƒ clients tá»± join khi reconnect
-                            # VÃ¬ náº¿u thÃªm sáºµn 2 players, client thá»© 2 join sáº½ trigger "playing" ngay
-                            
-                            await db.commit()
-                            
-                            # Broadcast thÃ´ng bÃ¡o match má»›i
-                            await broadcast(state, {
-                                "type": "rematch_accepted",
-                                "payload": {
-                                    "new_match_id": new_match_id,
-                                    "message": "Both players accepted! New match created."
-                                }
-                            })
-                            
-                            print(f"ðŸ”„ Rematch created: {state.match_id} -> {new_match_id}")
-
-                else:
-                    await websocket.send_text(json.dumps({"type":"error","payload":f"Unknown type: {mtype}"}))
+                    log.debug("rematch_created", match_id=state.match_id, new_match_id=new_match_id)
 
-    except WebSocketDisconnect:
-        async with state.lock:
-            state.connections.pop(user_id, None)
+        else:
+            await websocket.send_text(json.dumps({"type":"error","payload":f"Unknown type: {mtype}"}))
+
+
+async def leave_match(state: RoomState, conn: Connection, db: AsyncSession, handoff: bool = False):
+    """
+    Client rời trận: xử thua nếu đang chơi, báo đối thủ, dọn phòng khi hết người.
+    handoff=True (socket đóng vì server restart / worker đang drain): chỉ gỡ connection,
+    người chơi kết nối lại trước khi hết lượt thì chơi tiếp.
+    """
+    user_id = conn.user_id
+    match_id = state.match_id
+
+    async with state.lock:
+        # Connection cũ đã bị thay bởi reconnect -> không tính là rời trận
+        if state.connections.get(user_id) is not conn:
+            return
+        state.connections.pop(user_id, None)
+        conn.outbox.close()
+
+        if (handoff or drain.is_draining()) and state.status == "playing":
+            log.debug("player_handed_off", match_id=match_id, user_id=user_id)
+            return
+        
+        # Náº¿u ngÆ°á»i chÆ¡i disconnect khi Ä‘ang chÆ¡i -> Ä‘á»‘i thá»§ tháº¯ng
+        if state.status == "playing" and user_id in state.players:
+            # TÃ¬m Ä‘á»‘i thá»§
+            winner_id = None
+            for uid in state.players.keys():
+                if uid != user_id:
+                    winner_id = uid
+                    break
             
-            # Náº¿u ngÆ°á»i chÆ¡i disconnect khi Ä‘ang chÆ¡i -> Ä‘á»‘i thá»§ tháº¯ng
-            if state.status == "playing" and user_id in state.players:
-                # TÃ¬m Ä‘á»‘i thá»§
-                winner_id = None
-                for uid in state.players.keys():
-                    if uid != user_id:
-                        winner_id = uid
-                        break
-                
-                if winner_id:
-                    rating_changes = await end_match(state, db, winner_id, "disconnect")
-                    
-                    await broadcast(state, {
-                        "type": "disconnect",
-                        "payload": {
-                            "disconnected_user_id": user_id,
-                            "winner_user_id": winner_id,
-                            "reason": "Player disconnected",
-                            "rating_changes": rating_changes,
-                        }
-                    })
+            if winner_id:
+                await end_match(state, db, winner_id, "disconnect", {
+                    "type": "disconnect",
+                    "payload": {
+                        "disconnected_user_id": user_id,
+                        "winner_user_id": winner_id,
+                        "reason": "Player disconnected",
+                    }
+                })
 
+        
+        # 🚨 CRITICAL: Nếu match đã finished và player disconnect -> notify opponent
+        elif state.status == "finished":
+            log.debug("player_left_finished_match", match_id=state.match_id, user_id=user_id)
             
-            # 🚨 CRITICAL: Nếu match đã finished và player disconnect -> notify opponent
-            elif state.status == "finished":
-                print(f"👋 User {user_id} left finished match {state.match_id}")
+            # Gửi player_left cho tất cả players còn lại
+            await broadcast(state, {
+                "type": "player_left",
+                "payload": {
+                    "user_id": user_id,
+                    "match_id": state.match_id
+                }
+            })
+            
+            # Nếu có pending rematch request -> cancel
+            if user_id in state.rematch_requests:
+                state.rematch_requests.discard(user_id)
                 
-                # Gửi player_left cho tất cả players còn lại
                 await broadcast(state, {
-                    "type": "player_left",
+                    "type": "rematch_cancelled",
                     "payload": {
-                        "user_id": user_id,
-                        "match_id": state.match_id
+                        "reason": "player_left",
+                        "left_user_id": user_id
                     }
                 })
-                
-                # Nếu có pending rematch request -> cancel
-                if user_id in state.rematch_requests:
-                    state.rematch_requests.discard(user_id)
-                    
-                    await broadcast(state, {
-                        "type": "rematch_cancelled",
-                        "payload": {
-                            "reason": "player_left",
-                            "left_user_id": user_id
-                        }
-                    })
-                    print(f"❌ Rematch cancelled because user {user_id} left")
-
-            # Nếu tất cả đều rời -> dọn phòng sau 3s
-            if not state.connections and state.status == "finished":
-                async def cleanup_room():
-                    await asyncio.sleep(3)
-                    rooms.pop(match_id, None)
-                    print(f"ðŸ§¹ Room {match_id} cleaned up after all players left.")
-                
-                asyncio.create_task(cleanup_room())
+                log.debug("rematch_cancelled", match_id=state.match_id, left_user_id=user_id)
+
+        # Nếu tất cả đều rời -> dọn phòng sau 3s
+        if not state.connections and state.status == "finished":
+            async def cleanup_room():
+                await asyncio.sleep(3)
+                rooms.pop(match_id, None)
+                turn_scheduler.cancel(match_id)
+                await spectators.close_feed(match_id)
+                await match_snapshots.discard(match_id)
+                await match_bus.release_match(match_id)
+                log.debug("room_cleaned_up", match_id=match_id)
+            
+            asyncio.create_task(cleanup_room())
 
-    except Exception as e:
-        print(f"âŒ Error in websocket handler: {e}")
+
+async def reject_draining(websocket):
+    """Worker đang drain: báo client kết nối lại (lần sau vào worker khác)."""
+    try:
+        await websocket.send_text(drain.reconnect_message())
+        await websocket.close(code=drain.CLOSE_CODE_RESTART)
+    except Exception:
+        pass
+
+
+async def handoff_rooms():
+    """
+    Shutdown: ghi snapshot (kèm deadline lượt) của mọi trận chưa xong, rồi báo các client
+    còn nối (qua worker khác) kết nối lại. Gọi sau khi đã dừng turn_scheduler.
+    """
+    await snapshot_live_rooms()
+    for state in list(rooms.values()):
+        for conn in list(state.connections.values()):
+            conn.outbox.close()
+            await reject_draining(conn.ws)
+        state.connections.clear()
+    log.info("rooms_handed_off", rooms=len(rooms))
+
+
+async def proxy_match_connection(
+    websocket: WebSocket, match_id: int, user_id: int, owner: str,
+    since: int | None = None, epoch: str | None = None,
+) -> bool:
+    """
+    Trận đang được host ở worker khác: chuyển tiếp message của client qua match bus.
+    Returns: False nếu owner đã chết và worker này vừa tiếp quản (caller host local).
+    """
+    conn_id = match_bus.new_conn_id()
+    base = {"user_id": user_id, "conn_id": conn_id}
+    match_bus.register_local_socket(conn_id, websocket)
+    try:
+        for _ in range(2):
+            if await match_bus.send_to_owner(match_id, {**base, "kind": "join", "since": since, "epoch": epoch}):
+                break
+            # Không ai nghe inbox -> owner cũ đã chết, tiếp quản
+            owner = await match_bus.take_over(match_id, owner)
+            if owner == match_bus.WORKER_ID:
+                return False
+        else:
+            await websocket.send_text(json.dumps({"type": "error", "payload": "Match host unavailable"}))
+            await websocket.close()
+            return True
+
+        try:
+            while True:
+                raw = await websocket.receive_text()
+                await match_bus.send_to_owner(match_id, {**base, "kind": "message", "raw": raw})
+        except Exception as e:
+            handoff = isinstance(e, WebSocketDisconnect) and drain.is_restart_close(e.code)
+            await match_bus.send_to_owner(match_id, {**base, "kind": "leave", "handoff": handoff})
+        return True
+    finally:
+        match_bus.unregister_local_socket(conn_id)
+
+
+async def handle_remote_event(match_id: int, event: dict):
+    """Worker owner xử lý event join/message/leave do proxy (hoặc spectate) ở worker khác gửi tới."""
+
+    kind = event.get("kind")
+    if kind == "spectate":
+        state = rooms.get(match_id)
+        if state is not None:
+            spectators.request_frame(match_id, state.spectator_frame)
+        return
+    user_id = int(event["user_id"])
+    conn_id = event["conn_id"]
+
+    async with AsyncSessionLocal() as db:
+        if kind == "join":
+            remote_ws = match_bus.RemoteSocket(event["worker_id"], conn_id)
+            if drain.is_draining():
+                await reject_draining(remote_ws)
+                return
+            state = rooms.get(match_id)
+            snapshot = record = None
+            if state is None:
+                snapshot, record = await find_match(match_id)
+            elif not state.loaded_from_db:
+                record = await fetch_match_record(db, match_id)
+            if snapshot is None and record is None and (state is None or not state.loaded_from_db):
+                await remote_ws.send_text(json.dumps({"type": "error", "payload": "Match not found"}))
+                await remote_ws.close()
+                return
+            state = install_room(match_id, snapshot, record)
+            await load_room_from_db(state, db, record)
+            await join_match(
+                state, Connection(remote_ws, user_id), db,
+                since=event.get("since"), epoch=event.get("epoch"),
+            )
+            return
+
+        state = rooms.get(match_id)
+        if state is None:
+            return
+        conn = state.connections.get(user_id)
+        if conn is None or getattr(conn.ws, "conn_id", None) != conn_id:
+            return
+        if kind == "message":
+            await handle_match_message(state, conn, event.get("raw", ""), db)
+        elif kind == "leave":
+            await leave_match(state, conn, db, handoff=bool(event.get("handoff")))
+
+
+@router.websocket("/match/{match_id}")
+async def websocket_match(
+    websocket: WebSocket,
+    match_id: int,
+    token: str = Query(...),
+    since: int | None = Query(None, description="seq cuối client đã nhận (reconnect)"),
+    epoch: str | None = Query(None, description="epoch của room lúc nhận seq đó"),
+):
+    # Không giữ AsyncSession suốt vòng đời socket: mỗi đoạn cần DB mở session ngắn
+    # (connection chỉ bị giữ trong lúc query), số socket không còn bị giới hạn bởi pool.
+
+    # 1) Auth
+    try:
+        user_id = await decode_token(token)
+    except ValueError:
+        await websocket.close(code=4001)
+        return
+
+    await websocket.accept()
+    if drain.is_draining():
+        await reject_draining(websocket)
+        return
+
+    # 2) Match tồn tại không? Room đã có trong RAM thì không cần DB;
+    #    chưa có -> snapshot Redis (warm start) hoặc header + người chơi + moves trong 1 query
+    state = rooms.get(match_id)
+    snapshot = record = None
+    if state is None:
+        snapshot, record = await find_match(match_id)
+    elif not state.loaded_from_db:
+        async with AsyncSessionLocal() as db:
+            record = await fetch_match_record(db, match_id)
+    if snapshot is None and record is None and (state is None or not state.loaded_from_db):
+        await websocket.send_text(json.dumps({"type": "error", "payload": "Match not found"}))
+        await websocket.close()
+        return
+
+    # 3) Trận đang được host ở worker khác -> làm proxy qua match bus
+    owner = await match_bus.claim_match(match_id)
+    if owner != match_bus.WORKER_ID:
+        if await proxy_match_connection(websocket, match_id, user_id, owner, since, epoch):
+            return
+
+    # 4) Lấy / Tạo room + khÃ´i phá»¥c bÃ n tá»« DB náº¿u cáº§n
+    if match_id not in rooms and snapshot is None and record is None:
+        # Room vừa bị dọn trong lúc claim -> đọc lại
+        snapshot, record = await find_match(match_id)
+        if snapshot is None and record is None:
+            await websocket.close()
+            return
+    state = install_room(match_id, snapshot, record)
+    conn = Connection(websocket, user_id)
+
+    # 5) Join room (reconnect có since -> chỉ nhận event bị lỡ)
+    async with AsyncSessionLocal() as db:
+        await load_room_from_db(state, db, record)
+        await join_match(state, conn, db, since, epoch)
+
+    # 6) Main loop
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            # Session chỉ lấy connection khi thực sự query (phần lớn nước đi không chạm DB)
+            async with AsyncSessionLocal() as db:
+                await handle_match_message(state, conn, raw, db)
+
+    except WebSocketDisconnect as e:
+        async with AsyncSessionLocal() as db:
+            await leave_match(state, conn, db, handoff=drain.is_restart_close(e.code))
+
+    except Exception:
+        log.exception("match_socket_failed", match_id=match_id, user_id=user_id)
         async with state.lock:
-            state.connections.pop(user_id, None)
+            if state.connections.get(user_id) is conn:
+                state.connections.pop(user_id, None)
+                conn.outbox.close()
 
 # Note: Removed the redundant cleanup at the end since it's now handled in disconnect
 
 
+@router.websocket("/match/{match_id}/spectate")
+async def websocket_spectate(
+    websocket: WebSocket,
+    match_id: int,
+    token: str = Query(...),
+):
+    """
+    Xem trận (read-only). Không join state.connections, không query DB:
+    nhận frame "spectate" gộp tối đa mỗi SPECTATOR_FRAME_INTERVAL giây.
+    """
+    try:
+        user_id = await decode_token(token)
+    except ValueError:
+        await websocket.close(code=4001)
+        return
+
+    await websocket.accept()
+
+    state = rooms.get(match_id)
+    frame = state.spectator_frame() if state is not None else None
+    outbox = await spectators.subscribe(match_id, websocket, user_id, frame)
+    if outbox is None:
+        await websocket.send_text(json.dumps({"type": "error", "payload": "Match is not live"}))
+        await websocket.close()
+        return
+
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                msg = json.loads(raw)
+            except Exception:
+                continue
+            if msg.get("type") == "ping":
+                outbox.send(json.dumps({"type": "pong"}))
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        log.exception("spectator_socket_failed", match_id=match_id)
+    finally:
+        await spectators.unsubscribe(match_id, outbox)
+
+
 # â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 # Matchmaking WebSocket - Ä‘á»ƒ thÃ´ng bÃ¡o khi tÃ¬m Ä‘Æ°á»£c Ä‘á»‘i thá»§
 # â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
-matchmaking_queue: Dict[int, WebSocket] = {}  # user_id -> websocket
-notification_connections: Dict[int, WebSocket] = {}  # user_id -> websocket
+notification_connections: Dict[int, fanout.Outbox] = {}  # user_id -> outbox của socket
 
 @router.websocket("/matchmaking")
 async def websocket_matchmaking(
     websocket: WebSocket,
     token: str = Query(...),
-    db: AsyncSession = Depends(get_db),
 ):
-    """WebSocket endpoint cho matchmaking - tÃ¬m Ä‘á»‘i thá»§ tá»± Ä‘á»™ng."""
+    """
+    WebSocket endpoint cho matchmaking - tìm đối thủ tự động.
+    Người chơi vào queue theo rating (app.core.matchmaking), tự thử ghép cặp mỗi giây;
+    match_found được đẩy thẳng tới socket của cả 2 người, không poll DB.
+    """
     # 1) Auth
     try:
         await websocket.accept()
@@ -819,126 +1195,76 @@ async def websocket_matchmaking(
         await websocket.close(code=4001)
         return
 
-    print(f"ðŸ” User {user_id} joined matchmaking queue")
-    
-    # ThÃªm vÃ o queue
-    matchmaking_queue[user_id] = websocket
-    
+    from app.models.models import Game
+
+    # Lấy game + rating của user trong 1 query
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(Game.id, UserGameRating.rating)
+            .outerjoin(
+                UserGameRating,
+                (UserGameRating.game_id == Game.id) & (UserGameRating.user_id == user_id),
+            )
+            .where(Game.name == "Caro")
+        )).first()
+    if not row:
+        await websocket.send_text(json.dumps({
+            "type": "error",
+            "payload": "Game not found"
+        }))
+        await websocket.close()
+        return
+
+    game_id = row[0]
+    rating = row[1] if row[1] is not None else 1200
+
+    ticket = matchmaking.QueueTicket(game_id, user_id, rating, websocket)
+    log.debug("matchmaking_joined", user_id=user_id, game_id=game_id, rating=rating)
+
     try:
-        # Gá»­i thÃ´ng bÃ¡o Ä‘Ã£ vÃ o queue
+        queue_size = await matchmaking.enqueue(ticket)
         await websocket.send_text(json.dumps({
             "type": "searching",
             "payload": {
                 "message": "Searching for opponent...",
-                "queue_size": len(matchmaking_queue)
+                "queue_size": queue_size
             }
         }))
-        
-        # TÃ¬m hoáº§c Tạo match
-        from app.models.models import Game
-        
-        game = await db.scalar(select(Game).where(Game.name == "Caro"))
-        if not game:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "payload": "Game not found"
-            }))
-            await websocket.close()
-            return
-        
-        # LÆ°u game_id Ä'á»ƒ sá»­ dá»¥ng sau
-        game_id = game.id
-        
-        # TÃ¬m match Ä'ang waiting
-        match = await db.scalar(
-            select(Match)
-            .where(Match.game_id == game_id)
-            .where(Match.status == MatchStatus.waiting)
-        )
-        
-        match_id = None
-        is_match_ready = False
-        
-        if not match:
-            # Tạo match má»›i
-            new_match = Match(
-                game_id=game_id,
-                board_rows=15,
-                board_cols=19,
-                win_len=5,
-                status=MatchStatus.waiting,
-                created_at=datetime.now(timezone.utc),
-            )
-            db.add(new_match)
-            await db.flush()
-            match_id = new_match.id
-            print(f"âœ¨ Created new match {match_id} for user {user_id}")
-        else:
-            match_id = match.id
-            print(f"ðŸ'¥ User {user_id} joining existing match {match_id}")
-        
-        # Kiá»ƒm tra user Ä‘Ã£ trong match chÆ°a
-        exists = await db.scalar(
-            select(MatchPlayer).where(
-                MatchPlayer.match_id == match_id,
-                MatchPlayer.user_id == user_id,
-            )
-        )
-        
-        if not exists:
-            # Äáº¿m sá»‘ ngÆ°á»i chÆ¡i hiện tại
-            current_players = await db.execute(
-                select(MatchPlayer).where(MatchPlayer.match_id == match_id)
-            )
-            player_count = len(current_players.all())
-            symbol = "X" if player_count == 0 else "O"
-            
-            # ThÃªm player
-            db.add(MatchPlayer(
-                match_id=match_id,
-                user_id=user_id,
-                symbol=symbol
-            ))
-            
-            # Náº¿u Ä‘á»§ 2 ngÆ°á»i -> match ready
-            if player_count + 1 == 2:
-                is_match_ready = True
-                await db.execute(
-                    update(Match)
-                    .where(Match.id == match_id)
-                    .values(status=MatchStatus.playing, started_at=datetime.now(timezone.utc))
-                )
-            
-            await db.commit()
-            print(f"âœ… User {user_id} added to match {match_id} as {symbol}")
-        
-        # Náº¿u match Ä'Ã£ ready, thÃ´ng bÃ¡o cho Cáº¢ 2 ngÆ°á»i chÆ¡i
-        if is_match_ready:
-            # Lấy thÃ´ng tin cáº£ 2 players
-            players_result = await db.execute(
-                select(MatchPlayer, User)
-                .join(User, User.id == MatchPlayer.user_id)
-                .where(MatchPlayer.match_id == match_id)
-            )
-            players_data = players_result.all()
-            
-            players_info = []
-            for mp, user in players_data:
-                # Lấy rating riÃªng biá»‡t Ä'á»ƒ trÃ¡nh lá»—i greenlet
-                rating_obj = await db.scalar(
-                    select(UserGameRating.rating)
-                    .where(UserGameRating.user_id == user.id)
-                    .where(UserGameRating.game_id == game_id)
-                )
-                
-                players_info.append({
-                    "user_id": user.id,
-                    "username": user.username,
-                    "avatar_url": user.avatar_url,
-                    "symbol": mp.symbol,
-                    "rating": rating_obj if rating_obj is not None else 1200,
-                })
-            
+
+        last_ping = asyncio.get_event_loop().time()
+        while not ticket.found.is_set():
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), timeout=1.0)
+                msg = json.loads(raw)
+                if msg.get("type") == "cancel":
+                    await matchmaking.dequeue(ticket)
+                    log.debug("matchmaking_cancelled", user_id=user_id)
+                    await websocket.send_text(json.dumps({
+                        "type": "cancelled",
+                        "payload": {"message": "Matchmaking cancelled"}
+                    }))
+                    break
+            except asyncio.TimeoutError:
+                now = asyncio.get_event_loop().time()
+                if now - last_ping >= 3.0:
+                    await websocket.send_text(json.dumps({"type": "ping"}))
+                    last_ping = now
+            except json.JSONDecodeError:
+                continue
+
+            if ticket.found.is_set():
+                break
+
+            opponent_id = await matchmaking.try_pair(ticket)
+            if opponent_id is None:
+                continue
+
+            x_user_id, o_user_id = await matchmaking.seat_order(ticket, opponent_id)
+            async with AsyncSessionLocal() as db:
+                match_id, players_info = await _create_matched_game(db, game_id, x_user_id, o_user_id)
+            log.info("matchmaking_paired", sample=LOG_SAMPLE_RATE,
+                     match_id=match_id, user_id=user_id, opponent_id=opponent_id)
+
             match_ready_msg = json.dumps({
                 "type": "match_found",
                 "payload": {
@@ -947,120 +1273,78 @@ async def websocket_matchmaking(
                     "message": "Match found! Starting game..."
                 }
             })
-            
-            # Gá»­i cho táº¥t cáº£ players trong matchmaking queue
-            for mp, user in players_data:
-                if mp.user_id in matchmaking_queue:
-                    try:
-                        await matchmaking_queue[mp.user_id].send_text(match_ready_msg)
-                        print(f"âœ‰ï¸ Sent match_found to user {mp.user_id}")
-                    except Exception as e:
-                        print(f"âš ï¸ Failed to notify user {mp.user_id}: {e}")
-            
-            # Äá»£i 2 giÃ¢y rá»“i Ä‘Ã³ng connection
-            await asyncio.sleep(2)
-            await websocket.close()
-            matchmaking_queue.pop(user_id, None)
-            return
-        
-        # Náº¿u chÆ°a Ä'á»§ ngÆ°á»i, giá»¯ connection vÃ  Ä'á»£i
-        while True:
-            try:
-                # Äá»£i message tá»« client hoáº·c timeout Ä'á»ƒ check status
+            for uid in (opponent_id, user_id):
                 try:
-                    raw = await asyncio.wait_for(websocket.receive_text(), timeout=3.0)
-                    msg = json.loads(raw)
-                    
-                    # Xá»­ lÃ½ message cancel
-                    if msg.get("type") == "cancel":
-                        print(f"âŒ User {user_id} cancelled matchmaking")
-                        
-                        # XÃ³a user khá»i match náº¿u chÆ°a cÃ³ Ä'á»'i thá»§
-                        from sqlalchemy import delete
-                        player_result = await db.execute(
-                            select(MatchPlayer).where(MatchPlayer.match_id == match_id)
-                        )
-                        player_count = len(player_result.all())
-                        
-                        if player_count == 1:
-                            # Chá»‰ cÃ³ 1 ngÆ°á»i -> xÃ³a luÃ´n match
-                            await db.execute(delete(MatchPlayer).where(MatchPlayer.match_id == match_id))
-                            await db.execute(delete(Match).where(Match.id == match_id))
-                            await db.commit()
-                            print(f"ðŸ—'ï¸ Deleted empty match {match_id}")
-                        
-                        await websocket.send_text(json.dumps({
-                            "type": "cancelled",
-                            "payload": {"message": "Matchmaking cancelled"}
-                        }))
-                        break
-                        
-                except asyncio.TimeoutError:
-                    # Timeout - gá»­i ping vÃ  tiáº¿p tá»¥c
-                    await websocket.send_text(json.dumps({"type": "ping"}))
-                except json.JSONDecodeError:
-                    # Invalid JSON - ignore
-                    pass
-                
-                # Kiá»ƒm tra match Ä'Ã£ cÃ³ Ä'á»§ ngÆ°á»i chÆ°a
-                match_check = await db.scalar(select(Match).where(Match.id == match_id))
-                if match_check and match_check.status == MatchStatus.playing:
-                    # Match Ä'Ã£ sáºµn sÃ ng
-                    players_result = await db.execute(
-                        select(MatchPlayer, User)
-                        .join(User, User.id == MatchPlayer.user_id)
-                        .where(MatchPlayer.match_id == match_id)
-                    )
-                    players_data = players_result.all()
-                    
-                    players_info = []
-                    for mp, user in players_data:
-                        # Lấy rating riÃªng biá»‡t
-                        rating_obj = await db.scalar(
-                            select(UserGameRating.rating)
-                            .where(UserGameRating.user_id == user.id)
-                            .where(UserGameRating.game_id == game_id)
-                        )
-                        
-                        players_info.append({
-                            "user_id": user.id,
-                            "username": user.username,
-                            "avatar_url": user.avatar_url,
-                            "symbol": mp.symbol,
-                            "rating": rating_obj if rating_obj is not None else 1200,
-                        })
-                    
-                    await websocket.send_text(json.dumps({
-                        "type": "match_found",
-                        "payload": {
-                            "match_id": match_id,
-                            "players": players_info,
-                            "message": "Match found! Starting game..."
-                        }
-                    }))
-                    
-                    await asyncio.sleep(2)
-                    break
-                
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                print(f"âŒ Error in matchmaking: {e}")
-                break
-    
+                    await matchmaking.notify(uid, match_ready_msg)
+                except Exception as e:
+                    log.warning("match_found_notify_failed", match_id=match_id, user_id=uid, error=e)
+
+        if ticket.found.is_set():
+            # Đợi 2 giây để client kịp nhận rồi đóng connection
+            await asyncio.sleep(2)
+
     except WebSocketDisconnect:
-        print(f"ðŸšª User {user_id} left matchmaking queue")
-    except Exception as e:
-        print(f"âŒ Error in matchmaking handler: {e}")
+        log.debug("matchmaking_left", user_id=user_id)
+    except Exception:
+        log.exception("matchmaking_socket_failed", user_id=user_id)
     finally:
-        # Cleanup
-        matchmaking_queue.pop(user_id, None)
+        await matchmaking.dequeue(ticket)
         try:
             await websocket.close()
         except:
             pass
 
 
+async def _create_matched_game(db: AsyncSession, game_id: int, x_user_id: int, o_user_id: int):
+    """
+    Tạo match + 2 MatchPlayer cho cặp vừa ghép (X / O theo matchmaking.seat_order).
+    Returns: (match_id, players_info cho payload match_found)
+    """
+    now = datetime.now(timezone.utc)
+    match = Match(
+        game_id=game_id,
+        board_rows=15,
+        board_cols=19,
+        win_len=5,
+        status=MatchStatus.playing,
+        created_at=now,
+        started_at=now,
+    )
+    db.add(match)
+    await db.flush()
+    match_id = match.id
+    db.add_all([
+        MatchPlayer(match_id=match_id, user_id=x_user_id, symbol="X"),
+        MatchPlayer(match_id=match_id, user_id=o_user_id, symbol="O"),
+    ])
+    await db.commit()
+
+    # Thông tin + rating của cả 2 người trong 1 query
+    result = await db.execute(
+        select(User.id, User.username, User.avatar_url, UserGameRating.rating)
+        .outerjoin(
+            UserGameRating,
+            (UserGameRating.user_id == User.id) & (UserGameRating.game_id == game_id),
+        )
+        .where(User.id.in_([x_user_id, o_user_id]))
+    )
+    symbols = {x_user_id: "X", o_user_id: "O"}
+    players_info = sorted(
+        (
+            {
+                "user_id": uid,
+                "username": username,
+                "avatar_url": avatar_url,
+                "symbol": symbols[uid],
+                "rating": rating if rating is not None else 1200,
+            }
+            for uid, username, avatar_url, rating in result.all()
+        ),
+        key=lambda p: p["symbol"] != "X",
+    )
+    return match_id, players_info
+
+
 
 @router.websocket("/notifications")
 async def websocket_notifications(
@@ -1076,17 +1360,20 @@ async def websocket_notifications(
         await websocket.close(code=4001)
         return
     
-    print(f"ðŸ"" User {user_id} connected to notifications")
+    log.debug("notifications_connected", user_id=user_id)
     
     # Äóng connection cÅ© náº¿u cÃ³
-    if user_id in notification_connections:
+    old_outbox = notification_connections.pop(user_id, None)
+    if old_outbox is not None:
+        old_outbox.close()
         try:
-            await notification_connections[user_id].close()
+            await old_outbox.ws.close()
         except:
             pass
     
     # ThÃªm connection má»›i
-    notification_connections[user_id] = websocket
+    outbox = fanout.Outbox(websocket, name=f"notifications user {user_id}")
+    notification_connections[user_id] = outbox
     
     try:
         # Giá»¯ connection vÃ  nghe ping
@@ -1097,20 +1384,22 @@ async def websocket_notifications(
                 
                 # Respond to ping
                 if msg.get("type") == "ping":
-                    await websocket.send_text(json.dumps({"type": "pong"}))
+                    outbox.send(json.dumps({"type": "pong"}))
                     
             except asyncio.TimeoutError:
                 # Send ping to keep alive
-                await websocket.send_text(json.dumps({"type": "ping"}))
+                outbox.send(json.dumps({"type": "ping"}))
             except json.JSONDecodeError:
                 pass
                 
     except WebSocketDisconnect:
-        print(f"ðŸšª User {user_id} disconnected from notifications")
-    except Exception as e:
-        print(f"âŒ Error in notifications handler: {e}")
+        log.debug("notifications_disconnected", user_id=user_id)
+    except Exception:
+        log.exception("notifications_socket_failed", user_id=user_id)
     finally:
-        notification_connections.pop(user_id, None)
+        if notification_connections.get(user_id) is outbox:
+            notification_connections.pop(user_id, None)
+        outbox.close()
         try:
             await websocket.close()
         except:
@@ -1118,25 +1407,26 @@ async def websocket_notifications(
 
 async def send_notification(user_id: int, notification: dict):
     """Gá»­i notification cho user qua WebSocket."""
-    if user_id in notification_connections:
-        try:
-            await notification_connections[user_id].send_text(json.dumps(notification))
-            print(f"âœ‰ï¸ Sent notification to user {user_id}: {notification.get('type')}")
-        except Exception as e:
-            print(f"âš ï¸ Failed to send notification to user {user_id}: {e}")
-            notification_connections.pop(user_id, None)
+    outbox = notification_connections.get(user_id)
+    if outbox is not None and outbox.send(json.dumps(notification)):
+        log.debug("notification_sent", user_id=user_id, type=notification.get("type"))
 
 
 # â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€
 # Room List WebSocket - real-time room updates
 # â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€â"€
-room_list_connections: Dict[int, WebSocket] = {}  # user_id -> websocket
+room_list_connections: Dict[int, fanout.Outbox] = {}  # user_id -> outbox của socket
+
+
+async def _load_waiting_rooms() -> List[dict]:
+    # Cache Redis dùng chung: nhiều worker resync directory cùng lúc chỉ tốn 1 lần query
+    async with AsyncSessionLocal() as db:
+        return await fetch_rooms_list_cached(db)
 
 @router.websocket("/rooms")
 async def websocket_rooms(
     websocket: WebSocket,
     token: str = Query(...),
-    db: AsyncSession = Depends(get_db),
 ):
     """WebSocket endpoint cho room list - nháº­n updates real-time."""
     # Auth
@@ -1147,59 +1437,25 @@ async def websocket_rooms(
         await websocket.close(code=4001)
         return
     
-    print(f"ðŸ  User {user_id} connected to room list")
+    log.debug("room_list_connected", user_id=user_id)
     
     # Äóng connection cÅ© náº¿u cÃ³
-    if user_id in room_list_connections:
+    old_outbox = room_list_connections.pop(user_id, None)
+    if old_outbox is not None:
+        old_outbox.close()
         try:
-            await room_list_connections[user_id].close()
+            await old_outbox.ws.close()
         except:
             pass
     
     # ThÃªm connection má»›i
-    room_list_connections[user_id] = websocket
+    outbox = fanout.Outbox(websocket, name=f"room list user {user_id}")
+    room_list_connections[user_id] = outbox
     
     try:
         # Gá»­i danh sÃ¡ch rooms ban Ä'áº§u
-        from app.models.models import Room, RoomStatus, User as RoomUser, Game
-        from sqlalchemy.orm import selectinload
-        
-        rooms_query = await db.execute(
-            select(Room)
-            .options(
-                selectinload(Room.host),
-                selectinload(Room.game),
-                selectinload(Room.players)
-            )
-            .where(Room.status == RoomStatus.waiting)  # Chỉ lấy phòng waiting
-            .order_by(Room.created_at.desc())
-        )
-        rooms_list = rooms_query.scalars().all()
-        
-        rooms_data = []
-        for room in rooms_list:
-            rooms_data.append({
-                "id": room.id,
-                "name": room.room_name,  # ← Fixed: room_name not name
-                "room_code": room.room_code,  # ← ADDED: room_code for join
-                "game_id": room.game_id,
-                "game_name": room.game.name if room.game else None,
-                "host_id": room.host_id,
-                "host_username": room.host.username if room.host else None,
-                "max_players": room.max_players,
-                "current_players": len(room.players),
-                "status": room.status.value if hasattr(room.status, "value") else str(room.status),
-                "is_private": room.is_public == False,  # ← Fixed: is_public inverted
-                "created_at": room.created_at.isoformat() if room.created_at else None,
-            })
-        
-        await websocket.send_text(json.dumps({
-            "type": "rooms_list",
-            "payload": {
-                "rooms": rooms_data,
-                "total": len(rooms_data)
-            }
-        }))
+        # Directory trong RAM: chỉ query DB lần đầu / khi resync, list đã serialize sẵn
+        outbox.send(await room_directory.list_message(_load_waiting_rooms))
         
         # Giá»¯ connection vÃ  nghe commands
         while True:
@@ -1209,59 +1465,26 @@ async def websocket_rooms(
                 
                 # Respond to ping
                 if msg.get("type") == "ping":
-                    await websocket.send_text(json.dumps({"type": "pong"}))
+                    outbox.send(json.dumps({"type": "pong"}))
                 
                 # Refresh rooms list on request
                 elif msg.get("type") == "refresh":
-                    rooms_query = await db.execute(
-                        select(Room)
-                        .options(
-                            selectinload(Room.host),
-                            selectinload(Room.game),
-                            selectinload(Room.players)
-                        )
-                        .where(Room.status == RoomStatus.waiting)  # Chỉ lấy phòng waiting
-                        .order_by(Room.created_at.desc())
-                    )
-                    rooms_list = rooms_query.scalars().all()
-                    
-                    rooms_data = []
-                    for room in rooms_list:
-                        rooms_data.append({
-                            "id": room.id,
-                            "name": room.room_name,  # ← Fixed: room_name not name
-                            "room_code": room.room_code,  # ← ADDED: room_code for join
-                            "game_id": room.game_id,
-                            "game_name": room.game.name if room.game else None,
-                            "host_id": room.host_id,
-                            "host_username": room.host.username if room.host else None,
-                            "max_players": room.max_players,
-                            "current_players": len(room.players),
-                            "status": room.status.value if hasattr(room.status, "value") else str(room.status),
-                            "is_private": room.is_public == False,  # ← Fixed: is_public inverted
-                            "created_at": room.created_at.isoformat() if room.created_at else None,
-                        })
-                    
-                    await websocket.send_text(json.dumps({
-                        "type": "rooms_list",
-                        "payload": {
-                            "rooms": rooms_data,
-                            "total": len(rooms_data)
-                        }
-                    }))
+                    outbox.send(await room_directory.list_message(_load_waiting_rooms))
                     
             except asyncio.TimeoutError:
                 # Send ping to keep alive
-                await websocket.send_text(json.dumps({"type": "ping"}))
+                outbox.send(json.dumps({"type": "ping"}))
             except json.JSONDecodeError:
                 pass
                 
     except WebSocketDisconnect:
-        print(f"ðŸšª User {user_id} disconnected from room list")
-    except Exception as e:
-        print(f"âŒ Error in room list handler: {e}")
+        log.debug("room_list_disconnected", user_id=user_id)
+    except Exception:
+        log.exception("room_list_socket_failed", user_id=user_id)
     finally:
-        room_list_connections.pop(user_id, None)
+        if room_list_connections.get(user_id) is outbox:
+            room_list_connections.pop(user_id, None)
+        outbox.close()
         try:
             await websocket.close()
         except:
@@ -1271,41 +1494,55 @@ async def websocket_rooms(
 async def broadcast_room_update(room_data: dict, update_type: str = "update"):
     """
     Broadcast room updates đến tất cả clients đang xem room list.
-    Tối ưu: Gửi song song với asyncio.gather thay vì tuần tự.
+    Tối ưu: serialize 1 lần, đẩy vào outbox (fanout) thay vì await từng socket.
+    Được room_directory gọi sau khi áp change event (diff created / update / deleted).
     """
     if not room_list_connections:
-        print(f"⚠️ No room list connections to broadcast to")
         return
     
     message = {
         "type": f"room_{update_type}",
         "payload": room_data
     }
-    data = json.dumps(message)
+    data = json.dumps(message)  # serialize 1 lần cho mọi client
     
-    print(f"📢 Broadcasting room_{update_type} to {len(room_list_connections)} clients: Room {room_data.get('id')}")
+    log.debug("room_update_broadcast", update_type=update_type, room_id=room_data.get("id"),
+              recipients=len(room_list_connections))
     
-    # ✅ Gửi song song đến tất cả clients (parallel broadcast)
-    async def send_to_one(user_id: int, ws):
-        try:
-            await ws.send_text(data)
-            print(f"  ✅ Sent to user {user_id}")
-            return user_id, True
-        except Exception as e:
-            print(f"  ⚠️ Failed to send to user {user_id}: {e}")
-            return user_id, False
+    # ✅ Chỉ xếp vào outbox của từng client, writer task của mỗi socket tự gửi
+    fanout.publish(list(room_list_connections.values()), data)
     
-    tasks = [send_to_one(uid, ws) for uid, ws in list(room_list_connections.items())]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # Cleanup disconnected
-    for result in results:
-        if isinstance(result, tuple) and not result[1]:
-            room_list_connections.pop(result[0], None)
-    
-    print(f"📊 Broadcast complete. Active connections: {len(room_list_connections)}")
-
-
-
-
-
+    # Cleanup outbox đã đóng (socket lỗi / client quá chậm)
+    for uid, outbox in list(room_list_connections.items()):
+        if outbox.closed:
+            room_list_connections.pop(uid, None)
+
+
+room_directory.set_listener(broadcast_room_update)
+
+
+async def collect_metrics():
+    """Gauge realtime cho GET /metrics: room, connection theo loại socket, matchmaking queue."""
+    statuses: Dict[str, int] = {"waiting": 0, "playing": 0, "finished": 0}
+    match_connections = 0
+    for state in list(rooms.values()):
+        statuses[state.status] = statuses.get(state.status, 0) + 1
+        match_connections += len(state.connections)
+    spectator_stats = spectators.stats()
+    depths = await matchmaking.queue_depths()
+    return [
+        metrics.gauge("rooms", "Live match rooms hosted by this worker, by status",
+                      {("status", status): count for status, count in statuses.items()}),
+        metrics.gauge("ws_connections", "Open WebSocket connections, by socket type", {
+            ("socket", "match"): match_connections,
+            ("socket", "spectate"): spectator_stats["spectators"],
+            ("socket", "matchmaking"): matchmaking.local_tickets(),
+            ("socket", "notifications"): len(notification_connections),
+            ("socket", "rooms"): len(room_list_connections),
+        }),
+        metrics.gauge("matchmaking_queue_depth", "Players waiting in the matchmaking queue, by game",
+                      {("game_id", str(game_id)): depth for game_id, depth in depths.items()}),
+    ]
+
+
+metrics.register_collector(collect_metrics)
@@ -6,9 +6,18 @@ Dùng Redis cache và batch operations để handle 50+ concurrent users.
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-from app.core.cache import cache_get, cache_set, cache_delete_pattern
-from typing import List
+from app.core.cache import read_through, bump_generation
+from app.core import metrics
+from app.core.log import get_logger
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 import asyncio
+import os
+import time
+
+log = get_logger("realtime_helpers")
+
+
+ROOMS_CACHE_NAMESPACE = "rooms"
 
 
 async def fetch_rooms_list_cached(db: AsyncSession) -> List[dict]:
@@ -17,17 +26,15 @@ async def fetch_rooms_list_cached(db: AsyncSession) -> List[dict]:
     Giảm database load cho 50 concurrent users.
     
     Cache HIT: Trả về instant từ Redis
-    Cache MISS: Query DB + cache kết quả 5s
+    Cache MISS: 1 request load DB (lock), request đồng thời chờ kết quả đó
     """
-    # Try cache first
-    cache_key = "rooms:list:waiting"
-    cached = await cache_get(cache_key)
-    if cached is not None:
-        print(f"🚀 Cache HIT: rooms_list ({len(cached)} rooms)")
-        return cached
-    
-    # Cache miss - query từ DB
-    print(f"💾 Cache MISS: querying DB for rooms_list")
+    return await read_through(
+        ROOMS_CACHE_NAMESPACE, {"view": "waiting"}, lambda: fetch_rooms_list(db), ttl=5
+    )
+
+
+async def fetch_rooms_list(db: AsyncSession) -> List[dict]:
+    """Danh sách rooms đang waiting (không cache), dùng chung cho REST và WebSocket."""
     from app.models.models import Room, RoomStatus
     
     rooms_query = await db.execute(
@@ -58,17 +65,13 @@ async def fetch_rooms_list_cached(db: AsyncSession) -> List[dict]:
             "is_private": room.is_public == False,
             "created_at": room.created_at.isoformat() if room.created_at else None,
         })
-    
-    # Cache result for 5 seconds
-    await cache_set(cache_key, rooms_data, ttl=5)
-    
     return rooms_data
 
 
 async def invalidate_rooms_cache():
-    """Xóa cache rooms khi có thay đổi (create/update/delete room)."""
-    await cache_delete_pattern("rooms:list:*")
-    print("🗑️ Invalidated rooms cache")
+    """Vô hiệu cache rooms khi có thay đổi (create/update/delete room): bump generation, O(1)."""
+    await bump_generation(ROOMS_CACHE_NAMESPACE)
+    log.debug("rooms_cache_invalidated")
 
 
 # Rate limiting per user
@@ -98,70 +101,221 @@ def check_rate_limit(user_id: int, min_interval: float = 1.0) -> bool:
     return True
 
 
-# Batch move buffer để gom nhiều moves cùng lúc
-_pending_moves: List[tuple] = []  # [(match_id, user_id, row, col, symbol, timestamp), ...]
-_batch_task: asyncio.Task = None
+# ==== Write-behind move journal ====
+# Nước đi được ghi vào buffer trong RAM, background task gom lại và bulk INSERT
+# vào bảng moves. Round-trip của 1 nước đi không còn phải chờ Postgres commit.
+MOVE_BATCH_SIZE = int(os.getenv("MOVE_BATCH_SIZE", "50"))               # flush khi đủ N moves
+MOVE_FLUSH_INTERVAL = float(os.getenv("MOVE_FLUSH_INTERVAL", "0.1"))    # hoặc sau mỗi 100ms
+MOVE_FLUSH_MAX_RETRIES = 5  # 1 dòng lỗi (đã tách riêng, DB vẫn chạy) quá số lần này mới bị bỏ
+
+_pending_moves: List[dict] = []  # [{match_id, turn_no, user_id, x, y, symbol, made_at}, ...]
+_flush_lock = asyncio.Lock()
+_row_failures: Dict[Tuple[int, int], int] = {}  # (match_id, turn_no) -> số lần insert riêng dòng này lỗi
+_waiting_matches: Dict[int, int] = {}           # match_id -> số caller (end_match / timeout) đang chờ flush
+_pending_finishes: Dict[int, Callable[[], Awaitable[None]]] = {}  # match_id -> lần chốt trận chờ chạy lại
+_flush_event: Optional[asyncio.Event] = None
+_batch_task: Optional[asyncio.Task] = None
 
 
-async def add_move_to_batch(match_id: int, user_id: int, row: int, col: int, symbol: str):
+async def add_move_to_batch(match_id: int, turn_no: int, user_id: int, x: int, y: int, symbol: str):
     """
-    Thêm move vào batch buffer.
-    Moves sẽ được flush mỗi 100ms hoặc khi đủ 10 moves.
+    Thêm move vào journal (không chạm DB).
+    Moves sẽ được flush mỗi MOVE_FLUSH_INTERVAL giây hoặc khi đủ MOVE_BATCH_SIZE moves.
     """
     from datetime import datetime, timezone
-    _pending_moves.append((match_id, user_id, row, col, symbol, datetime.now(timezone.utc)))
-    
-    # Auto flush nếu buffer đầy
-    if len(_pending_moves) >= 10:
+    _pending_moves.append({
+        "match_id": match_id,
+        "turn_no": turn_no,
+        "user_id": user_id,
+        "x": x,
+        "y": y,
+        "symbol": symbol,
+        "made_at": datetime.now(timezone.utc),
+    })
+
+    if _batch_task is None:
+        # Flusher chưa chạy (script/test) -> ghi ngay
         await flush_move_batch()
+    elif len(_pending_moves) >= MOVE_BATCH_SIZE and _flush_event is not None:
+        _flush_event.set()
 
 
-async def flush_move_batch():
-    """Flush tất cả pending moves vào database một lúc."""
-    global _pending_moves
-    
+class MoveJournalError(Exception):
+    """Moves của trận đang chốt kết quả chưa ghi được vào DB (vẫn nằm trong journal)."""
+
+
+async def flush_move_batch(match_id: Optional[int] = None):
+    """
+    Flush tất cả pending moves vào database bằng 1 câu INSERT nhiều dòng.
+    match_id: trận đang chờ chốt kết quả (end_match / timeout) -> moves của trận này
+    không bao giờ bị bỏ; raise MoveJournalError nếu chúng vẫn chưa được ghi.
+    """
+    if match_id is not None:
+        _waiting_matches[match_id] = _waiting_matches.get(match_id, 0) + 1
+    try:
+        # Lock đảm bảo khi hàm trả về thì batch đang flush dở (nếu có) cũng đã commit
+        async with _flush_lock:
+            await _flush_pending()
+        if match_id is not None and any(move["match_id"] == match_id for move in _pending_moves):
+            raise MoveJournalError(f"moves of match {match_id} are not persisted yet")
+    finally:
+        if match_id is not None:
+            if _waiting_matches[match_id] <= 1:
+                del _waiting_matches[match_id]
+            else:
+                _waiting_matches[match_id] -= 1
+
+
+async def _insert_moves(rows: List[dict]) -> Optional[Exception]:
+    """INSERT rows trong 1 transaction riêng. Returns: lỗi (None nếu thành công)."""
+    from app.core.database import AsyncSessionLocal
+    from app.models.models import Move
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+    try:
+        async with AsyncSessionLocal() as db:
+            # ON CONFLICT DO NOTHING: retry sau lỗi không tạo bản ghi trùng (uq_turn_once)
+            await db.execute(pg_insert(Move).values(rows).on_conflict_do_nothing())
+            await db.commit()
+        return None
+    except Exception as e:
+        return e
+
+
+async def _db_reachable() -> bool:
+    from app.core.database import AsyncSessionLocal
+    from sqlalchemy import text
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
+
+
+async def _isolate_bad_rows(rows: List[dict]) -> Tuple[List[dict], List[Tuple[dict, Exception]]]:
+    """Chia đôi tới khi chỉ còn từng dòng lỗi. Returns: (dòng đã ghi, [(dòng lỗi, lỗi)])."""
+    error = await _insert_moves(rows)
+    if error is None:
+        return rows, []
+    if len(rows) == 1:
+        return [], [(rows[0], error)]
+    mid = len(rows) // 2
+    saved_left, bad_left = await _isolate_bad_rows(rows[:mid])
+    saved_right, bad_right = await _isolate_bad_rows(rows[mid:])
+    return saved_left + saved_right, bad_left + bad_right
+
+
+async def _flush_pending():
     if not _pending_moves:
         return
-    
+
     moves = _pending_moves.copy()
     _pending_moves.clear()
-    
-    print(f"💾 Batch saving {len(moves)} moves...")
-    
-    # TODO: Implement bulk insert moves to DB
-    # Sẽ được integrate vào handle_move() trong realtime.py
 
+    started = time.perf_counter()
+    error = await _insert_moves(moves)
+    if error is None:
+        metrics.MOVE_JOURNAL_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        _saved(moves)
+        log.debug("moves_flushed", moves=len(moves))
+        return
+
+    if not await _db_reachable():
+        # DB / mạng lỗi: không dòng nào có lỗi riêng -> giữ nguyên cả batch, lần sau thử lại
+        log.warning("moves_flush_failed_will_retry", moves=len(moves), error=error)
+        _pending_moves[:0] = moves
+        return
+
+    # DB vẫn chạy -> batch có dòng hỏng: tách theo trận, chia đôi để chỉ giữ lại đúng dòng lỗi
+    by_match: Dict[int, List[dict]] = {}
+    for move in moves:
+        by_match.setdefault(move["match_id"], []).append(move)
+
+    retry: List[dict] = []
+    for rows in by_match.values():
+        saved, bad = await _isolate_bad_rows(rows)
+        _saved(saved)
+        for row, row_error in bad:
+            key = (row["match_id"], row["turn_no"])
+            failures = _row_failures.get(key, 0) + 1
+            waiting = row["match_id"] in _waiting_matches or row["match_id"] in _pending_finishes
+            if failures >= MOVE_FLUSH_MAX_RETRIES and not waiting:
+                _row_failures.pop(key, None)
+                metrics.MOVE_JOURNAL_FLUSHED.inc(result="dropped")
+                log.error("move_dropped", match_id=row["match_id"], turn_no=row["turn_no"],
+                          failures=failures, error=row_error)
+            else:
+                _row_failures[key] = failures
+                retry.append(row)
+                log.warning("move_insert_failed_will_retry", match_id=row["match_id"], turn_no=row["turn_no"],
+                            failures=failures, error=row_error)
+    _pending_moves[:0] = retry
 
-async def broadcast_parallel(connections: dict, message: dict):
+
+def _saved(rows: List[dict]):
+    if not rows:
+        return
+    metrics.MOVE_JOURNAL_FLUSHED.inc(len(rows), result="saved")
+    if _row_failures:
+        for row in rows:
+            _row_failures.pop((row["match_id"], row["turn_no"]), None)
+
+
+def retry_after_flush(match_id: int, job: Callable[[], Awaitable[None]]):
     """
-    Broadcast message đến tất cả connections song song (parallel).
-    
-    Thay vì gửi tuần tự (chậm), dùng asyncio.gather để gửi đồng thời.
-    Tăng tốc broadcast từ O(n) -> O(1) time.
+    Chốt trận bị lỗi (moves chưa ghi / DB lỗi): flusher gọi lại job sau mỗi lần flush
+    tới khi job không raise. Moves của trận này không bị bỏ trong lúc chờ.
     """
-    import json
-    
-    if not connections:
-        return
-    
-    data = json.dumps(message)
-    
-    async def send_to_one(user_id: int, ws):
+    _pending_finishes[match_id] = job
+
+
+async def _retry_pending_finishes():
+    for match_id, job in list(_pending_finishes.items()):
         try:
-            await ws.send_text(data)
-            return user_id, True
+            await job()
         except Exception as e:
-            print(f"⚠️ Failed to send to user {user_id}: {e}")
-            return user_id, False
-    
-    # Gửi đồng thời đến tất cả clients
-    tasks = [send_to_one(uid, ws) for uid, ws in connections.items()]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # Cleanup failed connections
-    failed_users = [uid for uid, success in results if isinstance(success, tuple) and not success[1]]
-    for uid in failed_users:
-        connections.pop(uid, None)
-    
-    successful = len(results) - len(failed_users)
-    print(f"📢 Broadcast complete: {successful}/{len(results)} delivered")
+            log.warning("match_finish_retry_failed", match_id=match_id, error=e)
+            continue
+        _pending_finishes.pop(match_id, None)
+        log.info("match_finish_retried", match_id=match_id)
+
+
+async def _move_flusher():
+    """Background task: flush theo thời gian hoặc khi buffer đầy, rồi chạy lại các lần chốt trận lỗi."""
+    while True:
+        try:
+            await asyncio.wait_for(_flush_event.wait(), timeout=MOVE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_event.clear()
+        await flush_move_batch()
+        if _pending_finishes:
+            await _retry_pending_finishes()
+
+
+def start_move_journal():
+    """Khởi động background flusher (gọi lúc startup)."""
+    global _batch_task, _flush_event
+    if _batch_task is None or _batch_task.done():
+        _flush_event = asyncio.Event()
+        _batch_task = asyncio.create_task(_move_flusher())
+
+
+async def stop_move_journal():
+    """Dừng flusher và ghi nốt các moves còn lại (gọi lúc shutdown)."""
+    global _batch_task
+    if _batch_task is not None:
+        _batch_task.cancel()
+        try:
+            await _batch_task
+        except asyncio.CancelledError:
+            pass
+        _batch_task = None
+    await flush_move_batch()
+    if _pending_finishes:
+        await _retry_pending_finishes()
+        for match_id in _pending_finishes:
+            log.error("match_finish_abandoned", match_id=match_id)
+
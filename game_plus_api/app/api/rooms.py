@@ -4,6 +4,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, or_, and_, delete
 from app.core.database import get_db
 from app.core.security import get_current_user, hash_password, verify_password
+from app.core import room_directory
+from app.core.cache import read_through
+from app.core.log import get_logger
+from app.core.game_catalog import get_game
+from app.api.realtime_helpers import ROOMS_CACHE_NAMESPACE, invalidate_rooms_cache
 from app.models.models import (
     Room, RoomPlayer, RoomStatus, User, Game, Match, MatchStatus, 
     MatchPlayer, UserGameRating
@@ -17,73 +22,68 @@ from typing import List, Optional
 import random
 import string
 
+log = get_logger("rooms")
+
 router = APIRouter(prefix="/api/rooms", tags=["rooms"])
 
-# Import broadcast function from realtime
-async def notify_room_change(room: Room, db: AsyncSession, action: str = "update"):
-    """Helper để broadcast room changes qua WebSocket."""
+async def build_room_data(room: Room, db: AsyncSession) -> dict:
+    """room_data cho lobby, build bằng 1 query (game name + host username + số người chơi)."""
+    # ✅ EXTRACT tất cả giá trị TRƯỚC khi query tiếp (không dùng lazy load)
+    room_id = room.id
+    status = room.status.value if hasattr(room.status, "value") else str(room.status)
+    
+    player_count = (
+        select(func.count())
+        .select_from(RoomPlayer)
+        .where(RoomPlayer.room_id == room_id)
+        .scalar_subquery()
+    )
+    row = (await db.execute(
+        select(Game.name, User.username, player_count)
+        .select_from(Room)
+        .outerjoin(Game, Game.id == Room.game_id)
+        .outerjoin(User, User.id == Room.host_id)
+        .where(Room.id == room_id)
+    )).first()
+    game_name, host_username, current_players = row if row else (None, None, 0)
+    
+    return {
+        "id": room_id,
+        "name": room.room_name,
+        "room_code": room.room_code,
+        "game_id": room.game_id,
+        "game_name": game_name,
+        "host_id": room.host_id,
+        "host_username": host_username,
+        "max_players": room.max_players,
+        "current_players": current_players or 0,
+        "status": status,
+        "is_private": not room.is_public,
+        "created_at": room.created_at.isoformat() if room.created_at else None,
+    }
+
+
+async def publish_room_change(room_data: dict, action: str = "update"):
+    """
+    Invalidate cache rooms + phát change event cho room directory (lobby WebSocket của mọi worker).
+    Chỉ gọi SAU khi thay đổi đã commit, nếu không read_through có thể cache lại trạng thái cũ.
+    """
     try:
-        from app.api.realtime import broadcast_room_update
-        from app.api.realtime_helpers import invalidate_rooms_cache
-        
-        # ✅ Invalidate cache khi có thay đổi
         await invalidate_rooms_cache()
-        
-        # ✅ EXTRACT tất cả giá trị TRƯỚC khi gọi broadcast
-        room_id = room.id
-        room_name = room.room_name
-        room_code = room.room_code
-        game_id = room.game_id
-        host_id = room.host_id
-        max_players = room.max_players
-        status = room.status.value if hasattr(room.status, "value") else str(room.status)
-        is_public = room.is_public
-        created_at = room.created_at.isoformat() if room.created_at else None
-        
-        # ✅ Query game_name và host_username từ DB (không dùng lazy load)
-        from app.models.models import User, Game
-        from sqlalchemy import select
-        
-        game_name = None
-        if game_id:
-            game = await db.scalar(select(Game.name).where(Game.id == game_id))
-            game_name = game
-        
-        host_username = None
-        if host_id:
-            host = await db.scalar(select(User.username).where(User.id == host_id))
-            host_username = host
-        
-        # ✅ Query player count từ DB (không dùng lazy load)
-        from app.models.models import RoomPlayer
-        from sqlalchemy import func
-        player_count = await db.scalar(
-            select(func.count()).select_from(RoomPlayer).where(RoomPlayer.room_id == room_id)
-        ) or 0
-        
-        # ✅ Tạo room_data với giá trị đã extract
-        room_data = {
-            "id": room_id,
-            "name": room_name,
-            "room_code": room_code,
-            "game_id": game_id,
-            "game_name": game_name,
-            "host_id": host_id,
-            "host_username": host_username,
-            "max_players": max_players,
-            "current_players": player_count,
-            "status": status,
-            "is_private": not is_public,
-            "created_at": created_at,
-        }
-        
-        await broadcast_room_update(room_data, action)
-        print(f"✅ Broadcast {action} for room {room_id} successfully")
-        
-    except Exception as e:
-        print(f"⚠️ Failed to broadcast room change: {e}")
-        import traceback
-        traceback.print_exc()
+        await room_directory.publish_change(room_data, action)
+        log.debug("room_change_published", room_id=room_data["id"], action=action)
+    except Exception:
+        log.exception("room_change_publish_failed", room_id=room_data["id"], action=action)
+
+
+async def notify_room_change(room: Room, db: AsyncSession, action: str = "update"):
+    """Build room_data rồi phát change event (room đã commit)."""
+    try:
+        room_data = await build_room_data(room, db)
+    except Exception:
+        log.exception("room_change_publish_failed", room_id=room.id, action=action)
+        return
+    await publish_room_change(room_data, action)
 
 # ==== Helper Functions ====
 
@@ -157,6 +157,9 @@ async def build_room_detail(room: Room, db: AsyncSession) -> RoomDetail:
         board_rows=room.board_rows,
         board_cols=room.board_cols,
         win_len=room.win_len,
+        time_per_move=room.time_per_move,
+        time_initial=room.time_initial,
+        time_increment=room.time_increment,
         created_at=room.created_at,
         players=players_data,
         match_id=room.match_id
@@ -178,7 +181,7 @@ async def create_room(
     - Password optional
     """
     # Lấy game Caro
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
         raise HTTPException(404, "Game 'Caro' not found")
     
@@ -190,7 +193,7 @@ async def create_room(
     # Hash password nếu có
     hashed_password = None
     if data.password:
-        hashed_password = hash_password(data.password)
+        hashed_password = await hash_password(data.password)
     
     # Tạo room
     room = Room(
@@ -204,6 +207,9 @@ async def create_room(
         board_rows=data.board_rows,
         board_cols=data.board_cols,
         win_len=data.win_len,
+        time_per_move=data.time_per_move,
+        time_initial=data.time_initial,
+        time_increment=data.time_increment,
         status=RoomStatus.waiting,
         created_at=datetime.now(timezone.utc)
     )
@@ -241,50 +247,58 @@ async def list_rooms(
     - Mặc định chỉ lấy phòng công khai
     - Pagination
     """
-    query = select(Room, User.username).join(User, User.id == Room.host_id)
-    
-    if only_public:
-        query = query.where(Room.is_public == True)
-    
+    status_enum = None
     if status:
         try:
             status_enum = RoomStatus(status)
-            query = query.where(Room.status == status_enum)
         except ValueError:
             raise HTTPException(400, f"Invalid status: {status}")
     
-    query = query.order_by(Room.created_at.desc()).offset(skip).limit(limit)
-    
-    result = await db.execute(query)
-    rooms_data = result.all()
-    
-    # Count players cho mỗi room
-    room_ids = [room.id for room, _ in rooms_data]
-    player_counts = {}
-    if room_ids:
-        counts_query = await db.execute(
-            select(RoomPlayer.room_id, func.count(RoomPlayer.user_id))
-            .where(RoomPlayer.room_id.in_(room_ids))
-            .group_by(RoomPlayer.room_id)
-        )
-        player_counts = dict(counts_query.all())
-    
-    result_list = []
-    for room, host_username in rooms_data:
-        result_list.append(RoomListItem(
-            id=room.id,
-            room_code=room.room_code,
-            room_name=room.room_name,
-            host_username=host_username,
-            status=room.status.value,
-            is_public=room.is_public,
-            has_password=room.password is not None,
-            current_players=player_counts.get(room.id, 0),
-            max_players=room.max_players,
-            created_at=room.created_at
-        ))
-    
-    return result_list
+    async def load() -> List[dict]:
+        query = select(Room, User.username).join(User, User.id == Room.host_id)
+        
+        if only_public:
+            query = query.where(Room.is_public == True)
+        
+        if status_enum is not None:
+            query = query.where(Room.status == status_enum)
+        
+        query = query.order_by(Room.created_at.desc()).offset(skip).limit(limit)
+        
+        result = await db.execute(query)
+        rooms_data = result.all()
+        
+        # Count players cho mỗi room
+        room_ids = [room.id for room, _ in rooms_data]
+        player_counts = {}
+        if room_ids:
+            counts_query = await db.execute(
+                select(RoomPlayer.room_id, func.count(RoomPlayer.user_id))
+                .where(RoomPlayer.room_id.in_(room_ids))
+                .group_by(RoomPlayer.room_id)
+            )
+            player_counts = dict(counts_query.all())
+        
+        return [
+            {
+                "id": room.id,
+                "room_code": room.room_code,
+                "room_name": room.room_name,
+                "host_username": host_username,
+                "status": room.status.value,
+                "is_public": room.is_public,
+                "has_password": room.password is not None,
+                "current_players": player_counts.get(room.id, 0),
+                "max_players": room.max_players,
+                "created_at": room.created_at.isoformat() if room.created_at else None,
+            }
+            for room, host_username in rooms_data
+        ]
+    
+    # Cache theo filter + page; notify_room_change bump generation của namespace "rooms"
+    params = {"list": "rooms", "status": status, "only_public": only_public, "skip": skip, "limit": limit}
+    items = await read_through(ROOMS_CACHE_NAMESPACE, params, load, ttl=5)
+    return [RoomListItem(**item) for item in items]
 
 @router.get("/{room_id}", response_model=RoomDetail)
 async def get_room_detail(
@@ -324,7 +338,7 @@ async def join_room(
     if room.password:
         if not data.password:
             raise HTTPException(401, "Password required")
-        if not verify_password(data.password, room.password):
+        if not await verify_password(data.password, room.password):
             raise HTTPException(401, "Incorrect password")
     
     # Đếm số người chơi hiện tại
@@ -470,8 +484,10 @@ async def leave_room(
     
     # Nếu là host -> xóa phòng
     if current_user.id == room.host_id:
+        room_data = await build_room_data(room, db)  # lấy trước khi xóa
         await db.delete(room)
         await db.commit()
+        await publish_room_change(room_data, "deleted")
         return {
             "message": "Room deleted (host left)",
             "room_deleted": True
@@ -487,6 +503,7 @@ async def leave_room(
         raise HTTPException(404, "You are not in this room")
     
     await db.commit()
+    await notify_room_change(room, db, "update")
     
     return {
         "message": "Left room successfully",
@@ -533,6 +550,9 @@ async def start_game(
         board_rows=room.board_rows,
         board_cols=room.board_cols,
         win_len=room.win_len,
+        time_per_move=room.time_per_move,
+        time_initial=room.time_initial,
+        time_increment=room.time_increment,
         status=MatchStatus.waiting,  # Sẽ chuyển playing khi join WebSocket
         created_at=datetime.now(timezone.utc)
     )
@@ -591,11 +611,11 @@ async def delete_room(
     if room.status != RoomStatus.waiting:
         raise HTTPException(400, "Can only delete room in waiting state")
     
-    # Broadcast room deleted trước khi xóa
-    await notify_room_change(room, db, "deleted")
-    
+    room_data = await build_room_data(room, db)  # lấy trước khi xóa
     await db.delete(room)
     await db.commit()
+    # Broadcast room deleted sau khi commit
+    await publish_room_change(room_data, "deleted")
     
     return {
         "message": "Room deleted successfully",
@@ -3,22 +3,25 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 
 from app.core.database import get_db
+from app.core.game_catalog import get_game
+from app.core.log import get_logger
 from app.api.auth import get_current_user
-from app.models.models import User, UserGameRating, Game
+from app.api.profile import invalidate_user_caches
+from app.models.models import User, UserGameRating
 from app.schemas.user import UserPublic, UserUpdate
 
+log = get_logger("users")
+
 router = APIRouter(prefix="/api/users", tags=["Users"])
 
 
 async def get_user_caro_rating(db: AsyncSession, user_id: int) -> int | None:
     """Helper function to get user's Caro game rating."""
-    print(f"🔍 Getting Caro rating for user {user_id}")
-    game = await db.scalar(select(Game).where(Game.name == "Caro"))
+    game = await get_game(db, "Caro")
     if not game:
-        print(f"⚠️ Game 'Caro' not found in database!")
+        log.warning("game_not_found", game="Caro")
         return None
     
-    print(f"✅ Found game Caro with id {game.id}")
     rating_obj = await db.scalar(
         select(UserGameRating.rating)
         .where(UserGameRating.user_id == user_id)
@@ -26,7 +29,6 @@ async def get_user_caro_rating(db: AsyncSession, user_id: int) -> int | None:
     )
     
     result = rating_obj if rating_obj is not None else 1200
-    print(f"📊 User {user_id} rating: {result} (from_db={rating_obj is not None})")
     return result
 
 
@@ -54,9 +56,8 @@ async def get_profile(
     db: AsyncSession = Depends(get_db)
 ):
     """Get current user profile with Caro rating."""
-    print(f"📍 GET /api/users/me called for user {current_user.id} ({current_user.username})")
     result = await user_to_public(current_user, db)
-    print(f"📤 Returning user data with rating: {result.rating}")
+    log.debug("profile_served", user_id=current_user.id, rating=result.rating)
     return result
 
 @router.put("/me", response_model=UserPublic)
@@ -79,5 +80,6 @@ async def update_profile(
     res = await db.execute(q)
     await db.commit()
     updated_user = res.scalar_one()
+    await invalidate_user_caches(updated_user.id)
     
     return await user_to_public(updated_user, db)
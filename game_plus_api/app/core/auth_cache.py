@@ -0,0 +1,128 @@
+# app/core/auth_cache.py
+"""
+Cache cho xác thực (REST get_current_user + WebSocket decode_token).
+
+- Token đã verify: token -> user_id, giữ tới đúng `exp` của token (không decode lại).
+- User projection: user_id -> {id, username, email, avatar_url, provider, bio},
+  TTL AUTH_USER_CACHE_TTL giây, LRU giới hạn kích thước.
+- AUTH_CACHE_REDIS=1: projection được chia sẻ giữa các worker qua Redis (auth:user:{id}).
+
+Đổi profile / xóa tài khoản -> gọi invalidate_user(): event phát qua match bus (auth:events),
+mọi worker bỏ bản local ngay. User bị xóa được ghi nhớ tới khi token cuối của họ hết hạn,
+token đã cache (và token mới decode) của user đó không còn được chấp nhận.
+Bus không dùng được (Redis lỗi) -> worker khác thấy thay đổi chậm nhất sau AUTH_USER_CACHE_TTL giây.
+"""
+import json
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from app.core import match_bus
+from app.core.cache import get_redis
+from app.core.config import ACCESS_TOKEN_EXPIRE_MINUTES
+from app.core.layered_cache import TTLCache
+from app.core.log import get_logger
+
+log = get_logger("auth_cache")
+
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+USER_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+SHARE_VIA_REDIS = os.getenv("AUTH_CACHE_REDIS", "0") == "1"
+
+USER_KEY_PREFIX = "auth:user:"
+
+UserLoader = Callable[[], Awaitable[Optional[dict]]]
+
+
+_tokens = TTLCache(TOKEN_CACHE_SIZE)
+_users = TTLCache(USER_CACHE_SIZE)
+_deleted = TTLCache(USER_CACHE_SIZE)  # user_id đã xóa -> nhớ tới khi token cuối hết hạn
+_stats = {"token_hits": 0, "token_misses": 0, "user_hits": 0, "user_misses": 0}
+
+
+# ==== Tokens ====
+
+def get_token(token: str) -> Optional[int]:
+    user_id = _tokens.get(token)
+    if user_id is not None and is_deleted(user_id):
+        _tokens.pop(token)
+        user_id = None
+    _stats["token_hits" if user_id is not None else "token_misses"] += 1
+    return user_id
+
+
+def is_deleted(user_id: int) -> bool:
+    return _deleted.get(user_id) is not None
+
+
+def put_token(token: str, user_id: int, exp: Optional[float]):
+    """Nhớ token đã verify tới thời điểm hết hạn của nó (token không có exp thì không cache)."""
+    if exp:
+        _tokens.set(token, user_id, float(exp))
+
+
+# ==== Users ====
+
+def _user_key(user_id: int) -> str:
+    return f"{USER_KEY_PREFIX}{user_id}"
+
+
+async def get_user(user_id: int, load: UserLoader) -> Optional[dict]:
+    """Projection của user: RAM -> Redis (nếu bật) -> load() (DB). None nếu user không tồn tại."""
+    user = _users.get(user_id)
+    if user is not None:
+        _stats["user_hits"] += 1
+        return user
+    _stats["user_misses"] += 1
+
+    if SHARE_VIA_REDIS:
+        try:
+            client = await get_redis()
+            data = await client.get(_user_key(user_id))
+            if data:
+                user = json.loads(data)
+                _users.set(user_id, user, time.time() + USER_TTL)
+                return user
+        except Exception as e:
+            log.warning("redis_get_failed", user_id=user_id, error=e)
+
+    user = await load()
+    if user is None:
+        return None
+    _users.set(user_id, user, time.time() + USER_TTL)
+    if SHARE_VIA_REDIS:
+        try:
+            client = await get_redis()
+            await client.setex(_user_key(user_id), USER_TTL, json.dumps(user))
+        except Exception as e:
+            log.warning("redis_set_failed", user_id=user_id, error=e)
+    return user
+
+
+async def invalidate_user(user_id: int, deleted: bool = False):
+    """
+    Gọi sau khi commit đổi username / avatar / bio... (deleted=True khi xóa tài khoản)
+    để request sau ở mọi worker đọc lại từ DB.
+    """
+    event = {"user_id": user_id, "deleted": deleted}
+    apply_event(event)  # worker này: ngay, không chờ vòng pub/sub
+    if SHARE_VIA_REDIS:
+        try:
+            client = await get_redis()
+            await client.delete(_user_key(user_id))  # xóa trước khi báo -> worker khác không đọc lại bản cũ
+        except Exception as e:
+            log.warning("redis_delete_failed", user_id=user_id, error=e)
+    await match_bus.publish_auth_event(event)
+
+
+def apply_event(event: dict):
+    """Handler của auth:events (match_bus): bỏ projection local, nhớ user đã xóa."""
+    user_id = int(event["user_id"])
+    _users.pop(user_id)
+    if event.get("deleted"):
+        _deleted.set(user_id, True, time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def stats() -> dict:
+    return {"tokens": len(_tokens), "users": len(_users), "deleted_users": len(_deleted), **_stats}
@@ -1,13 +1,33 @@
 # app/core/cache.py
 import redis.asyncio as redis
+import asyncio
+import hashlib
 import json
 import os
-from typing import Optional, Any
+import time
+from typing import Optional, Any, Awaitable, Callable
 from dotenv import load_dotenv
+from app.core import metrics
+from app.core.log import get_logger
+
+log = get_logger("cache")
 
 load_dotenv()
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SCAN_BATCH = 500  # số key mỗi lần SCAN / UNLINK khi xóa theo pattern
+
+
+class TimedRedis(redis.Redis):
+    """Redis client đo round trip từng lệnh (metric redis_command_seconds theo command)."""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            metrics.REDIS_COMMAND_SECONDS.observe(time.perf_counter() - started, command=str(args[0]).lower())
+
 
 # Redis client singleton
 _redis_client: Optional[redis.Redis] = None
@@ -17,7 +37,7 @@ async def get_redis() -> redis.Redis:
     """Lấy Redis client (singleton pattern)."""
     global _redis_client
     if _redis_client is None:
-        _redis_client = redis.from_url(
+        _redis_client = TimedRedis.from_url(
             REDIS_URL,
             encoding="utf-8",
             decode_responses=True,
@@ -44,7 +64,7 @@ async def cache_get(key: str) -> Optional[Any]:
             return json.loads(data)
         return None
     except Exception as e:
-        print(f"⚠️ Redis GET error: {e}")
+        log.warning("redis_get_failed", key=key, error=e)
         return None
 
 
@@ -54,7 +74,7 @@ async def cache_set(key: str, value: Any, ttl: int = 5):
         client = await get_redis()
         await client.setex(key, ttl, json.dumps(value))
     except Exception as e:
-        print(f"⚠️ Redis SET error: {e}")
+        log.warning("redis_set_failed", key=key, error=e)
 
 
 async def cache_delete(key: str):
@@ -63,15 +83,106 @@ async def cache_delete(key: str):
         client = await get_redis()
         await client.delete(key)
     except Exception as e:
-        print(f"⚠️ Redis DELETE error: {e}")
+        log.warning("redis_delete_failed", key=key, error=e)
 
 
-async def cache_delete_pattern(pattern: str):
-    """Xóa tất cả keys matching pattern."""
+async def cache_delete_pattern(pattern: str, batch: int = SCAN_BATCH) -> int:
+    """
+    Xóa tất cả keys matching pattern - CHỈ dùng cho bảo trì / script.
+    Quét bằng SCAN theo từng batch (không chặn Redis như KEYS) nhưng vẫn O(toàn bộ keyspace);
+    code trong request phải invalidate bằng bump_generation(). Returns: số key đã xóa.
+    """
+    deleted = 0
     try:
         client = await get_redis()
-        keys = await client.keys(pattern)
+        keys = []
+        async for key in client.scan_iter(match=pattern, count=batch):
+            keys.append(key)
+            if len(keys) >= batch:
+                deleted += await client.unlink(*keys)
+                keys = []
         if keys:
-            await client.delete(*keys)
+            deleted += await client.unlink(*keys)
+    except Exception as e:
+        log.warning("redis_delete_pattern_failed", pattern=pattern, error=e)
+    return deleted
+
+
+# ==== Read-through cache cho list endpoints ====
+# Key = cache:{namespace}:v{generation}:{hash(params)}. Invalidate cả namespace bằng
+# bump_generation() (INCR 1 key, O(1)) thay vì tìm và xóa từng key; key cũ tự hết TTL.
+# Miss: chỉ 1 request (trên mọi worker) được load nhờ lock SET NX, số còn lại chờ kết quả.
+
+GEN_KEY_PREFIX = "cache:gen:"
+LOCK_TTL_MS = 3000        # lock load tự nhả nếu worker chết giữa chừng
+LOCK_WAIT_STEP = 0.05     # giây giữa 2 lần xem kết quả của request đang load
+LOCK_WAIT_STEPS = 20      # chờ tối đa ~1s rồi tự load
+
+Loader = Callable[[], Awaitable[Any]]
+
+
+def make_key(namespace: str, generation: int, params: Optional[dict] = None) -> str:
+    """Key ổn định theo params (filter / pagination), không phụ thuộc thứ tự."""
+    raw = json.dumps(params or {}, sort_keys=True, default=str)
+    digest = hashlib.sha1(raw.encode()).hexdigest()[:16]
+    return f"cache:{namespace}:v{generation}:{digest}"
+
+
+async def get_generation(namespace: str) -> int:
+    client = await get_redis()
+    return int(await client.get(f"{GEN_KEY_PREFIX}{namespace}") or 0)
+
+
+async def bump_generation(namespace: str):
+    """Vô hiệu hóa mọi key của namespace (các page / filter) trong O(1)."""
+    try:
+        client = await get_redis()
+        await client.incr(f"{GEN_KEY_PREFIX}{namespace}")
+    except Exception as e:
+        log.warning("redis_bump_generation_failed", namespace=namespace, error=e)
+
+
+async def read_through(namespace: str, params: Optional[dict], loader: Loader, ttl: int = 5) -> Any:
+    """
+    Lấy giá trị từ cache hoặc gọi loader() (kết quả phải JSON-serializable).
+    Redis lỗi -> gọi loader() trực tiếp.
+    """
+    try:
+        client = await get_redis()
+        key = make_key(namespace, await get_generation(namespace), params)
+        data = await client.get(key)
+        if data is not None:
+            metrics.CACHE_REQUESTS.inc(namespace=namespace, result="hit")
+            return json.loads(data)
+        metrics.CACHE_REQUESTS.inc(namespace=namespace, result="miss")
+        lock_key = f"{key}:lock"
+        got_lock = await client.set(lock_key, "1", nx=True, px=LOCK_TTL_MS)
     except Exception as e:
-        print(f"⚠️ Redis DELETE PATTERN error: {e}")
+        log.warning("read_through_redis_failed", namespace=namespace, error=e)
+        metrics.CACHE_REQUESTS.inc(namespace=namespace, result="error")
+        return await loader()
+
+    if got_lock:
+        try:
+            value = await loader()
+            try:
+                await client.setex(key, ttl, json.dumps(value))
+            except Exception as e:
+                log.warning("read_through_set_failed", namespace=namespace, error=e)
+            return value
+        finally:
+            try:
+                await client.delete(lock_key)
+            except Exception:
+                pass
+
+    # Request khác đang load cùng key -> chờ kết quả thay vì cùng đập vào DB
+    for _ in range(LOCK_WAIT_STEPS):
+        await asyncio.sleep(LOCK_WAIT_STEP)
+        try:
+            data = await client.get(key)
+        except Exception:
+            break
+        if data is not None:
+            return json.loads(data)
+    return await loader()
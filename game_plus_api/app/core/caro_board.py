@@ -0,0 +1,118 @@
+# app/core/caro_board.py
+"""
+Board engine gọn nhẹ cho Caro.
+Lưu bàn cờ trong một bytearray phẳng (1 byte/ô) thay vì list of lists,
+kiểm tra thắng tăng dần quanh nước vừa đi với chi phí O(win_len).
+"""
+from typing import List, Optional, Tuple
+
+EMPTY = 0
+SYMBOL_CODES = {"X": 1, "O": 2}
+CODE_SYMBOLS = ("", "X", "O")
+# Ký tự dùng cho serialize phẳng: "." = ô trống
+FLAT_CHARS = (".", "X", "O")
+
+_DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+
+class CaroBoard:
+    """Bàn cờ rows x cols, mỗi ô là 0 (trống), 1 (X) hoặc 2 (O)."""
+
+    __slots__ = ("rows", "cols", "win_len", "cells", "filled", "_rows_cache", "_flat_cache")
+
+    def __init__(self, rows: int, cols: int, win_len: int):
+        self.rows = rows
+        self.cols = cols
+        self.win_len = win_len
+        self.cells = bytearray(rows * cols)
+        self.filled = 0
+        self._rows_cache: Optional[List[List[str]]] = None
+        self._flat_cache: Optional[str] = None
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.rows and 0 <= y < self.cols
+
+    def get(self, x: int, y: int) -> str:
+        return CODE_SYMBOLS[self.cells[x * self.cols + y]]
+
+    def is_empty(self, x: int, y: int) -> bool:
+        return self.cells[x * self.cols + y] == EMPTY
+
+    def is_full(self) -> bool:
+        return self.filled == self.rows * self.cols
+
+    def count(self, symbol: str) -> int:
+        """Số quân của symbol đang có trên bàn."""
+        return self.cells.count(SYMBOL_CODES[symbol])
+
+    def place(self, x: int, y: int, symbol: str):
+        """Đặt quân lên ô (x, y). Caller phải tự kiểm tra bounds và ô trống."""
+        self.cells[x * self.cols + y] = SYMBOL_CODES[symbol]
+        self.filled += 1
+        self._rows_cache = None
+        self._flat_cache = None
+
+    def winning_line(self, x: int, y: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        Kiểm tra thắng quanh nước vừa đi tại (x, y).
+        Mỗi hướng chỉ đi tối đa win_len - 1 ô về mỗi phía nên chi phí là O(win_len).
+        Returns: danh sách toạ độ của đường thắng hoặc None.
+        """
+        cells = self.cells
+        rows, cols = self.rows, self.cols
+        code = cells[x * cols + y]
+        if code == EMPTY:
+            return None
+        reach = self.win_len - 1
+
+        for dx, dy in _DIRECTIONS:
+            # Đếm về phía trước
+            fwd = 0
+            i, j = x + dx, y + dy
+            while fwd < reach and 0 <= i < rows and 0 <= j < cols and cells[i * cols + j] == code:
+                fwd += 1
+                i += dx
+                j += dy
+            # Đếm về phía sau
+            back = 0
+            i, j = x - dx, y - dy
+            while back < reach and 0 <= i < rows and 0 <= j < cols and cells[i * cols + j] == code:
+                back += 1
+                i -= dx
+                j -= dy
+
+            if back + 1 + fwd >= self.win_len:
+                sx, sy = x - back * dx, y - back * dy
+                return [(sx + k * dx, sy + k * dy) for k in range(back + 1 + fwd)]
+        return None
+
+    def to_flat(self) -> str:
+        """Serialize phẳng rows*cols ký tự ('.', 'X', 'O'), cache tới nước đi tiếp theo."""
+        if self._flat_cache is None:
+            self._flat_cache = "".join(FLAT_CHARS[c] for c in self.cells)
+        return self._flat_cache
+
+    def to_rows(self) -> List[List[str]]:
+        """
+        Board dạng list of lists ("" = ô trống) cho client cũ.
+        Kết quả được cache và dùng chung giữa các lần join cho tới nước đi tiếp theo,
+        caller KHÔNG được sửa list trả về.
+        """
+        if self._rows_cache is None:
+            cols = self.cols
+            cells = self.cells
+            self._rows_cache = [
+                [CODE_SYMBOLS[c] for c in cells[r * cols:(r + 1) * cols]]
+                for r in range(self.rows)
+            ]
+        return self._rows_cache
+
+    @classmethod
+    def from_flat(cls, flat: str, rows: int, cols: int, win_len: int) -> "CaroBoard":
+        """Khôi phục board từ chuỗi do to_flat() sinh ra."""
+        board = cls(rows, cols, win_len)
+        for idx, ch in enumerate(flat[:rows * cols]):
+            if ch in SYMBOL_CODES:
+                board.cells[idx] = SYMBOL_CODES[ch]
+                board.filled += 1
+        return board
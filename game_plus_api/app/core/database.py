@@ -1,8 +1,14 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy import text
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
+import time
 from dotenv import load_dotenv
+from app.core import metrics
+from app.core.log import get_logger
+
+log = get_logger("database")
 
 # 🔧 Load biến môi trường từ .env
 load_dotenv()
@@ -12,6 +18,16 @@ DATABASE_URL = os.getenv(
     "postgresql+asyncpg://admin:Admin123@@localhost:5432/gameplus_db"
 )
 
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """QueuePool đo thời gian chờ lấy connection (metric db_pool_checkout_wait_seconds)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.DB_CHECKOUT_WAIT_SECONDS.observe(time.perf_counter() - started)
+
 # 🚀 Tạo engine và session với connection pooling tối ưu cho 50 concurrent users
 engine = create_async_engine(
     DATABASE_URL,
@@ -21,6 +37,7 @@ engine = create_async_engine(
     max_overflow=10,  # Số connections tạm thời thêm khi cần (tăng từ 10 lên 10)
     pool_pre_ping=True,  # Kiểm tra connection trước khi dùng
     pool_recycle=3600,  # Recycle connections sau 1 giờ để tránh stale
+    poolclass=TimedQueuePool,
 )
 AsyncSessionLocal = sessionmaker(
     autocommit=False,
@@ -30,6 +47,17 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False,  # Giảm lazy loading issues
 )
 
+# 📊 Gauge cho pool: realtime chỉ giữ connection trong lúc query, checked_out phải luôn nhỏ
+def pool_status() -> dict:
+    pool = engine.sync_engine.pool
+    return {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),  # QueuePool trả số âm khi chưa dùng hết pool_size
+        "max_overflow": pool._max_overflow,
+    }
+
 # 🧱 Base class cho tất cả models
 Base = declarative_base()
 
@@ -45,4 +73,4 @@ async def init_db():
         await conn.run_sync(Base.metadata.create_all)
         # Test query nhỏ để đảm bảo DB hoạt động
         await conn.execute(text("SELECT 1"))
-    print("✅ Database initialized successfully!")
+    log.info("db_initialized")
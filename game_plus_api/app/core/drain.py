@@ -0,0 +1,46 @@
+# app/core/drain.py
+"""
+Drain mode khi worker shutdown (deploy / bị recycle sau limit_max_requests).
+
+- Uvicorn đóng mọi WebSocket với code 1012 (Service Restart) trước khi chạy shutdown event:
+  người chơi rời trận với code này được coi là bàn giao, không bị xử thua.
+- Shutdown event bật drain: không nhận join mới, dừng deadline, ghi journal + snapshot,
+  gửi {"type": "reconnect"} cho client đang nối qua worker khác rồi nhả ownership
+  -> client kết nối lại, worker khác warm start trận từ snapshot.
+
+Client nhận close 1012 hoặc message "reconnect": đợi retry_after_ms rồi kết nối lại với since/epoch.
+"""
+import json
+import os
+
+from app.core.log import get_logger
+
+log = get_logger("drain")
+
+CLOSE_CODE_RESTART = 1012
+RECONNECT_DELAY_MS = int(os.getenv("WS_RECONNECT_DELAY_MS", "500"))
+
+_draining = False
+
+
+def begin():
+    global _draining
+    if not _draining:
+        log.info("draining_worker")
+    _draining = True
+
+
+def is_draining() -> bool:
+    return _draining
+
+
+def is_restart_close(code) -> bool:
+    """Socket bị đóng vì server restart (không phải người chơi bỏ trận)."""
+    return code == CLOSE_CODE_RESTART
+
+
+def reconnect_message() -> str:
+    return json.dumps({
+        "type": "reconnect",
+        "payload": {"reason": "server_restart", "retry_after_ms": RECONNECT_DELAY_MS},
+    })
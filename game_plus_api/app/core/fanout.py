@@ -0,0 +1,131 @@
+# app/core/fanout.py
+"""
+Fan-out cho WebSocket: mỗi socket có 1 Outbox (hàng đợi giới hạn + 1 writer task).
+
+- Broadcast chỉ serialize payload 1 lần rồi put_nowait vào outbox của từng socket,
+  không await send_text -> 1 client chậm không làm chậm người khác và không giữ state.lock.
+- Outbox đầy (client không đọc kịp) xử lý theo policy:
+    POLICY_DROP  : bỏ message cũ nhất (match socket: client phát hiện lỗ hổng seq và resync)
+    POLICY_CLOSE : đóng socket (room list / notifications: client reconnect và nhận lại full list)
+- send_text treo quá WS_SEND_TIMEOUT giây -> coi như socket chết, đóng luôn.
+"""
+import asyncio
+import os
+from typing import Iterable, Optional
+
+from app.core.log import get_logger
+
+log = get_logger("fanout")
+
+OUTBOX_SIZE = int(os.getenv("WS_OUTBOX_SIZE", "64"))
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+POLICY_DROP = "drop"
+POLICY_CLOSE = "close"
+
+CLOSE_CODE_SLOW = 1013  # "try again later"
+
+_CLOSE = object()  # đặt cuối hàng đợi bởi close_when_drained
+
+_stats = {
+    "open_outboxes": 0,
+    "sent_total": 0,
+    "dropped_total": 0,
+    "slow_closed_total": 0,
+    "send_errors_total": 0,
+}
+
+
+class Outbox:
+    """Hàng đợi gửi của 1 socket (WebSocket thật hoặc match_bus.RemoteSocket)."""
+
+    def __init__(self, ws, name: str = "", policy: str = POLICY_CLOSE, maxsize: int = OUTBOX_SIZE):
+        self.ws = ws
+        self.name = name
+        self.policy = policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+        self.draining = False
+        self.dropped = 0
+        self._close_code = 1000
+        self._writer: Optional[asyncio.Task] = None
+        _stats["open_outboxes"] += 1
+
+    def send(self, data: str) -> bool:
+        """Đưa message (đã serialize) vào hàng đợi, không chờ mạng. False nếu không gửi được."""
+        if self.closed or self.draining:
+            return False
+        if self.queue.full():
+            if self.policy == POLICY_DROP:
+                self.queue.get_nowait()
+                self.dropped += 1
+                _stats["dropped_total"] += 1
+            else:
+                log.warning("slow_consumer_closed", socket=self.name)
+                _stats["slow_closed_total"] += 1
+                self._shutdown(close_ws=True, code=CLOSE_CODE_SLOW)
+                return False
+        self.queue.put_nowait(data)
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._run())
+        return True
+
+    async def send_text(self, data: str):
+        """Cùng chữ ký với WebSocket.send_text để code cũ dùng outbox như socket."""
+        self.send(data)
+
+    def close(self):
+        """Dừng writer, bỏ các message chưa gửi (không đóng socket)."""
+        self._shutdown(close_ws=False)
+
+    def close_when_drained(self, code: int = 1000):
+        """Gửi nốt message đang chờ rồi đóng socket; từ chối message mới."""
+        if self.closed or self.draining:
+            return
+        self.send(_CLOSE)
+        self.draining = True
+        self._close_code = code
+
+    def _shutdown(self, close_ws: bool, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        _stats["open_outboxes"] -= 1
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if close_ws:
+            asyncio.create_task(self._close_ws(code))
+
+    async def _close_ws(self, code: int):
+        try:
+            await self.ws.close(code=code)
+        except Exception:
+            pass
+
+    async def _run(self):
+        while not self.closed:
+            data = await self.queue.get()
+            if data is _CLOSE:
+                self._shutdown(close_ws=True, code=self._close_code)
+                return
+            try:
+                await asyncio.wait_for(self.ws.send_text(data), timeout=SEND_TIMEOUT)
+                _stats["sent_total"] += 1
+            except Exception as e:
+                log.debug("send_failed_closing", socket=self.name, error=e)
+                _stats["send_errors_total"] += 1
+                self._shutdown(close_ws=True)
+                return
+
+
+def publish(outboxes: Iterable[Outbox], data: str) -> int:
+    """Đẩy 1 payload đã serialize tới nhiều outbox. Returns: số outbox nhận."""
+    delivered = 0
+    for outbox in outboxes:
+        if outbox.send(data):
+            delivered += 1
+    return delivered
+
+
+def stats() -> dict:
+    return dict(_stats)
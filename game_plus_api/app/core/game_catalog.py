@@ -0,0 +1,44 @@
+# app/core/game_catalog.py
+"""
+Tra cứu dòng Game theo tên (gần như mọi endpoint đều cần game "Caro").
+
+Dùng LayeredCache: RAM worker -> Redis -> DB. Bảng games gần như không đổi nên TTL dài;
+game chưa tồn tại không được cache (ensure_user_caro_rating tạo xong là thấy ngay).
+"""
+import os
+from types import SimpleNamespace
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.layered_cache import LayeredCache
+from app.models.models import Game
+
+_games = LayeredCache(
+    "games",
+    maxsize=64,
+    local_ttl=float(os.getenv("GAME_CACHE_LOCAL_TTL", "300")),
+    redis_ttl=int(os.getenv("GAME_CACHE_REDIS_TTL", "3600")),
+)
+
+
+async def get_game(db: AsyncSession, name: str = "Caro") -> Optional[SimpleNamespace]:
+    """Returns: object có id, name, description, thumbnail_url (hoặc None nếu không có game)."""
+    async def load() -> Optional[dict]:
+        game = await db.scalar(select(Game).where(Game.name == name))
+        if game is None:
+            return None
+        return {
+            "id": game.id,
+            "name": game.name,
+            "description": game.description,
+            "thumbnail_url": game.thumbnail_url,
+        }
+
+    data = await _games.get(name, load)
+    return SimpleNamespace(**data) if data is not None else None
+
+
+async def invalidate_game(name: str):
+    await _games.invalidate(name)
@@ -0,0 +1,65 @@
+# app/core/hash_pool.py
+"""
+Thread pool riêng, giới hạn kích thước cho việc tốn CPU (bcrypt hash / verify).
+
+bcrypt mất hàng chục ms mỗi lần; chạy thẳng trong endpoint async sẽ chặn event loop
+và làm khựng mọi WebSocket của worker. Ở đây việc được đẩy sang PASSWORD_HASH_WORKERS
+thread (bcrypt nhả GIL khi tính), tối đa PASSWORD_HASH_MAX_PENDING việc chờ + đang chạy.
+Vượt ngưỡng -> HTTP 503 + Retry-After thay vì xếp hàng vô hạn.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+RETRY_AFTER = "1"
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="hash")
+_pending = 0
+_stats = {
+    "completed_total": 0,
+    "rejected_total": 0,
+    "max_pending": 0,
+    "busy_seconds_total": 0.0,
+}
+
+
+async def run(fn: Callable[..., Any], *args) -> Any:
+    """Chạy fn(*args) trong pool. Raises HTTPException 503 khi pool quá tải."""
+    global _pending
+    if _pending >= MAX_PENDING:
+        _stats["rejected_total"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": RETRY_AFTER},
+        )
+    _pending += 1
+    _stats["max_pending"] = max(_stats["max_pending"], _pending)
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _pending -= 1
+        _stats["completed_total"] += 1
+        _stats["busy_seconds_total"] += time.perf_counter() - started
+
+
+def stats() -> dict:
+    return {
+        "workers": WORKERS,
+        "max_pending_allowed": MAX_PENDING,
+        "pending": _pending,
+        "queued": max(0, _pending - WORKERS),
+        **_stats,
+        "busy_seconds_total": round(_stats["busy_seconds_total"], 3),
+    }
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,189 @@
+# app/core/layered_cache.py
+"""
+Cache 2 tầng cho dữ liệu nhỏ, đọc rất nhiều, ít đổi (vd: dòng Game "Caro").
+
+    RAM (LRU + TTL, mỗi worker)  ->  Redis (chia sẻ giữa worker)  ->  loader() (DB)
+
+- Single-flight: nhiều request cùng miss 1 key trong 1 worker chỉ gọi loader() 1 lần,
+  các request còn lại await cùng kết quả.
+- Redis lỗi -> bỏ qua tầng Redis trong REDIS_RETRY_AFTER giây (không chờ timeout mỗi lần),
+  cache vẫn chạy với RAM + DB.
+- loader() trả None = không tồn tại, không cache (lần sau load lại).
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.cache import get_redis
+from app.core.log import get_logger
+
+log = get_logger("layered_cache")
+
+REDIS_RETRY_AFTER = 30.0  # giây bỏ qua Redis sau 1 lỗi
+
+Loader = Callable[[], Awaitable[Optional[Any]]]
+
+_redis_down_until = 0.0
+_caches: Dict[str, "LayeredCache"] = {}
+
+
+class TTLCache:
+    """LRU (OrderedDict) với hạn riêng cho từng key (epoch seconds)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value, expires_at: float):
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _redis_available() -> bool:
+    return time.monotonic() >= _redis_down_until
+
+
+def _redis_failed(action: str, e: Exception):
+    global _redis_down_until
+    if _redis_available():
+        log.warning("redis_unavailable", action=action, bypass_seconds=REDIS_RETRY_AFTER, error=e)
+    _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+
+
+class LayeredCache:
+    """1 namespace của cache 2 tầng. Value phải JSON-serializable."""
+
+    def __init__(self, namespace: str, maxsize: int = 1000, local_ttl: float = 60, redis_ttl: int = 300):
+        self.namespace = namespace
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self._local = TTLCache(maxsize)
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        self._stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "redis_errors": 0,
+            "local_seconds_total": 0.0,
+            "redis_seconds_total": 0.0,
+            "load_seconds_total": 0.0,
+        }
+        _caches[namespace] = self
+
+    def _redis_key(self, key) -> str:
+        return f"lcache:{self.namespace}:{key}"
+
+    async def get(self, key, load: Loader) -> Optional[Any]:
+        started = time.perf_counter()
+        value = self._local.get(key)
+        if value is not None:
+            self._stats["local_hits"] += 1
+            self._stats["local_seconds_total"] += time.perf_counter() - started
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise  # chính request này bị hủy
+                # Request đang load bị hủy (client ngắt) -> tự load
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._fetch(key, load, started)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # không ai chờ thì cũng không log "never retrieved"
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def _fetch(self, key, load: Loader, started: float) -> Optional[Any]:
+        if _redis_available():
+            try:
+                client = await get_redis()
+                data = await client.get(self._redis_key(key))
+                if data is not None:
+                    value = json.loads(data)
+                    self._local.set(key, value, time.time() + self.local_ttl)
+                    self._stats["redis_hits"] += 1
+                    self._stats["redis_seconds_total"] += time.perf_counter() - started
+                    return value
+            except Exception as e:
+                self._stats["redis_errors"] += 1
+                _redis_failed("GET", e)
+
+        self._stats["misses"] += 1
+        load_started = time.perf_counter()
+        value = await load()
+        self._stats["load_seconds_total"] += time.perf_counter() - load_started
+        if value is None:
+            return None
+
+        self._local.set(key, value, time.time() + self.local_ttl)
+        if _redis_available():
+            try:
+                client = await get_redis()
+                await client.setex(self._redis_key(key), self.redis_ttl, json.dumps(value))
+            except Exception as e:
+                self._stats["redis_errors"] += 1
+                _redis_failed("SET", e)
+        return value
+
+    async def invalidate(self, key):
+        """Xóa key ở RAM worker này + Redis (worker khác hết hạn sau local_ttl)."""
+        self._local.pop(key)
+        try:
+            client = await get_redis()
+            await client.delete(self._redis_key(key))
+        except Exception as e:
+            self._stats["redis_errors"] += 1
+            _redis_failed("DELETE", e)
+
+    def stats(self) -> dict:
+        # coalesced = chờ chung 1 lần load, không tự chạm DB -> tính là hit
+        hits = self._stats["local_hits"] + self._stats["redis_hits"] + self._stats["coalesced"]
+        lookups = hits + self._stats["misses"]
+        return {
+            "entries": len(self._local),
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            **{k: round(v, 6) if isinstance(v, float) else v for k, v in self._stats.items()},
+        }
+
+
+def stats() -> dict:
+    return {
+        "redis_available": _redis_available(),
+        "caches": {name: cache.stats() for name, cache in _caches.items()},
+    }
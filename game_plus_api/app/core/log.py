@@ -0,0 +1,177 @@
+# app/core/log.py
+"""
+Structured logging không chặn event loop (thay cho print trên hot path).
+
+    log = get_logger("realtime")
+    log.info("match_ended", match_id=12, winner_id=3, reason="win")
+    # 2026-01-01T10:00:00.123 INFO realtime match_ended match_id=12 winner_id=3 reason=win
+
+- Event loop chỉ put_nowait record vào hàng đợi RAM; 1 thread nền format (kể cả traceback)
+  và ghi stdout. Hàng đợi đầy (LOG_QUEUE_SIZE) -> bỏ record và đếm, không bao giờ block.
+- Sự kiện tỉ lệ với traffic (mỗi nước đi, mỗi lần gửi) để DEBUG hoặc info(..., sample=SAMPLE_RATE).
+- warning / error: tối đa LOG_BURST record cho mỗi event trong LOG_BURST_WINDOW giây,
+  record kế tiếp mang suppressed=N -> Redis / DB sập không làm ngập log.
+- LOG_LEVEL (INFO), LOG_FORMAT=text | json (1 dòng JSON / record), LOG_SAMPLE_RATE (0.01).
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+BURST = int(os.getenv("LOG_BURST", "10"))
+BURST_WINDOW = float(os.getenv("LOG_BURST_WINDOW", "10"))
+SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))  # sample cho event info tỉ lệ với traffic
+
+ROOT = "gameplus"
+
+_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(QUEUE_SIZE)
+_listener: Optional[logging.handlers.QueueListener] = None
+_windows: Dict[Tuple[str, str], List[float]] = {}  # (logger, event) -> [bắt đầu cửa sổ, số record, số bị chặn]
+_stats = {"enqueued_total": 0, "dropped_total": 0, "sampled_out_total": 0, "suppressed_total": 0}
+
+
+def _plain(value):
+    if isinstance(value, BaseException):
+        return f"{type(value).__name__}: {value}"  # error=e: không mất tên exception khi str(e) rỗng
+    return value
+
+
+def _text_value(value) -> str:
+    text = str(_plain(value))
+    return json.dumps(text, ensure_ascii=False) if (not text or " " in text or "=" in text) else text
+
+
+class _Formatter(logging.Formatter):
+    """Chạy trong thread của listener, không trên event loop."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", {})
+        ts = datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds")
+        logger = record.name[len(ROOT) + 1:] or ROOT
+        exc = self.formatException(record.exc_info) if record.exc_info else None
+        if LOG_FORMAT == "json":
+            data = {"ts": ts, "level": record.levelname, "logger": logger, "event": record.getMessage(),
+                    **{key: _plain(value) for key, value in fields.items()}}
+            if exc:
+                data["exc"] = exc
+            return json.dumps(data, ensure_ascii=False, default=str)
+        line = " ".join(
+            [ts, record.levelname, logger, record.getMessage()]
+            + [f"{key}={_text_value(value)}" for key, value in fields.items()]
+        )
+        return f"{line}\n{exc}" if exc else line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record  # không format ở đây (QueueHandler mặc định format cả traceback trên event loop)
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            _stats["enqueued_total"] += 1
+        except queue.Full:
+            _stats["dropped_total"] += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # hàng đợi có thể đang đầy lúc shutdown -> chờ thread xả
+
+
+def setup():
+    """Gọi 1 lần khi app khởi động: gắn QueueHandler + thread ghi stdout."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(_Formatter())
+    root = logging.getLogger(ROOT)
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [_QueueHandler(_queue)]
+    root.propagate = False
+    _listener = _QueueListener(_queue, output)
+    _listener.start()
+
+
+def shutdown():
+    """Ghi nốt record còn trong hàng đợi rồi dừng thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _throttle(logger: str, event: str) -> Optional[int]:
+    """None = chặn record này; số >= 0 = cho ghi, kèm số record đã bị chặn trước đó."""
+    now = time.monotonic()
+    window = _windows.get((logger, event))
+    if window is None or now - window[0] >= BURST_WINDOW:
+        _windows[(logger, event)] = [now, 1, 0]
+        return int(window[2]) if window else 0
+    if window[1] >= BURST:
+        window[2] += 1
+        _stats["suppressed_total"] += 1
+        return None
+    window[1] += 1
+    return 0
+
+
+class StructLogger:
+    """Logger theo event: tên event cố định + fields key=value (không ghép f-string)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._logger = logging.getLogger(f"{ROOT}.{name}")
+
+    def debug(self, event: str, *, sample: float = 1.0, **fields):
+        self._log(logging.DEBUG, event, fields, sample=sample)
+
+    def info(self, event: str, *, sample: float = 1.0, **fields):
+        self._log(logging.INFO, event, fields, sample=sample)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields):
+        """error kèm traceback của exception đang xử lý (traceback được format ở thread nền)."""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+    def _log(self, level: int, event: str, fields: dict, sample: float = 1.0, exc_info: bool = False):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample < 1.0:
+            if random.random() >= sample:
+                _stats["sampled_out_total"] += 1
+                return
+            fields["sample"] = sample
+        if level >= logging.WARNING:
+            suppressed = _throttle(self.name, event)
+            if suppressed is None:
+                return
+            if suppressed:
+                fields["suppressed"] = suppressed
+        self._logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+
+def get_logger(name: str) -> StructLogger:
+    return StructLogger(name)
+
+
+def stats() -> dict:
+    return {"queued": _queue.qsize(), "queue_size": QUEUE_SIZE, **_stats}
@@ -0,0 +1,531 @@
+# app/core/match_bus.py
+"""
+Match bus giữa các uvicorn workers qua Redis pub/sub.
+
+Mỗi trận có đúng 1 worker "owner" giữ RoomState (key match:owner:{id} trong Redis).
+Worker khác nhận WebSocket của trận đó sẽ làm proxy:
+- Message từ client -> publish vào inbox của trận (match:bus:{id}:in), owner xử lý.
+- Owner gửi về client qua RemoteSocket -> publish vào channel của worker proxy
+  (match:bus:worker:{worker_id}), worker đó chuyển tiếp xuống socket thật.
+
+Spectator: owner publish frame (đã throttle) vào match:spectate:{id}; worker nào có
+người xem trận đó subscribe channel này và fan-out xuống socket local. Owner chỉ
+publish khi kênh còn subscriber (người xem mới gửi event "spectate" vào inbox).
+
+Room directory: thay đổi phòng chờ được publish vào rooms:events, mọi worker áp vào
+directory trong RAM của mình (app/core/room_directory.py).
+
+Auth cache: đổi / xóa user được publish vào auth:events, mọi worker bỏ bản cache local
+(app/core/auth_cache.py).
+
+Khi Redis không dùng được, mọi trận được host local (hành vi single-worker cũ).
+"""
+import asyncio
+import json
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from app.core import fanout
+from app.core.cache import get_redis
+from app.core.log import get_logger
+
+log = get_logger("match_bus")
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+OWNER_KEY_PREFIX = "match:owner:"
+INBOX_CHANNEL_PREFIX = "match:bus:"
+WORKER_CHANNEL_PREFIX = "match:bus:worker:"
+SPECTATE_CHANNEL_PREFIX = "match:spectate:"
+ROOM_EVENTS_CHANNEL = "rooms:events"
+AUTH_EVENTS_CHANNEL = "auth:events"
+
+OWNER_TTL = int(os.getenv("MATCH_OWNER_TTL", "30"))  # giây, được heartbeat gia hạn
+FRAME_TTL = int(os.getenv("SPECTATOR_FRAME_TTL", "600"))  # giữ frame cuối cho người xem vào sau
+END_OF_FRAMES = ""  # frame rỗng trên kênh spectate = trận thôi phát, đóng người xem
+
+# Compare-and-delete: chỉ xóa owner key nếu vẫn là giá trị mình biết
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Compare-and-expire: chỉ gia hạn owner key còn là của worker này
+# KEYS = owner keys; ARGV[1] = worker_id, ARGV[2] = TTL. Returns: vị trí (1-based) các key đã mất
+_EXTEND_SCRIPT = """
+local lost = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('EXPIRE', key, ARGV[2])
+    else
+        table.insert(lost, i)
+    end
+end
+return lost
+"""
+
+RemoteHandler = Callable[[int, dict], Awaitable[None]]
+FrameHandler = Callable[[str], None]
+RoomEventHandler = Callable[[dict], Awaitable[None]]
+AuthEventHandler = Callable[[dict], None]
+
+_pubsub = None
+_listener_task: Optional[asyncio.Task] = None
+_heartbeat_task: Optional[asyncio.Task] = None
+_enabled = False
+
+_owned: Set[int] = set()                          # match_id do worker này host
+_claims: Dict[int, asyncio.Task] = {}             # match_id -> claim đang chạy (gộp request cùng trận)
+_inboxes: Dict[int, asyncio.Queue] = {}           # match_id -> queue event từ proxy
+_inbox_tasks: Dict[int, asyncio.Task] = {}        # match_id -> consumer task
+_local_sockets: Dict[str, fanout.Outbox] = {}     # conn_id -> outbox của socket thật (phía proxy)
+_frame_handlers: Dict[int, FrameHandler] = {}     # match_id -> fan-out frame cho spectator local
+_remote_handler: Optional[RemoteHandler] = None
+_room_event_handler: Optional[RoomEventHandler] = None
+_auth_event_handler: Optional[AuthEventHandler] = None
+
+
+def _owner_key(match_id: int) -> str:
+    return f"{OWNER_KEY_PREFIX}{match_id}"
+
+
+def _inbox_channel(match_id: int) -> str:
+    return f"{INBOX_CHANNEL_PREFIX}{match_id}:in"
+
+
+def _worker_channel(worker_id: str) -> str:
+    return f"{WORKER_CHANNEL_PREFIX}{worker_id}"
+
+
+def _spectate_channel(match_id: int) -> str:
+    return f"{SPECTATE_CHANNEL_PREFIX}{match_id}"
+
+
+def _last_frame_key(match_id: int) -> str:
+    return f"{SPECTATE_CHANNEL_PREFIX}{match_id}:last"
+
+
+def new_conn_id() -> str:
+    return uuid.uuid4().hex
+
+
+class RemoteSocket:
+    """
+    Giả lập WebSocket cho client đang kết nối ở worker khác.
+    Owner dùng như socket thường (send_text/close), dữ liệu đi qua pub/sub.
+    """
+
+    def __init__(self, worker_id: str, conn_id: str):
+        self.worker_id = worker_id
+        self.conn_id = conn_id
+
+    async def send_text(self, data: str):
+        client = await get_redis()
+        receivers = await client.publish(
+            _worker_channel(self.worker_id),
+            json.dumps({"conn_id": self.conn_id, "data": data}),
+        )
+        if not receivers:
+            raise ConnectionError(f"Worker {self.worker_id} is gone")
+
+    async def close(self, code: int = 1000):
+        client = await get_redis()
+        await client.publish(
+            _worker_channel(self.worker_id),
+            json.dumps({"conn_id": self.conn_id, "close": True, "code": code}),
+        )
+
+
+# ==== Lifecycle ====
+
+async def start(
+    remote_handler: RemoteHandler,
+    room_event_handler: Optional[RoomEventHandler] = None,
+    auth_event_handler: Optional[AuthEventHandler] = None,
+):
+    """Subscribe channel của worker và bắt đầu nghe bus (gọi lúc startup)."""
+    global _pubsub, _listener_task, _heartbeat_task, _enabled
+    global _remote_handler, _room_event_handler, _auth_event_handler
+    _remote_handler = remote_handler
+    _room_event_handler = room_event_handler
+    _auth_event_handler = auth_event_handler
+    try:
+        client = await get_redis()
+        _pubsub = client.pubsub()
+        await _pubsub.subscribe(_worker_channel(WORKER_ID))
+        if room_event_handler is not None:
+            await _pubsub.subscribe(ROOM_EVENTS_CHANNEL)
+        if auth_event_handler is not None:
+            await _pubsub.subscribe(AUTH_EVENTS_CHANNEL)
+    except Exception as e:
+        log.warning("disabled_redis_unavailable", error=e)
+        _pubsub = None
+        _enabled = False
+        return
+
+    _enabled = True
+    _listener_task = asyncio.create_task(_listen())
+    _heartbeat_task = asyncio.create_task(_heartbeat())
+    log.info("started", worker=WORKER_ID)
+
+
+async def stop():
+    """Nhả ownership các trận đang host và đóng pub/sub (gọi lúc shutdown)."""
+    global _pubsub, _listener_task, _heartbeat_task, _enabled
+    _enabled = False
+    for task in [_listener_task, _heartbeat_task, *_inbox_tasks.values()]:
+        if task and not task.done():
+            task.cancel()
+    _inbox_tasks.clear()
+    _inboxes.clear()
+    _frame_handlers.clear()
+
+    for match_id in list(_owned):
+        await release_match(match_id)
+
+    if _pubsub is not None:
+        try:
+            await _pubsub.unsubscribe()
+            await _pubsub.close()
+        except Exception:
+            pass
+    _pubsub = None
+    _listener_task = None
+    _heartbeat_task = None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+# ==== Ownership ====
+
+async def claim_match(match_id: int) -> str:
+    """
+    Nhận host trận nếu chưa có owner.
+    Returns: worker_id của owner (WORKER_ID nếu worker này host).
+    """
+    if not _enabled:
+        return WORKER_ID
+    if match_id in _owned:
+        return WORKER_ID
+    task = _claims.get(match_id)
+    if task is None:
+        task = _claims[match_id] = asyncio.create_task(_claim(match_id))
+        task.add_done_callback(lambda _: _claims.pop(match_id, None))
+    return await asyncio.shield(task)
+
+
+async def _claim(match_id: int) -> str:
+    try:
+        client = await get_redis()
+        key = _owner_key(match_id)
+        if await _set_owner(client, match_id):
+            return WORKER_ID
+        owner = await client.get(key)
+        if owner is None:
+            # Key vừa hết hạn giữa SET và GET -> thử lại 1 lần
+            if await _set_owner(client, match_id):
+                return WORKER_ID
+            owner = await client.get(key) or WORKER_ID
+        if owner == WORKER_ID and match_id not in _owned:
+            await _pubsub.subscribe(_inbox_channel(match_id))
+            _host(match_id)
+        return owner
+    except Exception as e:
+        log.warning("claim_failed_hosting_locally", match_id=match_id, error=e)
+        return WORKER_ID
+
+
+async def _set_owner(client, match_id: int) -> bool:
+    """
+    SET NX owner key, sau khi đã subscribe inbox: proxy đọc thấy owner mới thì
+    publish luôn có người nhận (không bị coi là owner chết và take_over nhầm).
+    """
+    channel = _inbox_channel(match_id)
+    await _pubsub.subscribe(channel)
+    try:
+        claimed = await client.set(_owner_key(match_id), WORKER_ID, nx=True, ex=OWNER_TTL)
+    except Exception:
+        await _pubsub.unsubscribe(channel)
+        raise
+    if not claimed:
+        await _pubsub.unsubscribe(channel)
+        return False
+    _host(match_id)
+    return True
+
+
+async def take_over(match_id: int, stale_owner: str) -> str:
+    """Owner cũ không còn nghe inbox (worker chết) -> xóa key cũ và claim lại."""
+    try:
+        client = await get_redis()
+        await client.eval(_RELEASE_SCRIPT, 1, _owner_key(match_id), stale_owner)
+    except Exception as e:
+        log.warning("takeover_failed", match_id=match_id, error=e)
+    return await claim_match(match_id)
+
+
+async def release_match(match_id: int):
+    """Thôi host trận (room đã dọn hoặc worker shutdown)."""
+    _owned.discard(match_id)
+    task = _inbox_tasks.pop(match_id, None)
+    if task and not task.done():
+        task.cancel()
+    _inboxes.pop(match_id, None)
+    try:
+        if _pubsub is not None:
+            await _pubsub.unsubscribe(_inbox_channel(match_id))
+        client = await get_redis()
+        await client.eval(_RELEASE_SCRIPT, 1, _owner_key(match_id), WORKER_ID)
+    except Exception as e:
+        log.warning("release_failed", match_id=match_id, error=e)
+
+
+def _host(match_id: int):
+    """Bắt đầu xử lý inbox của trận (caller đã subscribe channel inbox)."""
+    if match_id in _owned:
+        return
+    _owned.add(match_id)
+    queue: asyncio.Queue = asyncio.Queue()
+    _inboxes[match_id] = queue
+    _inbox_tasks[match_id] = asyncio.create_task(_consume_inbox(match_id, queue))
+
+
+# ==== Proxy side ====
+
+def register_local_socket(conn_id: str, websocket):
+    """Socket phía proxy đi qua Outbox như socket local: listener chỉ xếp hàng, không chờ mạng."""
+    _local_sockets[conn_id] = fanout.Outbox(websocket, name=f"proxy {conn_id}", policy=fanout.POLICY_DROP)
+
+
+def unregister_local_socket(conn_id: str):
+    outbox = _local_sockets.pop(conn_id, None)
+    if outbox is not None:
+        outbox.close()
+
+
+async def send_to_owner(match_id: int, event: dict) -> int:
+    """
+    Gửi event (join/message/leave/spectate) từ worker khác tới owner.
+    Returns: số subscriber nhận được (0 = owner không còn sống).
+    """
+    event = {**event, "worker_id": WORKER_ID}
+    try:
+        client = await get_redis()
+        return await client.publish(_inbox_channel(match_id), json.dumps(event))
+    except Exception as e:
+        log.warning("publish_failed", match_id=match_id, error=e)
+        return 0
+
+
+# ==== Spectator frames ====
+
+async def publish_frame(match_id: int, data: str) -> Optional[int]:
+    """
+    Owner: phát frame cho spectator ở mọi worker + lưu làm frame cuối.
+    Returns: số worker đang nghe kênh spectate (None nếu Redis lỗi).
+    """
+    if not _enabled:
+        return 0
+    try:
+        client = await get_redis()
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.publish(_spectate_channel(match_id), data)
+            pipe.set(_last_frame_key(match_id), data, ex=FRAME_TTL)
+            receivers, _ = await pipe.execute()
+        return receivers
+    except Exception as e:
+        log.warning("frame_publish_failed", match_id=match_id, error=e)
+        return None
+
+
+async def frame_watchers(match_id: int) -> int:
+    """Số worker đang subscribe kênh spectate của trận (PUBSUB NUMSUB)."""
+    if not _enabled:
+        return 0
+    try:
+        client = await get_redis()
+        [(_, count)] = await client.pubsub_numsub(_spectate_channel(match_id))
+        return int(count)
+    except Exception as e:
+        log.warning("frame_watchers_failed", match_id=match_id, error=e)
+        return 1  # không biết -> cứ publish như khi có người xem
+
+
+async def request_frame(match_id: int) -> bool:
+    """Viewer ở worker khác vừa vào xem: nhờ owner phát frame mới. False = trận không có owner."""
+    if not _enabled:
+        return False
+    return await send_to_owner(match_id, {"kind": "spectate"}) > 0
+
+
+async def end_frames(match_id: int):
+    """Owner: báo spectator ở mọi worker là trận thôi phát + xóa frame cuối."""
+    if not _enabled:
+        return
+    try:
+        client = await get_redis()
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.publish(_spectate_channel(match_id), END_OF_FRAMES)
+            pipe.delete(_last_frame_key(match_id))
+            await pipe.execute()
+    except Exception as e:
+        log.warning("frame_end_failed", match_id=match_id, error=e)
+
+
+async def last_frame(match_id: int) -> Optional[str]:
+    """Frame gần nhất của trận (None nếu trận không còn phát hoặc bus tắt)."""
+    if not _enabled:
+        return None
+    try:
+        client = await get_redis()
+        return await client.get(_last_frame_key(match_id))
+    except Exception as e:
+        log.warning("frame_read_failed", match_id=match_id, error=e)
+        return None
+
+
+async def watch_frames(match_id: int, handler: FrameHandler):
+    """Worker có spectator của trận host ở nơi khác: nhận frame qua pub/sub."""
+    if not _enabled or match_id in _frame_handlers:
+        return
+    _frame_handlers[match_id] = handler
+    try:
+        await _pubsub.subscribe(_spectate_channel(match_id))
+    except Exception as e:
+        _frame_handlers.pop(match_id, None)
+        log.warning("watch_failed", match_id=match_id, error=e)
+
+
+async def unwatch_frames(match_id: int):
+    if _frame_handlers.pop(match_id, None) is None:
+        return
+    try:
+        if _pubsub is not None:
+            await _pubsub.unsubscribe(_spectate_channel(match_id))
+    except Exception as e:
+        log.warning("unwatch_failed", match_id=match_id, error=e)
+
+
+# ==== Room directory ====
+
+async def publish_room_event(event: dict) -> bool:
+    """Phát thay đổi phòng cho mọi worker (kể cả worker này). False nếu bus không dùng được."""
+    if not _enabled or _room_event_handler is None:
+        return False
+    try:
+        client = await get_redis()
+        await client.publish(ROOM_EVENTS_CHANNEL, json.dumps(event))
+        return True
+    except Exception as e:
+        log.warning("room_event_publish_failed", error=e)
+        return False
+
+
+# ==== Auth cache ====
+
+async def publish_auth_event(event: dict) -> bool:
+    """Phát invalidation của auth cache cho mọi worker (kể cả worker này). False nếu bus không dùng được."""
+    if not _enabled or _auth_event_handler is None:
+        return False
+    try:
+        client = await get_redis()
+        await client.publish(AUTH_EVENTS_CHANNEL, json.dumps(event))
+        return True
+    except Exception as e:
+        log.warning("auth_event_publish_failed", error=e)
+        return False
+
+
+# ==== Internals ====
+
+async def _listen():
+    """Đọc toàn bộ message pub/sub của worker và phân phối."""
+    worker_channel = _worker_channel(WORKER_ID)
+    while _enabled:
+        try:
+            message = await _pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is None:
+                continue
+            channel = message["channel"]
+            if channel.startswith(SPECTATE_CHANNEL_PREFIX):
+                # Frame đã serialize sẵn, chuyển nguyên chuỗi
+                handler = _frame_handlers.get(int(channel[len(SPECTATE_CHANNEL_PREFIX):]))
+                if handler is not None:
+                    handler(message["data"])
+                continue
+            data = json.loads(message["data"])
+            if channel == worker_channel:
+                _deliver_local(data)
+            elif channel == ROOM_EVENTS_CHANNEL:
+                if _room_event_handler is not None:
+                    await _room_event_handler(data)
+            elif channel == AUTH_EVENTS_CHANNEL:
+                if _auth_event_handler is not None:
+                    _auth_event_handler(data)
+            else:
+                match_id = int(channel[len(INBOX_CHANNEL_PREFIX):].split(":", 1)[0])
+                queue = _inboxes.get(match_id)
+                if queue is not None:
+                    queue.put_nowait(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("listener_failed", error=e)
+            await asyncio.sleep(0.5)
+
+
+def _deliver_local(data: dict):
+    conn_id = data.get("conn_id")
+    outbox = _local_sockets.get(conn_id)
+    if outbox is None:
+        return
+    if data.get("close"):
+        _local_sockets.pop(conn_id, None)
+        outbox.close_when_drained(data.get("code", 1000))  # gửi nốt message đang chờ rồi mới đóng
+    elif not outbox.send(data["data"]):
+        log.debug("proxy_socket_closed", conn_id=conn_id)
+        _local_sockets.pop(conn_id, None)
+
+
+async def _consume_inbox(match_id: int, queue: asyncio.Queue):
+    """Xử lý tuần tự event của 1 trận để giữ đúng thứ tự join -> message -> leave."""
+    while True:
+        event = await queue.get()
+        try:
+            if _remote_handler is not None:
+                await _remote_handler(match_id, event)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("remote_event_failed", match_id=match_id, kind=event.get("kind"))
+
+
+async def _heartbeat():
+    """Gia hạn TTL owner key của các trận đang host."""
+    while True:
+        await asyncio.sleep(max(1, OWNER_TTL // 3))
+        if not _owned:
+            continue
+        try:
+            await _extend_owned()
+        except Exception as e:
+            log.warning("heartbeat_failed", error=e)
+
+
+async def _extend_owned():
+    """Compare-and-expire; key đã thuộc worker khác (bị take over) -> thôi host trận đó."""
+    match_ids = list(_owned)
+    client = await get_redis()
+    lost = await client.eval(
+        _EXTEND_SCRIPT, len(match_ids), *[_owner_key(m) for m in match_ids], WORKER_ID, OWNER_TTL,
+    )
+    for index in lost:
+        match_id = match_ids[int(index) - 1]
+        log.warning("ownership_lost", match_id=match_id)
+        await release_match(match_id)
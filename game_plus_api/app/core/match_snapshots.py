@@ -0,0 +1,125 @@
+# app/core/match_snapshots.py
+"""
+Snapshot gọn của trận đang chơi (RoomState) trong Redis để worker khởi động lại
+(restart / bị recycle sau limit_max_requests) dựng lại room mà không replay bảng moves.
+
+- Owner gọi mark_dirty() sau mỗi event; mỗi trận có tối đa 1 lệnh SET đang bay,
+  event tới trong lúc đó được gộp -> luôn ghi trạng thái mới nhất, không xếp hàng.
+- Key match:snapshot:{id}, TTL MATCH_SNAPSHOT_TTL giây (trận bỏ dở tự hết hạn).
+- Trận kết thúc -> discard(); DB là nguồn dữ liệu cho trận đã xong.
+- Redis lỗi: chỉ log, room vẫn khôi phục được từ DB như trước.
+"""
+import asyncio
+import json
+import os
+from typing import Callable, Dict, Optional, Set
+
+from app.core.cache import get_redis
+from app.core.log import get_logger
+
+log = get_logger("match_snapshots")
+
+SNAPSHOT_TTL = int(os.getenv("MATCH_SNAPSHOT_TTL", "3600"))
+SNAPSHOT_VERSION = 1
+
+SnapshotBuilder = Callable[[], dict]
+
+_pending: Dict[int, SnapshotBuilder] = {}   # match_id -> builder của trạng thái mới nhất
+_writers: Dict[int, asyncio.Task] = {}
+_saved: Set[int] = set()                    # trận có snapshot trong Redis do worker này host
+_stats = {"writes_total": 0, "coalesced_total": 0, "restores_total": 0, "errors_total": 0}
+
+
+def _key(match_id: int) -> str:
+    return f"match:snapshot:{match_id}"
+
+
+def mark_dirty(match_id: int, build: SnapshotBuilder):
+    """Trận vừa đổi trạng thái: hẹn ghi snapshot (gộp nếu đang có lệnh ghi)."""
+    if match_id in _pending:
+        _stats["coalesced_total"] += 1
+    _pending[match_id] = build
+    _saved.add(match_id)
+    writer = _writers.get(match_id)
+    if writer is None or writer.done():
+        _writers[match_id] = asyncio.create_task(_write_loop(match_id))
+
+
+async def _write_loop(match_id: int):
+    try:
+        while match_id in _pending:
+            build = _pending.pop(match_id)
+            await _write(match_id, build)
+    finally:
+        if _writers.get(match_id) is asyncio.current_task():
+            del _writers[match_id]
+
+
+async def _write(match_id: int, build: SnapshotBuilder):
+    try:
+        data = json.dumps({"v": SNAPSHOT_VERSION, **build()})
+        client = await get_redis()
+        await client.setex(_key(match_id), SNAPSHOT_TTL, data)
+        _stats["writes_total"] += 1
+    except Exception as e:
+        _stats["errors_total"] += 1
+        log.warning("snapshot_write_failed", match_id=match_id, error=e)
+
+
+async def load(match_id: int) -> Optional[dict]:
+    """
+    Snapshot cuối của trận (None nếu không có / khác version / Redis lỗi).
+    Chỉ đọc: worker proxy cũng gọi, restored() đánh dấu khi room thực sự được dựng.
+    """
+    try:
+        client = await get_redis()
+        data = await client.get(_key(match_id))
+    except Exception as e:
+        _stats["errors_total"] += 1
+        log.warning("snapshot_read_failed", match_id=match_id, error=e)
+        return None
+    if not data:
+        return None
+    snapshot = json.loads(data)
+    if snapshot.get("v") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def restored(match_id: int):
+    """Room được dựng từ snapshot ở worker này: từ giờ worker này chịu trách nhiệm xóa key."""
+    _saved.add(match_id)
+    _stats["restores_total"] += 1
+
+
+async def discard(match_id: int):
+    """Trận kết thúc / room bị dọn: bỏ snapshot đang chờ ghi và xóa key (1 lần)."""
+    _pending.pop(match_id, None)
+    if match_id not in _saved:
+        return
+    _saved.discard(match_id)
+    writer = _writers.get(match_id)
+    if writer is not None and writer is not asyncio.current_task():
+        # Chờ lệnh SET đang bay xong rồi mới DELETE (tránh SET tới sau làm sống lại snapshot)
+        await asyncio.gather(writer, return_exceptions=True)
+    try:
+        client = await get_redis()
+        await client.delete(_key(match_id))
+    except Exception as e:
+        _stats["errors_total"] += 1
+        log.warning("snapshot_delete_failed", match_id=match_id, error=e)
+
+
+async def flush():
+    """Shutdown: ghi nốt mọi snapshot đang chờ."""
+    for match_id in list(_pending):
+        build = _pending.pop(match_id, None)
+        if build is not None:
+            await _write(match_id, build)
+    writers = [task for task in _writers.values() if not task.done()]
+    if writers:
+        await asyncio.gather(*writers, return_exceptions=True)
+
+
+def stats() -> dict:
+    return {"live": len(_saved), "pending": len(_pending), "writers": len(_writers), **_stats}
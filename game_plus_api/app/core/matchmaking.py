@@ -0,0 +1,227 @@
+# app/core/matchmaking.py
+"""
+Matchmaking engine theo rating.
+
+Người chờ được lưu trong Redis sorted set mm:queue:{game_id} (score = rating).
+Mỗi người tự thử ghép cặp định kỳ với cửa sổ rating nới rộng dần theo thời gian chờ;
+việc chọn đối thủ + xóa cả 2 khỏi queue chạy trong 1 Lua script nên atomic giữa các worker.
+match_found được đẩy thẳng tới socket của cả 2 người (qua match bus nếu khác worker),
+không còn poll DB.
+
+Khi Redis không dùng được, dùng queue in-memory của worker hiện tại.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from app.core.cache import get_redis
+from app.core import match_bus
+from app.core.log import get_logger
+
+log = get_logger("matchmaking")
+
+QUEUE_KEY_PREFIX = "mm:queue:"
+WORKER_KEY = "mm:worker"  # hash user_id -> worker_id đang giữ socket
+JOINED_KEY = "mm:joined"  # hash user_id -> thời điểm vào queue (epoch, dùng để chia X / O)
+
+BASE_WINDOW = int(os.getenv("MM_BASE_WINDOW", "50"))           # ±rating lúc mới vào queue
+WINDOW_GROWTH = int(os.getenv("MM_WINDOW_GROWTH", "25"))       # nới thêm mỗi giây chờ
+MAX_WINDOW = int(os.getenv("MM_MAX_WINDOW", "600"))
+CANDIDATES_PER_SIDE = 10
+
+# KEYS[1] = queue; ARGV = user_id, rating, window, số ứng viên mỗi phía
+# Lấy ứng viên gần nhất ở 2 phía rating, xóa cả 2 khỏi queue trong cùng 1 script.
+_PAIR_SCRIPT = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return false
+end
+local r = tonumber(ARGV[2])
+local w = tonumber(ARGV[3])
+local n = tonumber(ARGV[4])
+local best, best_d = false, false
+local function pick(list)
+    for i = 1, #list, 2 do
+        if list[i] ~= ARGV[1] then
+            local d = math.abs(tonumber(list[i + 1]) - r)
+            if not best_d or d < best_d then
+                best, best_d = list[i], d
+            end
+        end
+    end
+end
+pick(redis.call('ZRANGEBYSCORE', KEYS[1], r, r + w, 'WITHSCORES', 'LIMIT', 0, n))
+pick(redis.call('ZREVRANGEBYSCORE', KEYS[1], r, r - w, 'WITHSCORES', 'LIMIT', 0, n))
+if not best then
+    return false
+end
+redis.call('ZREM', KEYS[1], ARGV[1], best)
+return best
+"""
+
+
+class QueueTicket:
+    """Vé chờ của 1 người trong queue; `found` được set khi match_found đã tới socket."""
+
+    def __init__(self, game_id: int, user_id: int, rating: int, websocket):
+        self.game_id = game_id
+        self.user_id = user_id
+        self.rating = rating
+        self.websocket = websocket
+        self.joined_at = time.monotonic()
+        self.queued_at = time.time()
+        self.found = asyncio.Event()
+
+    @property
+    def conn_id(self) -> str:
+        return f"mm:{self.user_id}"
+
+    def window(self) -> int:
+        waited = time.monotonic() - self.joined_at
+        return min(MAX_WINDOW, BASE_WINDOW + int(waited * WINDOW_GROWTH))
+
+    async def send_text(self, data: str):
+        """Được match bus gọi khi worker khác đẩy match_found tới."""
+        await self.websocket.send_text(data)
+        self.found.set()
+
+    async def close(self, code: int = 1000):
+        await self.websocket.close(code=code)
+
+
+_tickets: Dict[int, QueueTicket] = {}                     # user_id -> ticket ở worker này
+_local_queues: Dict[int, Dict[int, int]] = {}             # fallback: game_id -> {user_id: rating}
+_local_lock = asyncio.Lock()
+_seen_games: set = set()                                  # game_id từng có queue (cho metrics)
+
+
+def _queue_key(game_id: int) -> str:
+    return f"{QUEUE_KEY_PREFIX}{game_id}"
+
+
+async def enqueue(ticket: QueueTicket) -> int:
+    """Đưa người chơi vào queue. Returns: số người đang chờ."""
+    _tickets[ticket.user_id] = ticket
+    match_bus.register_local_socket(ticket.conn_id, ticket)
+    if match_bus.is_enabled():
+        try:
+            client = await get_redis()
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.zadd(_queue_key(ticket.game_id), {str(ticket.user_id): ticket.rating})
+                pipe.hset(WORKER_KEY, str(ticket.user_id), match_bus.WORKER_ID)
+                pipe.hset(JOINED_KEY, str(ticket.user_id), ticket.queued_at)
+                pipe.zcard(_queue_key(ticket.game_id))
+                _, _, _, size = await pipe.execute()
+            return size
+        except Exception as e:
+            log.warning("enqueue_failed_using_local_queue", user_id=ticket.user_id, error=e)
+    async with _local_lock:
+        queue = _local_queues.setdefault(ticket.game_id, {})
+        queue[ticket.user_id] = ticket.rating
+        return len(queue)
+
+
+async def dequeue(ticket: QueueTicket) -> bool:
+    """Rời queue (cancel/disconnect). Returns: True nếu còn trong queue (chưa bị ghép)."""
+    if _tickets.get(ticket.user_id) is ticket:
+        _tickets.pop(ticket.user_id, None)
+        match_bus.unregister_local_socket(ticket.conn_id)
+    removed = False
+    if match_bus.is_enabled():
+        try:
+            client = await get_redis()
+            removed = bool(await client.zrem(_queue_key(ticket.game_id), str(ticket.user_id)))
+            await client.hdel(WORKER_KEY, str(ticket.user_id))
+            await client.hdel(JOINED_KEY, str(ticket.user_id))
+        except Exception as e:
+            log.warning("dequeue_failed", user_id=ticket.user_id, error=e)
+    async with _local_lock:
+        queue = _local_queues.get(ticket.game_id, {})
+        if queue.pop(ticket.user_id, None) is not None:
+            removed = True
+    return removed
+
+
+async def try_pair(ticket: QueueTicket) -> Optional[int]:
+    """
+    Thử ghép ticket với người có rating gần nhất trong cửa sổ hiện tại.
+    Atomic: nếu trả về opponent_id thì cả 2 đã bị xóa khỏi queue.
+    """
+    window = ticket.window()
+    if match_bus.is_enabled():
+        try:
+            client = await get_redis()
+            opponent = await client.eval(
+                _PAIR_SCRIPT, 1, _queue_key(ticket.game_id),
+                str(ticket.user_id), ticket.rating, window, CANDIDATES_PER_SIDE,
+            )
+            return int(opponent) if opponent else None
+        except Exception as e:
+            log.warning("pair_failed", user_id=ticket.user_id, error=e)
+    async with _local_lock:
+        queue = _local_queues.get(ticket.game_id, {})
+        if ticket.user_id not in queue:
+            return None
+        best: Optional[Tuple[int, int]] = None
+        for uid, rating in queue.items():
+            if uid == ticket.user_id:
+                continue
+            diff = abs(rating - ticket.rating)
+            if diff <= window and (best is None or diff < best[1]):
+                best = (uid, diff)
+        if best is None:
+            return None
+        queue.pop(ticket.user_id, None)
+        queue.pop(best[0], None)
+        return best[0]
+
+
+async def seat_order(ticket: QueueTicket, opponent_id: int) -> Tuple[int, int]:
+    """(X, O) cho cặp vừa ghép: người vào queue trước cầm X (không rõ -> đối thủ cầm X)."""
+    opponent = _tickets.get(opponent_id)
+    opponent_since = opponent.queued_at if opponent is not None else None
+    if opponent_since is None and match_bus.is_enabled():
+        try:
+            client = await get_redis()
+            value = await client.hget(JOINED_KEY, str(opponent_id))
+            opponent_since = float(value) if value else None
+        except Exception as e:
+            log.warning("queue_join_time_lookup_failed", user_id=opponent_id, error=e)
+    if opponent_since is not None and opponent_since > ticket.queued_at:
+        return ticket.user_id, opponent_id
+    return opponent_id, ticket.user_id
+
+
+async def queue_size(game_id: int) -> int:
+    if match_bus.is_enabled():
+        try:
+            client = await get_redis()
+            return await client.zcard(_queue_key(game_id))
+        except Exception:
+            pass
+    return len(_local_queues.get(game_id, {}))
+
+
+async def queue_depths() -> Dict[int, int]:
+    """Số người đang chờ theo game (các game đã có người xếp hàng qua worker này)."""
+    game_ids = {ticket.game_id for ticket in _tickets.values()} | set(_local_queues) | _seen_games
+    _seen_games.update(game_ids)
+    return {game_id: await queue_size(game_id) for game_id in game_ids}
+
+
+def local_tickets() -> int:
+    return len(_tickets)
+
+
+async def notify(user_id: int, data: str):
+    """Đẩy message (match_found) tới socket matchmaking của user, dù ở worker nào."""
+    ticket = _tickets.get(user_id)
+    if ticket is not None:
+        await ticket.send_text(data)
+        return
+    if not match_bus.is_enabled():
+        return
+    client = await get_redis()
+    worker_id = await client.hget(WORKER_KEY, str(user_id))
+    if worker_id:
+        await match_bus.RemoteSocket(worker_id, f"mm:{user_id}").send_text(data)
@@ -0,0 +1,182 @@
+# app/core/metrics.py
+"""
+Metrics dạng Prometheus (text format 0.0.4) cho GET /metrics, không cần thư viện ngoài.
+
+- Counter / Histogram: cập nhật trên hot path chỉ là cộng số trong dict của process.
+- Gauge lấy lúc scrape qua collector (len(rooms), pool, scheduler...), hot path không tốn gì.
+- Mỗi worker có số liệu riêng (label worker), Prometheus scrape từng worker hoặc cộng lại.
+  Label worker = WORKER_INDEX (deploy đặt 0..N-1, giữ nguyên qua restart) hoặc pid,
+  không dùng match_bus.WORKER_ID (random mỗi lần start -> series mới mỗi lần deploy).
+"""
+import bisect
+import inspect
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from app.core.log import get_logger
+
+log = get_logger("metrics")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]          # (tên series, labels, giá trị)
+Family = Tuple[str, str, str, List[Sample]]         # (tên, type, help, samples)
+Collector = Callable[[], Union[Iterable[Family], Awaitable[Iterable[Family]]]]
+
+PREFIX = "gameplus_"
+WORKER_LABEL = os.getenv("WORKER_INDEX") or str(os.getpid())
+
+# Độ trễ: 0.5ms .. 10s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics: List["_Metric"] = []
+_collectors: List[Collector] = []
+
+
+def _key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = PREFIX + name
+        self.help = help
+        _metrics.append(self)
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, list] = {}  # key -> [counts theo bucket..., +Inf, sum]
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[Sample]:
+        out: List[Sample] = []
+        for key, series in self._series.items():
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                out.append((self.name + "_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            out.append((self.name + "_count", labels, cumulative))
+            out.append((self.name + "_sum", labels, series[-1]))
+        return out
+
+
+def register_collector(collector: Collector):
+    """Collector trả về các family (thường là gauge) đọc lúc scrape."""
+    _collectors.append(collector)
+
+
+LabelSpec = Optional[Union[Tuple[str, str], Tuple[Tuple[str, str], ...]]]
+
+
+def _labels(spec: LabelSpec) -> Dict[str, str]:
+    if not spec:
+        return {}
+    if isinstance(spec[0], str):
+        return {spec[0]: spec[1]}
+    return dict(spec)
+
+
+def _family(mtype: str, name: str, help: str, values: Union[float, Dict[LabelSpec, float]]) -> Family:
+    if not isinstance(values, dict):
+        values = {None: values}
+    samples = [(PREFIX + name, _labels(spec), value) for spec, value in values.items()]
+    return PREFIX + name, mtype, help, samples
+
+
+def gauge(name: str, help: str, values: Union[float, Dict[LabelSpec, float]]) -> Family:
+    """
+    Family gauge cho collector.
+    values: 1 số, hoặc {labels: số} với labels là (label, value), ((l1, v1), (l2, v2)) hoặc None.
+    """
+    return _family("gauge", name, help, values)
+
+
+def counter(name: str, help: str, values: Union[float, Dict[LabelSpec, float]]) -> Family:
+    """Như gauge() nhưng cho bộ đếm tăng dần có sẵn trong stats() của module khác."""
+    return _family("counter", name, help, values)
+
+
+async def render(const_labels: Optional[Dict[str, str]] = None) -> str:
+    """Text exposition của mọi metric + collector. Collector lỗi chỉ bị bỏ qua."""
+    families: List[Family] = [(m.name, m.type, m.help, m.samples()) for m in _metrics]
+    for collector in _collectors:
+        try:
+            result = collector()
+            if inspect.isawaitable(result):
+                result = await result
+            families.extend(result)
+        except Exception as e:
+            log.warning("collector_failed", collector=getattr(collector, "__name__", collector), error=e)
+
+    const_labels = const_labels or {}
+    lines: List[str] = []
+    for name, mtype, help, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {mtype}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_format_labels({**const_labels, **labels})} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ==== Metrics dùng chung (hot path) ====
+
+MOVE_STAGE_SECONDS = Histogram(
+    "move_stage_seconds",
+    "Move handling latency per stage: validate (receive -> validated, incl. lock wait), "
+    "persist (-> journal), broadcast (-> fan-out), total",
+)
+MOVE_JOURNAL_FLUSH_SECONDS = Histogram("move_journal_flush_seconds", "Bulk INSERT of journaled moves")
+MOVE_JOURNAL_FLUSHED = Counter("move_journal_moves_total", "Moves written by the journal, by result")
+DB_CHECKOUT_WAIT_SECONDS = Histogram("db_pool_checkout_wait_seconds", "Time waiting for a pooled DB connection")
+REDIS_COMMAND_SECONDS = Histogram("redis_command_seconds", "Redis command round trip, by command")
+CACHE_REQUESTS = Counter("cache_requests_total", "Read-through cache lookups, by namespace and result")
@@ -0,0 +1,239 @@
+# app/core/rank_service.py
+"""
+Rank service: bảng xếp hạng theo rating lưu trong Redis sorted set rank:{game_id}
+(member = user_id, score = rating).
+
+- finish_match() (realtime) gọi sync_ratings() sau khi commit để ZSET luôn khớp DB.
+- Dòng rating tạo giữa request (ensure_user_caro_rating) -> sync_after_commit(): ZADD
+  chạy khi transaction của session commit, rollback thì bỏ.
+- get_rank() = 1 + số người có rating cao hơn (ZCOUNT, O(log n)), cùng ngữ nghĩa
+  với cách đếm cũ trên Postgres nên người đồng rating có cùng rank.
+- ZSET chưa được build (Redis mới start / flush) -> fallback đếm trên DB và build nền.
+  User chưa có trong ZSET mà caller không truyền rating -> cũng đếm trên DB.
+- Rebuild thủ công: python app/scripts/rebuild_ranks.py
+- Trong lúc rebuild, sync_ratings ghi cả vào key tạm (cờ :rebuilding) nên rating
+  đổi giữa chừng không bị RENAME ghi đè bằng snapshot cũ.
+"""
+import asyncio
+from typing import Dict, Optional, Set
+
+from sqlalchemy import event, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.cache import get_redis
+from app.models.models import UserGameRating
+from app.core.log import get_logger
+
+log = get_logger("rank_service")
+
+KEY_PREFIX = "rank:"
+REBUILD_LOCK_TTL = 60
+REBUILD_CHUNK = 5000
+
+# KEYS[1] = zset; ARGV[1] = user_id, ARGV[2] = rating dự phòng khi user chưa có trong zset
+# Returns: rank (>= 1) hoặc -1 nếu không xác định được
+_RANK_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score then
+    if ARGV[2] == '' then
+        return -1
+    end
+    score = ARGV[2]
+end
+return redis.call('ZCOUNT', KEYS[1], '(' .. score, '+inf') + 1
+"""
+
+# KEYS[1] = zset, KEYS[2] = cờ rebuilding, KEYS[3] = zset tạm; ARGV = user_id, rating, ...
+_SYNC_SCRIPT = """
+local building = redis.call('EXISTS', KEYS[2]) == 1
+for i = 1, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+    if building then
+        redis.call('ZADD', KEYS[3], ARGV[i + 1], ARGV[i])
+    end
+end
+return 1
+"""
+
+# KEYS[1] = zset, KEYS[2] = cờ rebuilding, KEYS[3] = zset tạm, KEYS[4] = cờ ready
+_SWAP_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('RENAME', KEYS[3], KEYS[1])
+else
+    redis.call('DEL', KEYS[1])
+end
+redis.call('DEL', KEYS[2])
+redis.call('SET', KEYS[4], '1')
+return 1
+"""
+
+_PENDING_SYNC = "rank_pending_sync"  # key trong Session.info: {game_id: {user_id: rating}}
+
+_rebuild_tasks: Dict[int, asyncio.Task] = {}
+_sync_tasks: Set[asyncio.Task] = set()
+
+
+def _key(game_id: int) -> str:
+    return f"{KEY_PREFIX}{game_id}"
+
+
+def _ready_key(game_id: int) -> str:
+    return f"{KEY_PREFIX}{game_id}:ready"
+
+
+def _building_key(game_id: int) -> str:
+    return f"{KEY_PREFIX}{game_id}:building"
+
+
+def _rebuilding_key(game_id: int) -> str:
+    return f"{KEY_PREFIX}{game_id}:rebuilding"
+
+
+async def get_rank(
+    db: AsyncSession, user_id: int, game_id: int, rating: Optional[int] = None
+) -> Optional[int]:
+    """
+    Rank của user trong game. `rating` dùng khi user chưa có dòng rating
+    (rank nếu có rating đó). Returns None nếu user chưa có rating và không truyền rating.
+    """
+    try:
+        client = await get_redis()
+        if await client.exists(_ready_key(game_id)):
+            rank = await client.eval(
+                _RANK_SCRIPT, 1, _key(game_id),
+                str(user_id), "" if rating is None else str(rating),
+            )
+            if rank > 0:
+                return int(rank)
+            # Chưa có trong ZSET (vd: dòng rating chưa sync) -> DB là nguồn đúng
+        else:
+            _schedule_rebuild(game_id)
+    except Exception as e:
+        log.warning("rank_lookup_failed_using_db", game_id=game_id, error=e)
+    return await _get_rank_from_db(db, user_id, game_id, rating)
+
+
+async def _get_rank_from_db(
+    db: AsyncSession, user_id: int, game_id: int, rating: Optional[int]
+) -> Optional[int]:
+    own_rating = await db.scalar(
+        select(UserGameRating.rating)
+        .where(UserGameRating.user_id == user_id, UserGameRating.game_id == game_id)
+    )
+    if own_rating is None:
+        own_rating = rating
+    if own_rating is None:
+        return None
+    higher_count = await db.scalar(
+        select(func.count())
+        .select_from(UserGameRating)
+        .where(UserGameRating.game_id == game_id, UserGameRating.rating > own_rating)
+    ) or 0
+    return higher_count + 1
+
+
+async def sync_ratings(game_id: int, ratings: Dict[int, int]):
+    """Ghi rating mới vào ZSET (gọi sau khi DB đã commit)."""
+    if not ratings:
+        return
+    try:
+        client = await get_redis()
+        args = []
+        for uid, r in ratings.items():
+            args += [str(uid), r]
+        await client.eval(
+            _SYNC_SCRIPT, 3, _key(game_id), _rebuilding_key(game_id), _building_key(game_id), *args
+        )
+    except Exception as e:
+        # ZSET lệch DB -> bỏ cờ ready để lần đọc sau fallback DB và build lại
+        log.warning("rank_sync_failed", game_id=game_id, error=e)
+        try:
+            client = await get_redis()
+            await client.delete(_ready_key(game_id))
+        except Exception:
+            pass
+
+
+def sync_after_commit(db: AsyncSession, game_id: int, ratings: Dict[int, int]):
+    """Hẹn ZADD rating cho lúc transaction hiện tại của `db` commit (dòng rating mới tạo)."""
+    pending = db.sync_session.info.setdefault(_PENDING_SYNC, {})
+    pending.setdefault(game_id, {}).update(ratings)
+
+
+@event.listens_for(Session, "after_commit")
+def _sync_pending(session: Session):
+    pending = session.info.pop(_PENDING_SYNC, None)
+    if not pending:
+        return
+    loop = asyncio.get_running_loop()
+    for game_id, ratings in pending.items():
+        task = loop.create_task(sync_ratings(game_id, ratings))
+        _sync_tasks.add(task)
+        task.add_done_callback(_sync_tasks.discard)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session):
+    session.info.pop(_PENDING_SYNC, None)
+
+
+async def rebuild(db: AsyncSession, game_id: int) -> int:
+    """
+    Build lại ZSET từ user_game_ratings: ghi vào key tạm rồi RENAME (atomic),
+    reader không bao giờ thấy ZSET dở dang. Rating sync_ratings ghi trong lúc
+    build đã nằm sẵn trong key tạm, snapshot chỉ ZADD NX nên không ghi đè.
+    Returns: số user.
+    """
+    client = await get_redis()
+    tmp_key = _building_key(game_id)
+    flag_key = _rebuilding_key(game_id)
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.delete(tmp_key)
+        pipe.set(flag_key, "1", ex=REBUILD_LOCK_TTL)
+        await pipe.execute()
+
+    total = 0
+    try:
+        result = await db.stream(
+            select(UserGameRating.user_id, UserGameRating.rating)
+            .where(UserGameRating.game_id == game_id)
+        )
+        async for chunk in result.partitions(REBUILD_CHUNK):
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.zadd(tmp_key, {str(uid): rating for uid, rating in chunk}, nx=True)
+                pipe.expire(flag_key, REBUILD_LOCK_TTL)
+                await pipe.execute()
+            total += len(chunk)
+
+        await client.eval(_SWAP_SCRIPT, 4, _key(game_id), flag_key, tmp_key, _ready_key(game_id))
+    except Exception:
+        await client.delete(flag_key, tmp_key)
+        raise
+    return total
+
+
+def _schedule_rebuild(game_id: int):
+    """Build ZSET nền (1 worker tại 1 thời điểm nhờ lock trong Redis)."""
+    task = _rebuild_tasks.get(game_id)
+    if task is not None and not task.done():
+        return
+    _rebuild_tasks[game_id] = asyncio.create_task(_rebuild_in_background(game_id))
+
+
+async def _rebuild_in_background(game_id: int):
+    from app.core.database import AsyncSessionLocal
+
+    lock_key = f"{_key(game_id)}:lock"
+    try:
+        client = await get_redis()
+        if not await client.set(lock_key, "1", nx=True, ex=REBUILD_LOCK_TTL):
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                total = await rebuild(db, game_id)
+            log.info("rank_index_rebuilt", game_id=game_id, users=total)
+        finally:
+            await client.delete(lock_key)
+    except Exception as e:
+        log.warning("rank_rebuild_failed", game_id=game_id, error=e)
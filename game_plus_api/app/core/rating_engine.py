@@ -0,0 +1,304 @@
+# app/core/rating_engine.py
+"""
+Rating engine cho trận 2 người.
+
+- EloEngine (mặc định, K=32, giữ nguyên công thức cũ) hoặc Glicko2Engine,
+  chọn qua env RATING_ENGINE=elo|glicko2.
+- apply_match_result(): khóa + tạo (nếu thiếu) dòng user_game_ratings của cả 2 người
+  bằng 1 câu INSERT ... ON CONFLICT DO UPDATE ... RETURNING, tính rating mới và cập nhật
+  stats trong session hiện tại. Caller commit cùng transaction với việc chốt trận.
+- recompute(): tính lại toàn bộ rating của 1 game từ lịch sử match_players (offline).
+"""
+import math
+import os
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import user_stats
+from app.models.models import Match, MatchPlayer, MatchStatus, UserGameRating
+
+DEFAULT_RATING = user_stats.DEFAULT_RATING
+DEFAULT_RD = 350.0
+DEFAULT_VOLATILITY = 0.06
+
+
+class RatingState(NamedTuple):
+    rating: float
+    rd: float = DEFAULT_RD
+    volatility: float = DEFAULT_VOLATILITY
+
+
+class RatingEngine:
+    """Interface: tính rating mới của 2 người sau 1 trận (score_a: 1 thắng, 0.5 hòa, 0 thua)."""
+
+    name = "base"
+
+    def rate(self, a: RatingState, b: RatingState, score_a: float) -> Tuple[RatingState, RatingState]:
+        raise NotImplementedError
+
+
+class EloEngine(RatingEngine):
+    name = "elo"
+
+    def __init__(self, k: int = 32):
+        self.k = k
+
+    def rate(self, a: RatingState, b: RatingState, score_a: float) -> Tuple[RatingState, RatingState]:
+        e_a = 1 / (1 + 10 ** ((b.rating - a.rating) / 400))
+        e_b = 1 / (1 + 10 ** ((a.rating - b.rating) / 400))
+        new_a = int(a.rating + self.k * (score_a - e_a))
+        new_b = int(b.rating + self.k * ((1 - score_a) - e_b))
+        return a._replace(rating=new_a), b._replace(rating=new_b)
+
+
+class Glicko2Engine(RatingEngine):
+    """Glicko-2 với mỗi trận là 1 rating period (Glickman, 2012)."""
+
+    name = "glicko2"
+    SCALE = 173.7178
+    CENTER = 1500.0
+
+    def __init__(self, tau: float = 0.5, min_rd: float = 30.0, epsilon: float = 1e-6):
+        self.tau = tau
+        self.min_rd = min_rd
+        self.epsilon = epsilon
+
+    @staticmethod
+    def _g(phi: float) -> float:
+        return 1 / math.sqrt(1 + 3 * phi * phi / (math.pi * math.pi))
+
+    def _volatility(self, phi: float, sigma: float, delta: float, v: float) -> float:
+        a = math.log(sigma * sigma)
+        tau2 = self.tau * self.tau
+
+        def f(x: float) -> float:
+            ex = math.exp(x)
+            return (ex * (delta * delta - phi * phi - v - ex)) / (2 * (phi * phi + v + ex) ** 2) - (x - a) / tau2
+
+        big_a = a
+        if delta * delta > phi * phi + v:
+            big_b = math.log(delta * delta - phi * phi - v)
+        else:
+            k = 1
+            while f(a - k * self.tau) < 0:
+                k += 1
+            big_b = a - k * self.tau
+
+        f_a, f_b = f(big_a), f(big_b)
+        while abs(big_b - big_a) > self.epsilon:
+            big_c = big_a + (big_a - big_b) * f_a / (f_b - f_a)
+            f_c = f(big_c)
+            if f_c * f_b <= 0:
+                big_a, f_a = big_b, f_b
+            else:
+                f_a /= 2
+            big_b, f_b = big_c, f_c
+        return math.exp(big_a / 2)
+
+    def _update(self, p: RatingState, opp: RatingState, score: float) -> RatingState:
+        mu = (p.rating - self.CENTER) / self.SCALE
+        phi = p.rd / self.SCALE
+        mu_j = (opp.rating - self.CENTER) / self.SCALE
+        phi_j = opp.rd / self.SCALE
+
+        g = self._g(phi_j)
+        expected = 1 / (1 + math.exp(-g * (mu - mu_j)))
+        v = 1 / (g * g * expected * (1 - expected))
+        delta = v * g * (score - expected)
+
+        sigma = self._volatility(phi, p.volatility, delta, v)
+        phi_star = math.sqrt(phi * phi + sigma * sigma)
+        new_phi = 1 / math.sqrt(1 / (phi_star * phi_star) + 1 / v)
+        new_mu = mu + new_phi * new_phi * g * (score - expected)
+
+        return RatingState(
+            rating=int(round(new_mu * self.SCALE + self.CENTER)),
+            rd=max(self.min_rd, new_phi * self.SCALE),
+            volatility=sigma,
+        )
+
+    def rate(self, a: RatingState, b: RatingState, score_a: float) -> Tuple[RatingState, RatingState]:
+        return self._update(a, b, score_a), self._update(b, a, 1 - score_a)
+
+
+ENGINES = {
+    EloEngine.name: EloEngine,
+    Glicko2Engine.name: Glicko2Engine,
+}
+
+
+def get_engine(name: Optional[str] = None) -> RatingEngine:
+    name = (name or os.getenv("RATING_ENGINE", "elo")).lower()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown rating engine: {name}")
+    return ENGINES[name]()
+
+
+_engine: Optional[RatingEngine] = None
+
+
+def default_engine() -> RatingEngine:
+    global _engine
+    if _engine is None:
+        _engine = get_engine()
+    return _engine
+
+
+def _state(row: UserGameRating) -> RatingState:
+    return RatingState(
+        rating=row.rating,
+        rd=row.rating_deviation if row.rating_deviation is not None else DEFAULT_RD,
+        volatility=row.volatility if row.volatility is not None else DEFAULT_VOLATILITY,
+    )
+
+
+async def lock_rating_rows(db: AsyncSession, game_id: int, user_ids: List[int]) -> Dict[int, UserGameRating]:
+    """
+    Tạo dòng rating nếu thiếu và khóa (FOR UPDATE ngầm của ON CONFLICT DO UPDATE)
+    dòng của tất cả user_ids trong 1 round trip.
+    """
+    # Sắp xếp để 2 trận đồng thời luôn khóa theo cùng thứ tự (tránh deadlock)
+    user_ids = sorted(user_ids)
+    stmt = (
+        pg_insert(UserGameRating)
+        .values([
+            {
+                "user_id": uid,
+                "game_id": game_id,
+                "rating": DEFAULT_RATING,
+                "wins": 0,
+                "losses": 0,
+                "draws": 0,
+                "current_streak": 0,
+                "best_win_streak": 0,
+                "total_moves": 0,
+                "rating_deviation": DEFAULT_RD,
+                "volatility": DEFAULT_VOLATILITY,
+            }
+            for uid in user_ids
+        ])
+        .on_conflict_do_update(
+            index_elements=[UserGameRating.user_id, UserGameRating.game_id],
+            set_={"updated_at": func.now()},
+        )
+        .returning(UserGameRating)
+    )
+    result = await db.execute(
+        select(UserGameRating).from_statement(stmt).execution_options(populate_existing=True)
+    )
+    return {row.user_id: row for row in result.scalars()}
+
+
+async def apply_match_result(
+    db: AsyncSession,
+    game_id: int,
+    player_ids: Tuple[int, int],
+    winner_id: Optional[int],
+    moves: Dict[int, int],
+    played_at: datetime,
+    engine: Optional[RatingEngine] = None,
+) -> Tuple[Dict[str, int], Dict[int, int]]:
+    """
+    Áp kết quả trận vào rating + stats của 2 người (không commit).
+    Returns: (rating_changes {"user_id": delta}, new_ratings {user_id: rating})
+    """
+    engine = engine or default_engine()
+    rows = await lock_rating_rows(db, game_id, list(player_ids))
+    a_id, b_id = player_ids
+    row_a, row_b = rows[a_id], rows[b_id]
+
+    if winner_id == a_id:
+        score_a = 1.0
+    elif winner_id == b_id:
+        score_a = 0.0
+    else:
+        score_a = 0.5
+
+    old_a, old_b = row_a.rating, row_b.rating
+    new_a, new_b = engine.rate(_state(row_a), _state(row_b), score_a)
+
+    for row, new_state, score in ((row_a, new_a, score_a), (row_b, new_b, 1 - score_a)):
+        row.rating = int(new_state.rating)
+        row.rating_deviation = new_state.rd
+        row.volatility = new_state.volatility
+        result = "win" if score == 1.0 else "loss" if score == 0.0 else "draw"
+        user_stats.apply_result(row, result, moves.get(row.user_id, 0), played_at)
+
+    # Flush ngay để UPDATE đi trong cùng transaction trước khi caller commit
+    await db.flush()
+
+    rating_changes = {
+        str(a_id): row_a.rating - old_a,
+        str(b_id): row_b.rating - old_b,
+    }
+    return rating_changes, {a_id: row_a.rating, b_id: row_b.rating}
+
+
+async def recompute(db: AsyncSession, game_id: int, engine: Optional[RatingEngine] = None) -> Dict[int, RatingState]:
+    """
+    Tính lại rating của mọi người chơi trong game từ lịch sử trận đã kết thúc,
+    theo thứ tự finished_at. Chỉ tính trong RAM, không ghi DB.
+    Returns: {user_id: RatingState}
+    """
+    engine = engine or default_engine()
+    states: Dict[int, RatingState] = {}
+
+    result = await db.stream(
+        select(MatchPlayer.match_id, MatchPlayer.user_id, MatchPlayer.is_winner)
+        .join(Match, Match.id == MatchPlayer.match_id)
+        .where(Match.game_id == game_id, Match.status == MatchStatus.finished)
+        .order_by(Match.finished_at, Match.id, MatchPlayer.user_id)
+    )
+
+    current_match = None
+    players: List[Tuple[int, Optional[bool]]] = []
+
+    def apply(players: List[Tuple[int, Optional[bool]]]):
+        if len(players) != 2:
+            return
+        (a_id, a_won), (b_id, b_won) = players
+        score_a = 1.0 if a_won is True else 0.0 if b_won is True else 0.5
+        a = states.get(a_id, RatingState(DEFAULT_RATING))
+        b = states.get(b_id, RatingState(DEFAULT_RATING))
+        states[a_id], states[b_id] = engine.rate(a, b, score_a)
+
+    async for match_id, user_id, is_winner in result:
+        if match_id != current_match:
+            apply(players)
+            current_match = match_id
+            players = []
+        players.append((user_id, is_winner))
+    apply(players)
+
+    return states
+
+
+async def save_recomputed(db: AsyncSession, game_id: int, states: Dict[int, RatingState], chunk: int = 1000) -> int:
+    """UPSERT kết quả recompute() theo lô (không đụng vào stats). Caller commit."""
+    items = list(states.items())
+    for i in range(0, len(items), chunk):
+        stmt = pg_insert(UserGameRating).values([
+            {
+                "user_id": uid,
+                "game_id": game_id,
+                "rating": int(state.rating),
+                "rating_deviation": state.rd,
+                "volatility": state.volatility,
+            }
+            for uid, state in items[i:i + chunk]
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserGameRating.user_id, UserGameRating.game_id],
+            set_={
+                "rating": stmt.excluded.rating,
+                "rating_deviation": stmt.excluded.rating_deviation,
+                "volatility": stmt.excluded.volatility,
+                "updated_at": func.now(),
+            },
+        )
+        await db.execute(stmt)
+    return len(items)
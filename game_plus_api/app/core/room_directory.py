@@ -0,0 +1,106 @@
+# app/core/room_directory.py
+"""
+Danh sách phòng chờ trong RAM của mỗi worker, đồng bộ bằng change event.
+
+- Load từ DB 1 lần khi có người xem lobby đầu tiên (và load lại sau ROOM_DIRECTORY_RESYNC
+  giây phòng khi lỡ event pub/sub). Sau đó mọi thay đổi đến qua publish_change().
+- Client lobby nhận diff room_created / room_update / room_deleted; danh sách đầy đủ
+  (rooms_list) được serialize sẵn và dùng lại cho tới thay đổi kế tiếp.
+- Có Redis: event đi qua match bus (rooms:events) tới mọi worker; không có thì áp local.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.core import match_bus
+
+RESYNC_INTERVAL = float(os.getenv("ROOM_DIRECTORY_RESYNC", "60"))
+
+DiffListener = Callable[[dict, str], Awaitable[None]]
+Loader = Callable[[], Awaitable[list]]
+
+_rooms: Dict[int, dict] = {}           # room_id -> room_data (chỉ phòng waiting)
+_loaded_at: Optional[float] = None     # None = chưa load (không có ai xem lobby)
+_list_message: Optional[str] = None    # rooms_list đã serialize
+_load_lock = asyncio.Lock()
+_listener: Optional[DiffListener] = None
+_stats = {"loads": 0, "events": 0, "list_serializations": 0}
+
+
+def set_listener(listener: DiffListener):
+    """realtime đăng ký hàm fan-out diff tới socket lobby local."""
+    global _listener
+    _listener = listener
+
+
+async def ensure_loaded(load: Loader):
+    """Load directory từ DB nếu chưa có hoặc đã quá RESYNC_INTERVAL."""
+    global _loaded_at, _list_message
+    if _loaded_at is not None and time.monotonic() - _loaded_at < RESYNC_INTERVAL:
+        return
+    async with _load_lock:
+        if _loaded_at is not None and time.monotonic() - _loaded_at < RESYNC_INTERVAL:
+            return
+        rooms = await load()
+        _rooms.clear()
+        _rooms.update({room["id"]: room for room in rooms})
+        _list_message = None
+        _loaded_at = time.monotonic()
+        _stats["loads"] += 1
+
+
+async def list_message(load: Loader) -> str:
+    """Message rooms_list đầy đủ (serialize 1 lần cho tới thay đổi kế tiếp)."""
+    global _list_message
+    await ensure_loaded(load)
+    if _list_message is None:
+        rooms = sorted(_rooms.values(), key=lambda r: (r.get("created_at") or "", r["id"]), reverse=True)
+        _list_message = json.dumps({
+            "type": "rooms_list",
+            "payload": {"rooms": rooms, "total": len(rooms)},
+        })
+        _stats["list_serializations"] += 1
+    return _list_message
+
+
+async def publish_change(room_data: dict, action: str):
+    """Gọi từ REST rooms sau khi phòng thay đổi (action: created | update | deleted)."""
+    event = {"room": room_data, "action": action}
+    if not await match_bus.publish_room_event(event):
+        await apply_change(event)
+
+
+async def apply_change(event: dict):
+    """Áp 1 change event vào directory và đẩy diff tới lobby local."""
+    global _list_message
+    _stats["events"] += 1
+    room = event["room"]
+    action = event["action"]
+    room_id = room["id"]
+    known = room_id in _rooms
+    waiting = action != "deleted" and room.get("status") == "waiting"
+
+    if _loaded_at is not None:
+        if waiting:
+            _rooms[room_id] = room
+        else:
+            _rooms.pop(room_id, None)
+        _list_message = None
+
+    # Phòng không còn trong list và trước đó cũng không có -> không ai cần diff
+    if not waiting and not known and _loaded_at is not None:
+        return
+    if waiting and not known and action == "update" and _loaded_at is not None:
+        action = "created"
+    if _listener is not None:
+        await _listener(room, action)
+
+
+def stats() -> dict:
+    return {
+        "rooms": len(_rooms),
+        "loaded": _loaded_at is not None,
+        **_stats,
+    }
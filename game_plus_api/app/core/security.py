@@ -9,6 +9,7 @@ from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.core.database import get_db
+from app.core import auth_cache, hash_pool
 from app.models.models import User
 import os
 from app.core.config import SECRET_KEY, ALGORITHM
@@ -20,13 +21,15 @@ ALGORITHM = "HS256"
 
 # FastAPI sẽ tự động trích token từ header "Authorization: Bearer <token>"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+# bcrypt chạy trong hash_pool (thread pool giới hạn), không chặn event loop.
+# Pool quá tải -> HTTPException 503 (Retry-After).
+async def hash_password(password: str) -> str:
+    return await hash_pool.run(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: Optional[str]) -> bool:
+async def verify_password(plain_password: str, hashed_password: Optional[str]) -> bool:
     if not hashed_password:
         return False
-    return pwd_context.verify(plain_password, hashed_password)
+    return await hash_pool.run(pwd_context.verify, plain_password, hashed_password)
 
 def create_access_token(subject: str | int, expires_delta: timedelta) -> str:
     now = datetime.now(timezone.utc)
@@ -34,6 +37,33 @@ def create_access_token(subject: str | int, expires_delta: timedelta) -> str:
     to_encode: Dict[str, Any] = {"sub": str(subject), "iat": int(now.timestamp()), "exp": int(expire.timestamp())}
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+def decode_user_id(token: str) -> int:
+    """
+    user_id (sub) của JWT hợp lệ. Token đã verify được nhớ tới khi hết hạn.
+    Raises JWTError / ValueError / TypeError nếu token không hợp lệ.
+    """
+    user_id = auth_cache.get_token(token)
+    if user_id is not None:
+        return user_id
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user_id = int(payload.get("sub"))
+    if auth_cache.is_deleted(user_id):
+        raise ValueError("User deleted")
+    auth_cache.put_token(token, user_id, payload.get("exp"))
+    return user_id
+
+async def _load_user_projection(db: AsyncSession, user_id: int) -> Optional[dict]:
+    row = (await db.execute(
+        select(User.id, User.username, User.email, User.avatar_url, User.provider, User.bio)
+        .where(User.id == user_id)
+    )).mappings().first()
+    return dict(row) if row else None
+
+async def get_user_projection(db: AsyncSession, user_id: int) -> Optional[dict]:
+    """Projection (id, username, email, avatar_url, provider, bio) qua auth cache."""
+    return await auth_cache.get_user(user_id, lambda: _load_user_projection(db, user_id))
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db)
@@ -48,14 +78,12 @@ async def get_current_user(
     )
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = int(payload.get("sub"))
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
+        user_id = decode_user_id(token)
+    except (JWTError, ValueError, TypeError):
         raise credentials_exception
 
-    user = await db.scalar(select(User).where(User.id == user_id))
+    # Projection được cache (auth_cache), phần lớn request không chạm DB
+    user = await get_user_projection(db, user_id)
     if user is None:
         raise credentials_exception
 
@@ -63,10 +91,4 @@ async def get_current_user(
     # instance that may be detached from its session later (causes
     # MissingGreenlet errors when attributes are accessed outside the
     # original DB session). We copy the commonly-used fields.
-    return SimpleNamespace(
-        id=user.id,
-        username=user.username,
-        email=user.email,
-        avatar_url=user.avatar_url,
-        provider=user.provider,
-    )
\ No newline at end of file
+    return SimpleNamespace(**user)
\ No newline at end of file
@@ -0,0 +1,181 @@
+# app/core/spectators.py
+"""
+Tầng spectator: người xem không nằm trong state.connections của trận.
+
+- Owner gọi mark_dirty() sau mỗi broadcast; frame (trạng thái gọn của trận) được build
+  và serialize tối đa 1 lần / SPECTATOR_FRAME_INTERVAL giây, nhiều event dồn vào 1 frame.
+- Frame được đẩy vào outbox của spectator local (giữ ít frame, đầy thì bỏ frame cũ)
+  và publish qua match bus cho spectator ở worker khác.
+- Không ai xem thì không build, không publish: owner chỉ publish khi kênh spectate
+  còn subscriber (biết qua NUMSUB / kết quả PUBLISH), người xem ở worker khác vào
+  sau thì gửi request_frame() tới owner để bật lại.
+- Vào xem không chạm DB: lấy frame từ RoomState local hoặc frame cuối trong Redis.
+
+Người chơi không chờ spectator: broadcast chỉ đánh dấu dirty, không gửi gì.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, Optional, Set
+
+from app.core import fanout, match_bus
+from app.core.log import get_logger
+
+log = get_logger("spectators")
+
+FRAME_INTERVAL = float(os.getenv("SPECTATOR_FRAME_INTERVAL", "0.5"))
+OUTBOX_SIZE = int(os.getenv("SPECTATOR_OUTBOX_SIZE", "4"))
+
+FrameBuilder = Callable[[], dict]
+
+
+class _Feed:
+    """Throttle frame của 1 trận ở worker owner."""
+
+    def __init__(self):
+        self.build: Optional[FrameBuilder] = None
+        self.task: Optional[asyncio.Task] = None
+        self.last_sent = 0.0
+        self.remote: Optional[bool] = None  # còn worker khác nghe kênh spectate? None = chưa hỏi
+
+
+_feeds: Dict[int, _Feed] = {}
+_viewers: Dict[int, Set[fanout.Outbox]] = {}  # match_id -> outbox của spectator local
+_stats = {"frames_total": 0}
+
+
+# ==== Owner side ====
+
+def mark_dirty(match_id: int, build_frame: FrameBuilder):
+    """Trận có thay đổi: hẹn gửi frame mới (gộp các thay đổi trong cùng khoảng throttle)."""
+    if match_id not in _viewers and not match_bus.is_enabled():
+        return  # không ai xem và không có worker khác
+    feed = _feeds.get(match_id)
+    if feed is None:
+        feed = _feeds[match_id] = _Feed()
+    feed.build = build_frame
+    if match_id not in _viewers and feed.remote is False:
+        return  # worker khác cũng không ai xem; request_frame() bật lại
+    _schedule(match_id, feed)
+
+
+def request_frame(match_id: int, build_frame: FrameBuilder):
+    """Owner nhận event "spectate": có người xem mới ở worker khác -> publish lại."""
+    feed = _feeds.get(match_id)
+    if feed is None:
+        feed = _feeds[match_id] = _Feed()
+    feed.build = build_frame
+    feed.remote = True
+    _schedule(match_id, feed)
+
+
+def _schedule(match_id: int, feed: _Feed):
+    if feed.task is None or feed.task.done():
+        feed.task = asyncio.create_task(_flush_later(match_id, feed))
+
+
+async def close_feed(match_id: int):
+    """Room bị dọn: gửi frame cuối (status / result) rồi đóng socket của mọi spectator."""
+    feed = _feeds.pop(match_id, None)
+    if feed is not None and feed.task is not None and not feed.task.done():
+        feed.task.cancel()
+    if feed is not None and (match_id in _viewers or feed.remote is not False):
+        try:
+            data = json.dumps(feed.build())
+        except Exception as e:
+            log.warning("frame_build_failed", match_id=match_id, error=e)
+        else:
+            _stats["frames_total"] += 1
+            _deliver(match_id, data)
+            await match_bus.publish_frame(match_id, data)
+    _deliver(match_id, match_bus.END_OF_FRAMES)
+    await match_bus.end_frames(match_id)
+
+
+async def _flush_later(match_id: int, feed: _Feed):
+    delay = feed.last_sent + FRAME_INTERVAL - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    if feed.remote is None:
+        feed.remote = await match_bus.frame_watchers(match_id) > 0
+    if match_id not in _viewers and not feed.remote:
+        return
+    feed.last_sent = time.monotonic()
+    try:
+        # Build lúc gửi -> frame phản ánh trạng thái mới nhất
+        data = json.dumps(feed.build())
+    except Exception as e:
+        log.warning("frame_build_failed", match_id=match_id, error=e)
+        return
+    _stats["frames_total"] += 1
+    _deliver(match_id, data)
+    if feed.remote:
+        receivers = await match_bus.publish_frame(match_id, data)
+        if receivers == 0:
+            feed.remote = False  # người xem ở worker khác đã rời hết
+
+
+def _deliver(match_id: int, data: str):
+    viewers = _viewers.get(match_id)
+    if not viewers:
+        return
+    if data == match_bus.END_OF_FRAMES:
+        for outbox in viewers:
+            outbox.close_when_drained()  # unsubscribe() dọn _viewers khi socket đóng
+        return
+    fanout.publish(viewers, data)
+
+
+# ==== Viewer side ====
+
+async def subscribe(match_id: int, websocket, user_id: int, frame: Optional[dict]) -> Optional[fanout.Outbox]:
+    """
+    Đăng ký spectator. `frame`: frame hiện tại nếu trận host ở worker này,
+    None -> dùng frame cuối trong Redis rồi nhờ owner phát frame mới.
+    Returns None nếu trận không còn phát.
+    """
+    outbox = fanout.Outbox(
+        websocket, name=f"spectator {user_id} match {match_id}",
+        policy=fanout.POLICY_DROP, maxsize=OUTBOX_SIZE,
+    )
+    viewers = _viewers.setdefault(match_id, set())
+    viewers.add(outbox)
+    if frame is not None:
+        outbox.send(json.dumps(frame))
+        return outbox
+
+    # Subscribe trước khi nhờ owner -> frame owner phát ra không bị lỡ
+    if len(viewers) == 1:
+        await match_bus.watch_frames(match_id, lambda d: _deliver(match_id, d))
+    data = await match_bus.last_frame(match_id)
+    if data is not None:
+        outbox.send(data)
+    if not await match_bus.request_frame(match_id) and data is None:
+        await unsubscribe(match_id, outbox)
+        return None
+    return outbox
+
+
+async def unsubscribe(match_id: int, outbox: fanout.Outbox):
+    outbox.close()
+    viewers = _viewers.get(match_id)
+    if viewers is None:
+        return
+    viewers.discard(outbox)
+    if not viewers:
+        _viewers.pop(match_id, None)
+        await match_bus.unwatch_frames(match_id)
+
+
+def viewer_count(match_id: int) -> int:
+    return len(_viewers.get(match_id, ()))
+
+
+def stats() -> dict:
+    return {
+        "watched_matches": len(_viewers),
+        "spectators": sum(len(v) for v in _viewers.values()),
+        "active_feeds": len(_feeds),
+        **_stats,
+    }
@@ -0,0 +1,182 @@
+# app/core/turn_scheduler.py
+"""
+Scheduler deadline lượt đi cho mọi trận của worker.
+
+Thay vì mỗi nước đi tạo 1 asyncio.Task sleep(MOVE_TIMEOUT) rồi cancel task cũ,
+toàn bộ deadline nằm trong 1 min-heap và 1 task duy nhất chờ tới deadline gần nhất.
+Đặt lại deadline của 1 trận chỉ là push vào heap (entry cũ bị bỏ qua khi pop).
+Callback chỉ được tạo task khi thực sự hết giờ.
+
+Kèm TimeControl cho từng trận: giới hạn mỗi nước (mặc định) hoặc Fischer
+(quỹ thời gian ban đầu + cộng thêm increment sau mỗi nước).
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.log import get_logger
+
+log = get_logger("turn_scheduler")
+
+TimeoutCallback = Callable[[], Awaitable[None]]
+
+
+class TimeControl:
+    """
+    per_move: giây tối đa cho 1 nước (luôn áp dụng).
+    initial/increment: bật Fischer khi initial > 0 -> mỗi người có quỹ `initial` giây,
+    sau mỗi nước được cộng `increment`; lượt đi bị giới hạn bởi min(quỹ, per_move).
+    """
+
+    def __init__(self, per_move: float, initial: float = 0, increment: float = 0):
+        self.per_move = per_move
+        self.initial = initial
+        self.increment = increment
+
+    @property
+    def is_fischer(self) -> bool:
+        return self.initial > 0
+
+    @classmethod
+    def from_env(cls, per_move: float) -> "TimeControl":
+        return cls(
+            per_move=per_move,
+            initial=float(os.getenv("MATCH_TIME_INITIAL", "0")),
+            increment=float(os.getenv("MATCH_TIME_INCREMENT", "0")),
+        )
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict], per_move: float) -> "TimeControl":
+        """Time control đã chọn cho trận (Match / snapshot); thiếu thì lấy mặc định từ env."""
+        if not data:
+            return cls.from_env(per_move)
+        default = cls.from_env(per_move)
+        return cls(
+            per_move=data.get("per_move") or default.per_move,
+            initial=data["initial"] if data.get("initial") is not None else default.initial,
+            increment=data["increment"] if data.get("increment") is not None else default.increment,
+        )
+
+    def new_clocks(self) -> Dict[str, float]:
+        return {"X": self.initial, "O": self.initial} if self.is_fischer else {}
+
+    def turn_limit(self, clocks: Dict[str, float], symbol: str) -> float:
+        """Số giây tối đa cho lượt của symbol."""
+        if self.is_fischer:
+            return min(self.per_move, clocks.get(symbol, self.initial))
+        return self.per_move
+
+    def consume(self, clocks: Dict[str, float], symbol: str, elapsed: float):
+        """Trừ thời gian đã dùng cho nước vừa đi và cộng increment (Fischer)."""
+        if self.is_fischer:
+            clocks[symbol] = max(0.0, clocks.get(symbol, self.initial) - elapsed) + self.increment
+
+    def to_dict(self) -> dict:
+        return {"per_move": self.per_move, "initial": self.initial, "increment": self.increment}
+
+
+class TurnScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, int, int]] = []            # (deadline, seq, key)
+        self._entries: Dict[int, Tuple[float, int, TimeoutCallback]] = {}  # key -> entry còn hiệu lực
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self.fired = 0
+        self.cancelled = 0
+        self.max_lag = 0.0  # giây trễ lớn nhất giữa deadline và lúc fire
+
+    # ==== Lifecycle ====
+
+    def start(self):
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner and not self._runner.done():
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+        self._runner = None
+
+    # ==== API ====
+
+    def schedule(self, key: int, delay: float, callback: TimeoutCallback):
+        """Đặt (hoặc thay) deadline của key sau `delay` giây."""
+        deadline = time.monotonic() + delay
+        seq = next(self._seq)
+        self._entries[key] = (deadline, seq, callback)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        # Heap đầy entry cũ -> dọn lại cho gọn
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+        self.start()
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+
+    def cancel(self, key: int):
+        if self._entries.pop(key, None) is not None:
+            self.cancelled += 1
+
+    def remaining(self, key: int) -> Optional[float]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return max(0.0, entry[0] - time.monotonic())
+
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "pending_timers": len(self._entries),
+            "heap_size": len(self._heap),
+            "fired_total": self.fired,
+            "cancelled_total": self.cancelled,
+            "max_fire_lag_ms": round(self.max_lag * 1000, 2),
+        }
+
+    # ==== Internals ====
+
+    def _compact(self):
+        self._heap = [(d, s, k) for k, (d, s, _) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            # Fire tất cả deadline đã tới
+            while self._heap and self._heap[0][0] <= now:
+                deadline, seq, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is None or entry[1] != seq:
+                    continue  # entry đã bị thay/cancel
+                del self._entries[key]
+                self.fired += 1
+                self.max_lag = max(self.max_lag, now - deadline)
+                asyncio.create_task(self._fire(key, entry[2]))
+
+            if not self._entries:
+                self._heap.clear()  # chỉ còn entry đã hủy
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _fire(key: int, callback: TimeoutCallback):
+        try:
+            await callback()
+        except Exception:
+            log.exception("timer_callback_failed", key=key)
+
+
+scheduler = TurnScheduler()
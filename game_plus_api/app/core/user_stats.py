@@ -0,0 +1,81 @@
+# app/core/user_stats.py
+"""
+Đọc / ghi stats tổng hợp của user theo game.
+
+Nguồn duy nhất là 1 dòng user_game_ratings (wins/losses/draws, streak, total_moves,
+last_played_at), được cập nhật trong cùng transaction với rating khi trận kết thúc.
+Các endpoint stats chỉ đọc dòng này, không COUNT lại lịch sử trận.
+"""
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import UserGameRating
+
+DEFAULT_RATING = 1200
+
+
+def stats_from_row(row: Optional[UserGameRating]) -> dict:
+    """Chuyển 1 dòng UserGameRating (hoặc None) thành dict stats."""
+    if row is None:
+        wins = losses = draws = 0
+        extra = {
+            "rating": DEFAULT_RATING,
+            "current_streak": 0,
+            "best_win_streak": 0,
+            "total_moves": 0,
+            "last_played_at": None,
+        }
+    else:
+        wins, losses, draws = row.wins, row.losses, row.draws
+        extra = {
+            "rating": row.rating,
+            "current_streak": row.current_streak or 0,
+            "best_win_streak": row.best_win_streak or 0,
+            "total_moves": row.total_moves or 0,
+            "last_played_at": row.last_played_at.isoformat() if row.last_played_at else None,
+        }
+    total_games = wins + losses + draws
+    win_rate = (wins / total_games * 100) if total_games > 0 else 0.0
+    return {
+        "wins": wins,
+        "losses": losses,
+        "draws": draws,
+        "total_games": total_games,
+        "win_rate": round(win_rate, 2),
+        **extra,
+    }
+
+
+async def get_stats(db: AsyncSession, user_id: int, game_id: int) -> dict:
+    """Stats của 1 user (1 query theo unique index user_id + game_id)."""
+    row = await db.scalar(
+        select(UserGameRating).where(
+            UserGameRating.user_id == user_id,
+            UserGameRating.game_id == game_id,
+        )
+    )
+    return stats_from_row(row)
+
+
+def apply_result(row: UserGameRating, result: str, moves: int, played_at: datetime):
+    """
+    Cộng kết quả 1 trận vào dòng stats (result: "win" | "loss" | "draw").
+    Caller commit cùng transaction với rating.
+    """
+    streak = row.current_streak or 0
+    if result == "win":
+        row.wins = (row.wins or 0) + 1
+        streak = streak + 1 if streak > 0 else 1
+        row.best_win_streak = max(row.best_win_streak or 0, streak)
+    elif result == "loss":
+        row.losses = (row.losses or 0) + 1
+        streak = streak - 1 if streak < 0 else -1
+    else:
+        row.draws = (row.draws or 0) + 1
+        streak = 0
+    row.current_streak = streak
+    row.total_moves = (row.total_moves or 0) + moves
+    row.last_played_at = played_at
@@ -1,12 +1,21 @@
 from fastapi import FastAPI
-from app.core.database import init_db
+from fastapi.responses import PlainTextResponse
+from app.core.database import init_db, pool_status
 from app.core.middleware import setup_cors
 from app.core.cache import close_redis
+from app.core import (
+    auth_cache, drain, fanout, hash_pool, layered_cache, log, match_bus, match_snapshots, metrics,
+    room_directory, spectators,
+)
+from app.core.turn_scheduler import scheduler as turn_scheduler
+from app.api.realtime_helpers import start_move_journal, stop_move_journal
 from app.api import (
     auth, auth_google, users, games, scores, realtime, 
     matches, friends, leaderboard, match_history, profile, rooms
 )
 
+logger = log.get_logger("main")
+
 app = FastAPI(
     title="GamePlus API",
     version="1.0.0",
@@ -20,14 +29,30 @@ setup_cors(app)
 
 @app.on_event("startup")
 async def startup_event():
+    log.setup()  # log qua hàng đợi + thread nền, không ghi stdout trên event loop
     await init_db()
-    print("✅ Server started - Ready for 50+ concurrent users")
+    # Match bus: cho phép 2 người chơi cùng trận ở 2 worker khác nhau
+    # + đồng bộ room directory (lobby) và invalidation của auth cache giữa các worker
+    await match_bus.start(realtime.handle_remote_event, room_directory.apply_change, auth_cache.apply_event)
+    # Write-behind journal cho moves
+    start_move_journal()
+    # 1 scheduler cho deadline lượt đi của mọi trận
+    turn_scheduler.start()
+    logger.info("server_started", worker=match_bus.WORKER_ID, metrics_worker=metrics.WORKER_LABEL)
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Cleanup resources on shutdown."""
+    """Drain rồi cleanup: trận đang chơi được bàn giao cho worker khác, không bị xử thua."""
+    drain.begin()                     # từ chối WebSocket / join mới
+    await turn_scheduler.stop()       # không xử thua vì hết giờ trong lúc bàn giao
+    await stop_move_journal()         # ghi nốt moves
+    # Snapshot (kèm deadline) + báo client kết nối lại; worker mới warm start từ snapshot
+    await realtime.handoff_rooms()
+    await match_bus.stop()            # nhả ownership để worker khác nhận trận
     await close_redis()
-    print("👋 Server shutdown - Cleaned up resources")
+    hash_pool.shutdown()
+    logger.info("server_stopped", worker=match_bus.WORKER_ID)
+    log.shutdown()                    # ghi nốt log còn trong hàng đợi
 
 # Routers
 app.include_router(auth.router)
@@ -46,3 +71,101 @@ app.include_router(rooms.router)
 @app.get("/api/test-db")
 async def test_db():
     return {"status": "Database OK"}
+
+def collect_infra_metrics():
+    """Gauge / counter đọc từ stats() sẵn có: DB pool, timer, cache, fan-out, spectator, room directory, bcrypt pool, snapshot, log."""
+    pool = pool_status()
+    timers = turn_scheduler.stats()
+    auth = auth_cache.stats()
+    fan = fanout.stats()
+    hashing = hash_pool.stats()
+    snapshots = match_snapshots.stats()
+    layered = layered_cache.stats()["caches"]
+    watching = spectators.stats()
+    directory = room_directory.stats()
+    logs = log.stats()
+    return [
+        metrics.gauge("db_pool_connections", "DB pool connections, by state", {
+            ("state", "checked_out"): pool["checked_out"],
+            ("state", "checked_in"): pool["checked_in"],
+            ("state", "overflow"): pool["overflow"],
+        }),
+        metrics.gauge("db_pool_size", "Configured DB pool size", pool["pool_size"]),
+        metrics.gauge("turn_timers_pending", "Turn deadlines waiting in the scheduler", timers["pending_timers"]),
+        metrics.gauge("turn_timer_heap_size", "Scheduler heap entries incl. stale ones", timers["heap_size"]),
+        metrics.gauge("turn_timer_max_lag_seconds", "Largest delay between deadline and firing",
+                      timers["max_fire_lag_ms"] / 1000),
+        metrics.counter("turn_timers_fired_total", "Turn deadlines fired", timers["fired_total"]),
+        metrics.counter("turn_timers_cancelled_total", "Turn deadlines cancelled before firing",
+                        timers["cancelled_total"]),
+        metrics.gauge("auth_cache_entries", "Auth cache entries in worker RAM, by kind", {
+            ("kind", "token"): auth["tokens"],
+            ("kind", "user"): auth["users"],
+            ("kind", "deleted_user"): auth["deleted_users"],
+        }),
+        metrics.counter("auth_cache_requests_total", "Auth cache lookups, by kind and result", {
+            (("kind", "token"), ("result", "hit")): auth["token_hits"],
+            (("kind", "token"), ("result", "miss")): auth["token_misses"],
+            (("kind", "user"), ("result", "hit")): auth["user_hits"],
+            (("kind", "user"), ("result", "miss")): auth["user_misses"],
+        }),
+        metrics.counter("layered_cache_requests_total", "Two-tier cache lookups, by cache and result", {
+            (("cache", name), ("result", result)): stats[key]
+            for name, stats in layered.items()
+            for result, key in (("local_hit", "local_hits"), ("redis_hit", "redis_hits"),
+                                ("miss", "misses"), ("coalesced", "coalesced"))
+        }),
+        metrics.gauge("layered_cache_entries", "Two-tier cache entries in worker RAM, by cache",
+                      {("cache", name): stats["entries"] for name, stats in layered.items()}),
+        metrics.counter("layered_cache_load_seconds_total", "Time spent in loaders on cache misses, by cache",
+                        {("cache", name): stats["load_seconds_total"] for name, stats in layered.items()}),
+        metrics.counter("layered_cache_redis_errors_total", "Redis errors seen by the two-tier cache, by cache",
+                        {("cache", name): stats["redis_errors"] for name, stats in layered.items()}),
+        metrics.gauge("ws_outboxes_open", "Open WebSocket outboxes", fan["open_outboxes"]),
+        metrics.counter("ws_messages_total", "Outbox messages, by result", {
+            ("result", "sent"): fan["sent_total"],
+            ("result", "dropped"): fan["dropped_total"],
+            ("result", "send_error"): fan["send_errors_total"],
+        }),
+        metrics.counter("ws_slow_consumers_closed_total", "Sockets closed because their outbox was full",
+                        fan["slow_closed_total"]),
+        metrics.gauge("spectated_matches", "Matches with local spectators", watching["watched_matches"]),
+        metrics.gauge("spectator_feeds", "Spectator feeds owned by this worker", watching["active_feeds"]),
+        metrics.counter("spectator_frames_total", "Spectator frames built and published", watching["frames_total"]),
+        metrics.gauge("room_directory_rooms", "Waiting rooms in the in-memory room directory", directory["rooms"]),
+        metrics.gauge("room_directory_loaded", "1 once the room directory has been loaded from the DB",
+                      int(directory["loaded"])),
+        metrics.counter("room_directory_operations_total", "Room directory work, by operation", {
+            ("op", "load"): directory["loads"],
+            ("op", "event"): directory["events"],
+            ("op", "list_serialization"): directory["list_serializations"],
+        }),
+        metrics.gauge("password_hash_pending", "bcrypt jobs queued or running", hashing["pending"]),
+        metrics.counter("password_hash_completed_total", "bcrypt jobs completed", hashing["completed_total"]),
+        metrics.counter("password_hash_rejected_total", "bcrypt jobs rejected with 503", hashing["rejected_total"]),
+        metrics.counter("password_hash_busy_seconds_total", "Time bcrypt workers spent hashing",
+                        hashing["busy_seconds_total"]),
+        metrics.gauge("match_snapshots_live", "Match snapshots this worker keeps in Redis", snapshots["live"]),
+        metrics.counter("match_snapshot_writes_total", "Match snapshots written to Redis", snapshots["writes_total"]),
+        metrics.counter("match_snapshot_coalesced_total", "Snapshot writes folded into a pending write",
+                        snapshots["coalesced_total"]),
+        metrics.counter("match_snapshot_errors_total", "Snapshot writes / restores that failed", snapshots["errors_total"]),
+        metrics.counter("match_snapshot_restores_total", "Rooms warm-started from a snapshot", snapshots["restores_total"]),
+        metrics.gauge("log_queue_depth", "Log records waiting for the writer thread", logs["queued"]),
+        metrics.counter("log_records_total", "Log records, by result", {
+            ("result", "enqueued"): logs["enqueued_total"],
+            ("result", "dropped"): logs["dropped_total"],
+            ("result", "sampled_out"): logs["sampled_out_total"],
+            ("result", "suppressed"): logs["suppressed_total"],
+        }),
+    ]
+
+
+metrics.register_collector(collect_infra_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (text format 0.0.4) của worker này."""
+    body = await metrics.render({"worker": metrics.WORKER_LABEL})
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
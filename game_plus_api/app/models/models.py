@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, String, Text, ForeignKey, TIMESTAMP, func, Boolean,
+    Column, Integer, Float, String, Text, ForeignKey, TIMESTAMP, func, Boolean,
     Enum as SAEnum, CheckConstraint, UniqueConstraint, Index
 )
 from sqlalchemy.orm import relationship
@@ -69,6 +69,10 @@ class Match(Base):
     board_rows = Column(Integer, nullable=False, default=15)
     board_cols = Column(Integer, nullable=False, default=19)
     win_len = Column(Integer, nullable=False, default=5)
+    # Time control (giây); NULL = mặc định server (MOVE_TIMEOUT / MATCH_TIME_*)
+    time_per_move = Column(Float, nullable=True)
+    time_initial = Column(Float, nullable=True)
+    time_increment = Column(Float, nullable=True)
     status = Column(SAEnum(MatchStatus), nullable=False, default=MatchStatus.waiting)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     started_at = Column(TIMESTAMP(timezone=True))
@@ -83,6 +87,9 @@ class Match(Base):
         CheckConstraint("board_rows >= 5 AND board_cols >= 5", name="ck_board_min_size"),
         CheckConstraint("win_len BETWEEN 3 AND 10", name="ck_win_len_range"),
         Index("ix_matches_game_status", "game_id", "status"),
+        # Keyset match history: vào từ match_players (user_id, match_id), sort / cursor theo
+        # (created_at, id). Index ASC, Postgres scan ngược cho ORDER BY ... DESC.
+        Index("ix_matches_created", "created_at", "id"),
     )
 
 class MatchPlayer(Base):
@@ -103,7 +110,7 @@ class MatchPlayer(Base):
     __table_args__ = (
         CheckConstraint("symbol IN ('X','O')", name="ck_symbol_only_xo"),
         UniqueConstraint("match_id", "symbol", name="uq_match_symbol_once"),  # 1 symbol chỉ 1 người
-        Index("ix_match_players_user", "user_id"),
+        Index("ix_match_players_user", "user_id", "match_id"),
     )
 
 class Move(Base):
@@ -141,9 +148,17 @@ class UserGameRating(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     game_id = Column(Integer, ForeignKey("games.id", ondelete="CASCADE"), nullable=False)
     rating = Column(Integer, nullable=False, default=1000)
+    # Chỉ dùng khi RATING_ENGINE=glicko2 (app/core/rating_engine.py)
+    rating_deviation = Column(Float, nullable=False, default=350.0)
+    volatility = Column(Float, nullable=False, default=0.06)
     wins = Column(Integer, nullable=False, default=0)
     losses = Column(Integer, nullable=False, default=0)
     draws = Column(Integer, nullable=False, default=0)
+    # Stats tổng hợp, cập nhật trong cùng transaction với rating khi trận kết thúc
+    current_streak = Column(Integer, nullable=False, default=0)   # >0: chuỗi thắng, <0: chuỗi thua
+    best_win_streak = Column(Integer, nullable=False, default=0)
+    total_moves = Column(Integer, nullable=False, default=0)
+    last_played_at = Column(TIMESTAMP(timezone=True), nullable=True)
     updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
 
     user = relationship("User", back_populates="ratings")
@@ -269,6 +284,9 @@ class Room(Base):
     board_rows = Column(Integer, default=15)
     board_cols = Column(Integer, default=19)
     win_len = Column(Integer, default=5)
+    time_per_move = Column(Float, nullable=True)   # NULL = mặc định server
+    time_initial = Column(Float, nullable=True)
+    time_increment = Column(Float, nullable=True)
     
     # Status
     status = Column(SAEnum(RoomStatus), nullable=False, default=RoomStatus.waiting)
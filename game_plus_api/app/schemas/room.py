@@ -11,6 +11,9 @@ class CreateRoomRequest(BaseModel):
     board_rows: int = Field(15, ge=10, le=20, description="Số hàng")
     board_cols: int = Field(19, ge=10, le=25, description="Số cột")
     win_len: int = Field(5, ge=3, le=7, description="Số quân liên tiếp để thắng")
+    time_per_move: Optional[float] = Field(None, ge=5, le=300, description="Giây tối đa mỗi nước (mặc định server)")
+    time_initial: Optional[float] = Field(None, ge=0, le=3600, description="Quỹ giờ Fischer mỗi người, 0 = tắt")
+    time_increment: Optional[float] = Field(None, ge=0, le=60, description="Giây cộng thêm sau mỗi nước (Fischer)")
     is_public: bool = Field(True, description="Phòng công khai hay riêng tư")
 
 class JoinRoomRequest(BaseModel):
@@ -44,6 +47,9 @@ class RoomDetail(BaseModel):
     board_rows: int
     board_cols: int
     win_len: int
+    time_per_move: Optional[float] = None  # None = mặc định server
+    time_initial: Optional[float] = None
+    time_increment: Optional[float] = None
     created_at: datetime
     players: List[PlayerInRoom] = []
     match_id: Optional[int] = None  # ID của match khi game bắt đầu
@@ -0,0 +1,83 @@
+"""
+Benchmark invalidate cache theo kích thước keyspace Redis.
+
+So sánh (mỗi namespace có --entries key, keyspace có thêm N key rác):
+    generation : bump_generation()  - INCR 1 key, phải phẳng khi keyspace tăng
+    scan       : cache_delete_pattern() - SCAN toàn keyspace (chỉ cho bảo trì)
+
+Ghi key vào Redis trong .env (prefix bench:*), tự dọn khi xong - không chạy trên production:
+    python app/scripts/bench_cache_invalidation.py --sizes 1000 10000 100000 --iterations 50
+"""
+import argparse
+import asyncio
+import statistics
+import sys, os
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from app.core.cache import (
+    get_redis, close_redis, cache_set, cache_delete_pattern,
+    bump_generation, make_key, get_generation,
+)
+
+NAMESPACE = "bench:ns"
+FILLER_PREFIX = "bench:filler:"
+FILL_BATCH = 1000
+
+
+async def fill_keyspace(target: int, current: int) -> int:
+    """Thêm key rác cho tới khi có `target` key filler."""
+    client = await get_redis()
+    for start in range(current, target, FILL_BATCH):
+        async with client.pipeline(transaction=False) as pipe:
+            for i in range(start, min(start + FILL_BATCH, target)):
+                pipe.setex(f"{FILLER_PREFIX}{i}", 600, "x")
+            await pipe.execute()
+    return max(current, target)
+
+
+async def populate_namespace(entries: int):
+    generation = await get_generation(NAMESPACE)
+    for page in range(entries):
+        await cache_set(make_key(NAMESPACE, generation, {"page": page}), [page], ttl=600)
+
+
+async def timed(fn, iterations: int, entries: int, repopulate: bool):
+    samples = []
+    for _ in range(iterations):
+        if repopulate:
+            await populate_namespace(entries)
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark cache invalidation")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--entries", type=int, default=50, help="số key trong namespace bị invalidate")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--scan-iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    filled = 0
+    print(f"{'keyspace':>9} {'generation ms':>14} {'scan ms':>9}")
+    try:
+        for size in sorted(args.sizes):
+            filled = await fill_keyspace(size, filled)
+            gen_ms = await timed(lambda: bump_generation(NAMESPACE), args.iterations, args.entries, False)
+            scan_ms = await timed(
+                lambda: cache_delete_pattern(f"cache:{NAMESPACE}:*"),
+                args.scan_iterations, args.entries, True,
+            )
+            print(f"{size:>9} {gen_ms:>14.3f} {scan_ms:>9.3f}")
+    finally:
+        removed = await cache_delete_pattern("bench:*")
+        removed += await cache_delete_pattern(f"cache:{NAMESPACE}:*")
+        print(f"🧹 Removed {removed} bench keys")
+        await close_redis()
+
+
+asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Benchmark /api/leaderboard: số query SQL và latency (p50/p99) theo page size.
+
+Chạy trực tiếp endpoint function trên DB thật + Redis (cấu hình trong .env):
+    python app/scripts/bench_leaderboard.py --sizes 10 50 100 --iterations 50 --viewer 1
+
+Mỗi page size in 2 dòng:
+- cold: bump generation của leaderboard trước mỗi lần đo -> luôn miss read_through, đi DB
+- warm: đo liên tiếp sau 1 lần nạp cache -> đọc từ Redis
+"""
+import argparse
+import asyncio
+import statistics
+import sys, os
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from sqlalchemy import event
+
+from app.core.cache import bump_generation
+from app.core.database import AsyncSessionLocal, engine
+from app.api.leaderboard import LEADERBOARD_CACHE_NAMESPACE, get_leaderboard
+
+_query_count = 0
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    global _query_count
+    _query_count += 1
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+async def bench_page(size: int, iterations: int, viewer, search, cold: bool):
+    global _query_count
+    latencies = []
+    queries = 0
+    rows = 0
+    async with AsyncSessionLocal() as db:
+        # Warm-up: mở connection + cache statement (+ nạp cache cho chế độ warm)
+        await get_leaderboard(game_name="Caro", limit=size, offset=0, search=search,
+                              current_user=viewer, db=db)
+        for _ in range(iterations):
+            if cold:
+                await bump_generation(LEADERBOARD_CACHE_NAMESPACE)  # ngoài phần đo
+            _query_count = 0
+            start = time.perf_counter()
+            result = await get_leaderboard(game_name="Caro", limit=size, offset=0, search=search,
+                                           current_user=viewer, db=db)
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries = _query_count
+            rows = len(result)
+    return rows, queries, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark leaderboard endpoint")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--viewer", type=int, default=None, help="user_id đang xem (để tính cờ bạn bè)")
+    parser.add_argument("--search", type=str, default=None)
+    args = parser.parse_args()
+
+    event.listen(engine.sync_engine, "before_cursor_execute", _count_query)
+    viewer = SimpleNamespace(id=args.viewer) if args.viewer is not None else None
+
+    print(f"{'page':>6} {'cache':>6} {'rows':>6} {'queries':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for size in args.sizes:
+        for mode in ("cold", "warm"):
+            rows, queries, latencies = await bench_page(
+                size, args.iterations, viewer, args.search, cold=mode == "cold"
+            )
+            print(
+                f"{size:>6} {mode:>6} {rows:>6} {queries:>8} "
+                f"{statistics.median(latencies):>9.2f} {_percentile(latencies, 99):>9.2f}"
+            )
+
+    await engine.dispose()
+
+
+asyncio.run(main())
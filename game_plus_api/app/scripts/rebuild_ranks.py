@@ -0,0 +1,40 @@
+"""
+Build lại bảng rank trong Redis (rank:{game_id}) từ user_game_ratings.
+
+    python app/scripts/rebuild_ranks.py            # tất cả game
+    python app/scripts/rebuild_ranks.py --game Caro
+"""
+import argparse
+import asyncio
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from sqlalchemy import select
+
+from app.core.cache import close_redis
+from app.core.database import AsyncSessionLocal, engine
+from app.core import rank_service
+from app.models.models import Game
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild Redis rank index")
+    parser.add_argument("--game", type=str, default=None, help="Tên game (mặc định: tất cả)")
+    args = parser.parse_args()
+
+    async with AsyncSessionLocal() as db:
+        query = select(Game)
+        if args.game:
+            query = query.where(Game.name == args.game)
+        games = (await db.scalars(query)).all()
+        if not games:
+            print("⚠️ No game found")
+        for game in games:
+            total = await rank_service.rebuild(db, game.id)
+            print(f"✅ Rebuilt rank index for {game.name} (game_id={game.id}): {total} users")
+
+    await close_redis()
+    await engine.dispose()
+
+
+asyncio.run(main())
@@ -0,0 +1,58 @@
+"""
+Tính lại rating từ lịch sử trận (offline), ví dụ khi đổi engine Elo -> Glicko-2.
+
+    python app/scripts/recompute_ratings.py --game Caro --engine glicko2 --dry-run
+    python app/scripts/recompute_ratings.py --game Caro --engine glicko2
+"""
+import argparse
+import asyncio
+import sys, os
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from sqlalchemy import select
+
+from app.core.cache import close_redis
+from app.core.database import AsyncSessionLocal, engine
+from app.core import rank_service, rating_engine
+from app.models.models import Game
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Recompute ratings from match history")
+    parser.add_argument("--game", type=str, default="Caro")
+    parser.add_argument("--engine", type=str, default=None, help="elo | glicko2 (mặc định: RATING_ENGINE)")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ in top 10, không ghi DB")
+    args = parser.parse_args()
+
+    rater = rating_engine.get_engine(args.engine)
+
+    async with AsyncSessionLocal() as db:
+        game = await db.scalar(select(Game).where(Game.name == args.game))
+        if not game:
+            print(f"❌ Game '{args.game}' not found")
+            return
+
+        start = time.perf_counter()
+        states = await rating_engine.recompute(db, game.id, rater)
+        elapsed = time.perf_counter() - start
+        print(f"📊 Recomputed {len(states)} players with {rater.name} in {elapsed:.2f}s")
+
+        top = sorted(states.items(), key=lambda item: item[1].rating, reverse=True)[:10]
+        for uid, state in top:
+            print(f"   user {uid}: {int(state.rating)} (rd {state.rd:.1f})")
+
+        if args.dry_run:
+            print("ℹ️ Dry run, nothing written")
+        else:
+            saved = await rating_engine.save_recomputed(db, game.id, states)
+            await db.commit()
+            print(f"✅ Saved {saved} ratings")
+            total = await rank_service.rebuild(db, game.id)
+            print(f"✅ Rebuilt rank index ({total} users)")
+
+    await close_redis()
+    await engine.dispose()
+
+
+asyncio.run(main())
@@ -0,0 +1,18 @@
+-- Migration: Indexes cho keyset pagination của match history
+-- Created: 2025-11-03
+--
+-- /api/match-history phân trang theo (created_at, id) DESC thay vì OFFSET.
+-- Query đi từ người chơi: match_players (user_id, match_id) -> matches theo PK,
+-- sort / cursor theo matches (created_at, id). Index khai báo ASC giống models.py,
+-- Postgres scan ngược cho ORDER BY created_at DESC, id DESC.
+
+-- Bản trước tạo (game_id, created_at DESC, id DESC): không khớp models.py và không
+-- dùng được khi query bắt đầu từ match_players
+DROP INDEX IF EXISTS ix_matches_game_created;
+CREATE INDEX IF NOT EXISTS ix_matches_created
+    ON matches (created_at, id);
+
+-- Thay index chỉ có user_id bằng (user_id, match_id) để join sang matches không cần đọc heap
+DROP INDEX IF EXISTS ix_match_players_user;
+CREATE INDEX IF NOT EXISTS ix_match_players_user
+    ON match_players (user_id, match_id);
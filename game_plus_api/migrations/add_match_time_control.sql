@@ -0,0 +1,14 @@
+-- Migration: Time control theo từng trận / phòng
+-- Created: 2025-11-12
+--
+-- NULL = dùng mặc định của server (MOVE_TIMEOUT, MATCH_TIME_INITIAL, MATCH_TIME_INCREMENT).
+
+ALTER TABLE matches
+    ADD COLUMN IF NOT EXISTS time_per_move DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS time_initial DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS time_increment DOUBLE PRECISION;
+
+ALTER TABLE rooms
+    ADD COLUMN IF NOT EXISTS time_per_move DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS time_initial DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS time_increment DOUBLE PRECISION;
@@ -0,0 +1,8 @@
+-- Migration: Cột cho rating engine Glicko-2
+-- Created: 2025-11-05
+--
+-- Elo (mặc định) chỉ dùng rating; Glicko-2 (RATING_ENGINE=glicko2) cần thêm RD + volatility.
+
+ALTER TABLE user_game_ratings
+    ADD COLUMN IF NOT EXISTS rating_deviation DOUBLE PRECISION NOT NULL DEFAULT 350,
+    ADD COLUMN IF NOT EXISTS volatility DOUBLE PRECISION NOT NULL DEFAULT 0.06;
@@ -0,0 +1,100 @@
+-- Migration: Materialized per-user per-game stats on user_game_ratings
+-- Created: 2025-11-02
+--
+-- wins/losses/draws + streaks + total_moves + last_played_at được cập nhật khi trận kết thúc
+-- (app/api/realtime.py::update_ratings). Script này thêm cột và backfill từ lịch sử trận.
+
+ALTER TABLE user_game_ratings
+    ADD COLUMN IF NOT EXISTS current_streak INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS best_win_streak INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS total_moves INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_played_at TIMESTAMP WITH TIME ZONE;
+
+-- Backfill: tính lại toàn bộ từ matches / match_players / moves
+WITH results AS (
+    SELECT
+        mp.user_id,
+        m.game_id,
+        m.id AS match_id,
+        COALESCE(m.finished_at, m.created_at) AS played_at,
+        CASE
+            WHEN mp.is_winner IS TRUE THEN 1
+            WHEN mp.is_winner IS FALSE THEN -1
+            ELSE 0
+        END AS r
+    FROM match_players mp
+    JOIN matches m ON m.id = mp.match_id
+    WHERE m.status = 'finished'
+),
+ordered AS (
+    SELECT
+        *,
+        ROW_NUMBER() OVER (PARTITION BY user_id, game_id ORDER BY played_at, match_id) AS rn,
+        COUNT(*) OVER (PARTITION BY user_id, game_id) AS total
+    FROM results
+),
+islands AS (
+    -- Gaps-and-islands: các trận liên tiếp cùng kết quả có cùng grp
+    SELECT
+        *,
+        rn - ROW_NUMBER() OVER (PARTITION BY user_id, game_id, r ORDER BY played_at, match_id) AS grp
+    FROM ordered
+),
+runs AS (
+    SELECT user_id, game_id, r, grp, COUNT(*) AS len, MAX(rn) AS end_rn, MAX(total) AS total
+    FROM islands
+    GROUP BY user_id, game_id, r, grp
+),
+streaks AS (
+    SELECT
+        user_id,
+        game_id,
+        COALESCE(MAX(len) FILTER (WHERE r = 1), 0) AS best_win_streak,
+        COALESCE(MAX(r * len) FILTER (WHERE end_rn = total), 0) AS current_streak
+    FROM runs
+    GROUP BY user_id, game_id
+),
+totals AS (
+    SELECT
+        user_id,
+        game_id,
+        COUNT(*) FILTER (WHERE r = 1) AS wins,
+        COUNT(*) FILTER (WHERE r = -1) AS losses,
+        COUNT(*) FILTER (WHERE r = 0) AS draws,
+        MAX(played_at) AS last_played_at
+    FROM results
+    GROUP BY user_id, game_id
+),
+move_counts AS (
+    SELECT mv.user_id, m.game_id, COUNT(*) AS total_moves
+    FROM moves mv
+    JOIN matches m ON m.id = mv.match_id
+    WHERE m.status = 'finished'
+    GROUP BY mv.user_id, m.game_id
+)
+INSERT INTO user_game_ratings (
+    user_id, game_id, rating, wins, losses, draws,
+    current_streak, best_win_streak, total_moves, last_played_at
+)
+SELECT
+    t.user_id,
+    t.game_id,
+    1200,
+    t.wins,
+    t.losses,
+    t.draws,
+    s.current_streak,
+    s.best_win_streak,
+    COALESCE(mc.total_moves, 0),
+    t.last_played_at
+FROM totals t
+JOIN streaks s ON s.user_id = t.user_id AND s.game_id = t.game_id
+LEFT JOIN move_counts mc ON mc.user_id = t.user_id AND mc.game_id = t.game_id
+ON CONFLICT (user_id, game_id) DO UPDATE SET
+    wins = EXCLUDED.wins,
+    losses = EXCLUDED.losses,
+    draws = EXCLUDED.draws,
+    current_streak = EXCLUDED.current_streak,
+    best_win_streak = EXCLUDED.best_win_streak,
+    total_moves = EXCLUDED.total_moves,
+    last_played_at = EXCLUDED.last_played_at;
@@ -0,0 +1,24 @@
+# tests/conftest.py
+import fakeredis.aioredis
+import pytest
+
+from app.core import cache
+
+
+class CountingRedis(fakeredis.aioredis.FakeRedis):
+    """FakeRedis ghi lại tên từng lệnh gửi tới server (không tính pipeline)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = []
+
+    async def execute_command(self, *args, **options):
+        self.commands.append(str(args[0]).upper())
+        return await super().execute_command(*args, **options)
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = CountingRedis(decode_responses=True)
+    monkeypatch.setattr(cache, "_redis_client", client)
+    return client
@@ -0,0 +1,63 @@
+# tests/test_auth_cache.py
+"""Auth cache: đổi / xóa user được báo cho mọi worker, token của user đã xóa hết hiệu lực."""
+import asyncio
+
+import pytest
+
+from app.core import auth_cache, match_bus, security
+from app.core.config import access_token_expires
+from app.core.layered_cache import TTLCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(auth_cache, "_tokens", TTLCache(100))
+    monkeypatch.setattr(auth_cache, "_users", TTLCache(100))
+    monkeypatch.setattr(auth_cache, "_deleted", TTLCache(100))
+
+
+@pytest.fixture
+def bus(redis_client, monkeypatch):
+    monkeypatch.setattr(match_bus, "_enabled", True)
+    monkeypatch.setattr(match_bus, "_auth_event_handler", auth_cache.apply_event)
+    return redis_client
+
+
+async def load_user(user_id: int) -> dict:
+    return await auth_cache.get_user(user_id, lambda: _row(user_id))
+
+
+async def _row(user_id: int) -> dict:
+    return {"id": user_id, "username": "alice"}
+
+
+def test_invalidation_reaches_other_workers(bus):
+    async def scenario():
+        other_worker = bus.pubsub()
+        await other_worker.subscribe(match_bus.AUTH_EVENTS_CHANNEL)
+        await other_worker.get_message(timeout=0.1)  # subscribe ack
+        await auth_cache.invalidate_user(3)
+        message = await other_worker.get_message(ignore_subscribe_messages=True, timeout=0.5)
+        await other_worker.aclose()
+        return message
+
+    message = asyncio.run(scenario())
+
+    assert message["channel"] == match_bus.AUTH_EVENTS_CHANNEL
+    assert '"user_id": 3' in message["data"]
+
+
+def test_deleted_user_token_is_rejected():
+    token = security.create_access_token(subject=5, expires_delta=access_token_expires())
+
+    async def scenario():
+        assert security.decode_user_id(token) == 5  # cache token
+        await load_user(5)
+        auth_cache.apply_event({"user_id": 5, "deleted": True})  # event từ worker đã xóa tài khoản
+
+    asyncio.run(scenario())
+
+    assert auth_cache.get_token(token) is None
+    assert auth_cache.stats()["users"] == 0
+    with pytest.raises(ValueError):
+        security.decode_user_id(token)
@@ -0,0 +1,120 @@
+# tests/test_cache_invalidation.py
+"""Invalidate cache: bump_generation tốn số lệnh cố định dù keyspace lớn cỡ nào."""
+import asyncio
+
+import pytest
+
+from app.core.cache import bump_generation, cache_delete_pattern, make_key, read_through
+
+NAMESPACE = "rooms"
+
+
+async def fill(client, namespace_entries: int, filler: int):
+    """Ghi `namespace_entries` page của namespace + `filler` key không liên quan."""
+    async with client.pipeline(transaction=False) as pipe:
+        for page in range(namespace_entries):
+            pipe.setex(make_key(NAMESPACE, 0, {"page": page}), 600, "[]")
+        for i in range(filler):
+            pipe.setex(f"filler:{i}", 600, "x")
+        await pipe.execute()
+
+
+async def commands_for_bump(client, namespace_entries: int, filler: int):
+    await fill(client, namespace_entries, filler)
+    client.commands.clear()
+    await bump_generation(NAMESPACE)
+    return list(client.commands)
+
+
+@pytest.mark.parametrize("namespace_entries, filler", [(10, 0), (2000, 20000)])
+def test_bump_generation_is_one_command(redis_client, namespace_entries, filler):
+    commands = asyncio.run(commands_for_bump(redis_client, namespace_entries, filler))
+    assert commands == ["INCRBY"]  # redis-py gửi INCR dưới dạng INCRBY key 1
+
+
+def test_bump_generation_cost_does_not_grow_with_keyspace(redis_client):
+    async def run():
+        small = await commands_for_bump(redis_client, 10, 0)
+        await redis_client.flushall()
+        large = await commands_for_bump(redis_client, 2000, 20000)
+        return small, large
+
+    small, large = asyncio.run(run())
+    assert len(small) == len(large)
+
+
+def test_read_through_misses_after_bump(redis_client):
+    calls = []
+
+    async def load():
+        calls.append(1)
+        return [len(calls)]
+
+    async def run():
+        first = await read_through(NAMESPACE, {"page": 1}, load, ttl=60)
+        cached = await read_through(NAMESPACE, {"page": 1}, load, ttl=60)
+        await bump_generation(NAMESPACE)
+        fresh = await read_through(NAMESPACE, {"page": 1}, load, ttl=60)
+        return first, cached, fresh
+
+    first, cached, fresh = asyncio.run(run())
+    assert first == cached == [1]
+    assert fresh == [2]
+    assert len(calls) == 2
+
+
+def test_delete_pattern_scans_whole_keyspace(redis_client):
+    """cache_delete_pattern chỉ dành cho bảo trì: số lệnh SCAN tăng theo keyspace."""
+    async def scans(filler: int):
+        await redis_client.flushall()
+        await fill(redis_client, 10, filler)
+        redis_client.commands.clear()
+        deleted = await cache_delete_pattern(f"cache:{NAMESPACE}:*", batch=100)
+        return deleted, redis_client.commands.count("SCAN")
+
+    async def run():
+        return await scans(0), await scans(5000)
+
+    (small_deleted, small_scans), (large_deleted, large_scans) = asyncio.run(run())
+    assert small_deleted == large_deleted == 10
+    assert large_scans > small_scans
+
+
+def test_new_game_is_committed_before_caches_are_invalidated(monkeypatch):
+    from types import SimpleNamespace
+
+    from app.api import auth
+
+    events = []
+
+    class FakeSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def add(self, obj):
+            events.append("add")
+
+        async def commit(self):
+            events.append("commit")
+
+    async def get_game(db, name):
+        return SimpleNamespace(id=1) if "commit" in events else None
+
+    async def invalidate_game(name):
+        events.append(f"invalidate_game:{name}")
+
+    async def bump_generation(namespace):
+        events.append(f"bump:{namespace}")
+
+    monkeypatch.setattr(auth, "AsyncSessionLocal", FakeSession)
+    monkeypatch.setattr(auth, "get_game", get_game)
+    monkeypatch.setattr(auth, "invalidate_game", invalidate_game)
+    monkeypatch.setattr(auth, "bump_generation", bump_generation)
+
+    game = asyncio.run(auth._create_caro_game(db=None))
+
+    assert game.id == 1
+    assert events == ["add", "commit", "invalidate_game:Caro", "bump:games"]
@@ -0,0 +1,119 @@
+# tests/test_end_match.py
+"""end_match: kết quả chỉ được broadcast sau khi đã chốt vào DB; chốt lỗi thì move journal thử lại."""
+import asyncio
+
+import pytest
+
+from app.api import realtime
+from app.api import realtime_helpers as journal
+
+
+class FakeSession:
+    def __init__(self):
+        self.rolled_back = False
+
+    async def rollback(self):
+        self.rolled_back = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def room(monkeypatch):
+    calls = {"journal_ok": False, "finished": 0, "broadcasts": []}
+
+    async def flush(match_id=None):
+        if match_id is not None and not calls["journal_ok"]:
+            raise journal.MoveJournalError("moves of match 1 are not persisted yet")
+
+    async def finish(state, db, winner_id):
+        calls["finished"] += 1
+        return {str(winner_id): 16}
+
+    async def broadcast(state, message):
+        calls["broadcasts"].append(message)
+
+    monkeypatch.setattr(realtime, "flush_move_batch", flush)
+    monkeypatch.setattr(realtime, "finish_match", finish)
+    monkeypatch.setattr(realtime, "broadcast", broadcast)
+    monkeypatch.setattr(realtime, "AsyncSessionLocal", FakeSession)
+    monkeypatch.setattr(journal, "_pending_finishes", {})
+
+    state = realtime.RoomState(1, 15, 19, 5)
+    state.status = "playing"
+    state.players = {10: "X", 20: "O"}
+    return state, calls
+
+
+def test_unpersisted_result_is_not_announced_until_retry_succeeds(room):
+    state, calls = room
+    db = FakeSession()
+    result = {"type": "win", "payload": {"winner_user_id": 10}}
+
+    async def scenario():
+        await realtime.end_match(state, db, 10, "win", result)
+        announced_before_retry = list(calls["broadcasts"])
+
+        await journal._retry_pending_finishes()  # journal vẫn lỗi -> giữ trong hàng chờ
+        still_pending = 1 in journal._pending_finishes
+
+        calls["journal_ok"] = True
+        await journal._retry_pending_finishes()
+        return announced_before_retry, still_pending
+
+    announced_before_retry, still_pending = asyncio.run(scenario())
+
+    assert state.status == "finished"
+    assert db.rolled_back
+    assert announced_before_retry == []
+    assert still_pending
+    assert calls["finished"] == 1
+    assert calls["broadcasts"] == [
+        {"type": "win", "payload": {"winner_user_id": 10, "rating_changes": {"10": 16}}}
+    ]
+    assert journal._pending_finishes == {}
+
+
+def test_persisted_result_is_broadcast_with_rating_changes(room):
+    state, calls = room
+    calls["journal_ok"] = True
+
+    asyncio.run(realtime.end_match(state, FakeSession(), None, "draw",
+                                   {"type": "draw", "payload": {"reason": "board_full"}}))
+
+    assert calls["broadcasts"] == [
+        {"type": "draw", "payload": {"reason": "board_full", "rating_changes": {"None": 16}}}
+    ]
+    assert journal._pending_finishes == {}
+
+
+def test_rows_of_a_match_waiting_to_finish_are_never_dropped(monkeypatch):
+    failures = {}
+    monkeypatch.setattr(journal, "_row_failures", failures)
+    monkeypatch.setattr(journal, "_waiting_matches", {})
+    monkeypatch.setattr(journal, "_pending_finishes", {3: None})
+    monkeypatch.setattr(journal, "_pending_moves", [
+        {"match_id": 3, "turn_no": 1, "user_id": 1, "x": 0, "y": 0, "symbol": "X", "made_at": None}
+    ])
+    monkeypatch.setattr(journal, "_flush_lock", asyncio.Lock())
+
+    async def insert(rows):
+        return ValueError("violates foreign key constraint")
+
+    async def ping():
+        return True
+
+    monkeypatch.setattr(journal, "_insert_moves", insert)
+    monkeypatch.setattr(journal, "_db_reachable", ping)
+
+    async def scenario():
+        for _ in range(journal.MOVE_FLUSH_MAX_RETRIES + 2):
+            await journal.flush_move_batch()
+
+    asyncio.run(scenario())
+
+    assert [m["turn_no"] for m in journal._pending_moves] == [1]
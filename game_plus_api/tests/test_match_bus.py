@@ -0,0 +1,116 @@
+# tests/test_match_bus.py
+"""Ownership trận: owner nghe inbox trước khi ai thấy key, heartbeat không gia hạn key của worker khác."""
+import asyncio
+
+import pytest
+
+from app.core import match_bus
+
+
+@pytest.fixture
+def bus(redis_client, monkeypatch):
+    monkeypatch.setattr(match_bus, "_enabled", True)
+    monkeypatch.setattr(match_bus, "_owned", set())
+    monkeypatch.setattr(match_bus, "_claims", {})
+    monkeypatch.setattr(match_bus, "_inboxes", {})
+    monkeypatch.setattr(match_bus, "_inbox_tasks", {})
+    return redis_client
+
+
+def run(bus, scenario):
+    async def wrapped():
+        match_bus._pubsub = bus.pubsub()
+        try:
+            return await scenario()
+        finally:
+            for task in match_bus._inbox_tasks.values():
+                task.cancel()
+            await match_bus._pubsub.aclose()
+            match_bus._pubsub = None
+    return asyncio.run(wrapped())
+
+
+def test_claim_subscribes_inbox_before_owner_key_is_visible(bus, monkeypatch):
+    subscribers_at_set = []
+    original_set = bus.set
+
+    async def spying_set(*args, **kwargs):
+        subscribers_at_set.append(dict(await bus.pubsub_numsub("match:bus:5:in"))["match:bus:5:in"])
+        return await original_set(*args, **kwargs)
+
+    monkeypatch.setattr(bus, "set", spying_set)
+
+    async def scenario():
+        owner = await match_bus.claim_match(5)
+        return owner, await match_bus.send_to_owner(5, {"kind": "message"})
+
+    owner, receivers = run(bus, scenario)
+
+    assert owner == match_bus.WORKER_ID
+    assert subscribers_at_set == [1]
+    assert receivers == 1
+
+
+def test_lost_claim_leaves_inbox(bus):
+    async def scenario():
+        await bus.set("match:owner:5", "other-worker")
+        owner = await match_bus.claim_match(5)
+        return owner, dict(await bus.pubsub_numsub("match:bus:5:in"))["match:bus:5:in"]
+
+    owner, subscribers = run(bus, scenario)
+
+    assert owner == "other-worker"
+    assert subscribers == 0
+    assert 5 not in match_bus._owned
+
+
+def test_heartbeat_drops_matches_taken_over_by_another_worker(bus):
+    async def scenario():
+        await match_bus.claim_match(1)
+        await match_bus.claim_match(2)
+        await bus.set("match:owner:2", "new-owner", ex=7)  # worker khác đã take over
+        await match_bus._extend_owned()
+        return await bus.ttl("match:owner:1"), await bus.ttl("match:owner:2")
+
+    ttl_kept, ttl_taken = run(bus, scenario)
+
+    assert match_bus._owned == {1}
+    assert ttl_kept == match_bus.OWNER_TTL
+    assert ttl_taken <= 7
+
+
+class ProxiedSocket:
+    def __init__(self, stall=False):
+        self.stall = stall
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, data):
+        if self.stall:
+            await asyncio.Event().wait()  # client mạng yếu: không bao giờ nhận xong
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_slow_proxied_socket_does_not_stall_other_connections(monkeypatch):
+    monkeypatch.setattr(match_bus, "_local_sockets", {})
+
+    async def scenario():
+        slow, fast = ProxiedSocket(stall=True), ProxiedSocket()
+        match_bus.register_local_socket("slow", slow)
+        match_bus.register_local_socket("fast", fast)
+        match_bus._deliver_local({"conn_id": "slow", "data": "m1"})
+        match_bus._deliver_local({"conn_id": "fast", "data": "m1"})
+        match_bus._deliver_local({"conn_id": "fast", "data": "m2"})
+        match_bus._deliver_local({"conn_id": "fast", "close": True, "code": 1012})
+        await asyncio.sleep(0.01)
+        match_bus.unregister_local_socket("slow")
+        return fast
+
+    fast = asyncio.run(scenario())
+
+    assert fast.sent == ["m1", "m2"]
+    assert fast.close_code == 1012
+    assert match_bus._local_sockets == {}
@@ -0,0 +1,42 @@
+# tests/test_match_snapshots.py
+"""Snapshot trận: đọc ở worker proxy không làm worker đó nhận trách nhiệm xóa / đếm warm start."""
+import asyncio
+import json
+
+import pytest
+
+from app.core import match_snapshots
+
+
+@pytest.fixture
+def snapshots(redis_client, monkeypatch):
+    monkeypatch.setattr(match_snapshots, "_saved", set())
+    monkeypatch.setattr(match_snapshots, "_stats", dict.fromkeys(match_snapshots._stats, 0))
+    return redis_client
+
+
+def test_load_alone_does_not_claim_the_snapshot(snapshots):
+    async def scenario():
+        await snapshots.set("match:snapshot:4", json.dumps({"v": match_snapshots.SNAPSHOT_VERSION, "turn_no": 3}))
+        snapshot = await match_snapshots.load(4)   # worker proxy: đọc rồi chuyển tiếp cho owner
+        await match_snapshots.discard(4)
+        return snapshot, await snapshots.exists("match:snapshot:4")
+
+    snapshot, still_there = asyncio.run(scenario())
+
+    assert snapshot["turn_no"] == 3
+    assert still_there == 1
+    assert match_snapshots.stats()["restores_total"] == 0
+    assert match_snapshots.stats()["live"] == 0
+
+
+def test_restored_room_owns_its_snapshot(snapshots):
+    async def scenario():
+        await snapshots.set("match:snapshot:4", json.dumps({"v": match_snapshots.SNAPSHOT_VERSION}))
+        await match_snapshots.load(4)
+        match_snapshots.restored(4)                # install_room dựng room từ snapshot
+        await match_snapshots.discard(4)
+        return await snapshots.exists("match:snapshot:4")
+
+    assert asyncio.run(scenario()) == 0
+    assert match_snapshots.stats()["restores_total"] == 1
@@ -0,0 +1,53 @@
+# tests/test_matchmaking.py
+"""Matchmaking: người vào queue trước cầm X, kể cả khi đối thủ ở worker khác."""
+import asyncio
+
+import pytest
+
+from app.core import match_bus, matchmaking
+
+
+class FakeSocket:
+    async def send_text(self, data):
+        pass
+
+
+@pytest.fixture
+def queue(redis_client, monkeypatch):
+    monkeypatch.setattr(match_bus, "_enabled", True)
+    monkeypatch.setattr(matchmaking, "_tickets", {})
+    monkeypatch.setattr(matchmaking, "_local_queues", {})
+    return redis_client
+
+
+def ticket(user_id, queued_at):
+    t = matchmaking.QueueTicket(1, user_id, 1200, FakeSocket())
+    t.queued_at = queued_at
+    return t
+
+
+def test_longest_waiting_player_gets_x(queue):
+    older, newer = ticket(1, 100.0), ticket(2, 130.0)
+
+    async def scenario():
+        await matchmaking.enqueue(older)
+        await matchmaking.enqueue(newer)
+        opponent = await matchmaking.try_pair(newer)
+        return await matchmaking.seat_order(newer, opponent), await matchmaking.seat_order(older, 2)
+
+    from_newer, from_older = asyncio.run(scenario())
+
+    assert from_newer == (1, 2)
+    assert from_older == (1, 2)
+
+
+def test_join_time_of_remote_opponent_comes_from_redis(queue):
+    remote, local = ticket(7, 200.0), ticket(8, 150.0)
+
+    async def scenario():
+        await matchmaking.enqueue(remote)
+        matchmaking._tickets.pop(7)  # socket của user 7 nằm ở worker khác
+        await matchmaking.enqueue(local)
+        return await matchmaking.seat_order(local, 7)
+
+    assert asyncio.run(scenario()) == (8, 7)
@@ -0,0 +1,107 @@
+# tests/test_move_journal.py
+"""Move journal: batch lỗi chỉ bỏ đúng dòng hỏng, không bao giờ bỏ moves của trận đang chốt."""
+import asyncio
+
+import pytest
+
+from app.api import realtime_helpers as journal
+
+
+class FakeDB:
+    """Thay _insert_moves: dòng có turn_no trong `poisoned` làm cả INSERT lỗi."""
+
+    def __init__(self, poisoned=(), reachable=True):
+        self.poisoned = set(poisoned)
+        self.reachable = reachable
+        self.rows = []
+
+    async def insert(self, rows):
+        if not self.reachable:
+            return ConnectionError("db down")
+        if any((row["match_id"], row["turn_no"]) in self.poisoned for row in rows):
+            return ValueError("violates foreign key constraint")
+        self.rows.extend(rows)
+        return None
+
+    async def ping(self):
+        return self.reachable
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(journal, "_insert_moves", fake.insert)
+    monkeypatch.setattr(journal, "_db_reachable", fake.ping)
+    monkeypatch.setattr(journal, "_pending_moves", [])
+    monkeypatch.setattr(journal, "_row_failures", {})
+    monkeypatch.setattr(journal, "_waiting_matches", {})
+    monkeypatch.setattr(journal, "_flush_lock", asyncio.Lock())
+    return fake
+
+
+def queue(match_id, turns):
+    for turn_no in turns:
+        journal._pending_moves.append({"match_id": match_id, "turn_no": turn_no, "user_id": 1,
+                                       "x": turn_no, "y": 0, "symbol": "X", "made_at": None})
+
+
+def saved(db, match_id):
+    return sorted(row["turn_no"] for row in db.rows if row["match_id"] == match_id)
+
+
+def test_poisoned_row_does_not_block_other_matches(db):
+    db.poisoned = {(1, 3)}
+    queue(1, range(1, 6))
+    queue(2, range(1, 6))
+
+    asyncio.run(journal.flush_move_batch())
+
+    assert saved(db, 2) == [1, 2, 3, 4, 5]
+    assert saved(db, 1) == [1, 2, 4, 5]
+    assert [(m["match_id"], m["turn_no"]) for m in journal._pending_moves] == [(1, 3)]
+
+
+def test_poisoned_row_dropped_after_max_retries(db):
+    db.poisoned = {(1, 2)}
+    queue(1, [1, 2])
+
+    async def run():
+        for _ in range(journal.MOVE_FLUSH_MAX_RETRIES):
+            await journal.flush_move_batch()
+
+    asyncio.run(run())
+    assert saved(db, 1) == [1]
+    assert journal._pending_moves == []
+
+
+def test_waiting_match_never_dropped(db):
+    db.poisoned = {(1, 2)}
+    queue(1, [1, 2])
+
+    async def run():
+        for _ in range(journal.MOVE_FLUSH_MAX_RETRIES + 2):
+            with pytest.raises(journal.MoveJournalError):
+                await journal.flush_move_batch(1)
+
+    asyncio.run(run())
+    assert [m["turn_no"] for m in journal._pending_moves] == [2]
+    assert journal._waiting_matches == {}
+
+
+def test_outage_keeps_whole_batch(db):
+    db.reachable = False
+    queue(1, [1, 2])
+    queue(2, [1])
+
+    async def run():
+        for _ in range(journal.MOVE_FLUSH_MAX_RETRIES + 1):
+            await journal.flush_move_batch()
+
+    asyncio.run(run())
+    assert len(journal._pending_moves) == 3
+    assert journal._row_failures == {}
+
+    db.reachable = True
+    asyncio.run(journal.flush_move_batch())
+    assert journal._pending_moves == []
+    assert saved(db, 1) == [1, 2] and saved(db, 2) == [1]
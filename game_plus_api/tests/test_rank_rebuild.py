@@ -0,0 +1,102 @@
+# tests/test_rank_rebuild.py
+"""Rank rebuild: rating finish_match ghi trong lúc rebuild không bị snapshot cũ ghi đè."""
+import asyncio
+
+from app.core import rank_service
+
+GAME_ID = 1
+
+
+class FakeStream:
+    """db.stream(...) trả snapshot cố định; `during` chạy giữa 2 chunk (finish_match song song)."""
+
+    def __init__(self, rows, during=None):
+        self.rows = rows
+        self.during = during
+
+    async def partitions(self, size):
+        for i in range(0, len(self.rows), size):
+            yield self.rows[i:i + size]
+            if self.during is not None:
+                await self.during()
+                self.during = None
+
+
+class FakeDB:
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def stream(self, query):
+        return self._stream
+
+
+def test_rebuild_keeps_ratings_synced_mid_rebuild(redis_client, monkeypatch):
+    monkeypatch.setattr(rank_service, "REBUILD_CHUNK", 2)
+    snapshot = [(1, 1200), (2, 1300), (3, 1100), (4, 1000)]
+
+    async def finish_match():
+        # user 3 vừa thắng (sau snapshot), user 5 vừa có dòng rating đầu tiên
+        await rank_service.sync_ratings(GAME_ID, {3: 1150, 5: 1216})
+
+    async def scenario():
+        total = await rank_service.rebuild(FakeDB(FakeStream(snapshot, during=finish_match)), GAME_ID)
+        return total, await redis_client.zrange("rank:1", 0, -1, withscores=True)
+
+    total, ranks = asyncio.run(scenario())
+
+    assert total == 4
+    assert dict(ranks) == {"1": 1200, "2": 1300, "3": 1150, "4": 1000, "5": 1216}
+
+
+def test_rebuild_replaces_stale_members_and_clears_flags(redis_client):
+    async def scenario():
+        await redis_client.zadd("rank:1", {"9": 5000, "1": 1})
+        await rank_service.rebuild(FakeDB(FakeStream([(1, 1200)])), GAME_ID)
+        await rank_service.sync_ratings(GAME_ID, {1: 1210})
+        return (
+            await redis_client.zrange("rank:1", 0, -1, withscores=True),
+            await redis_client.exists("rank:1:building", "rank:1:rebuilding"),
+            await redis_client.get("rank:1:ready"),
+        )
+
+    ranks, leftovers, ready = asyncio.run(scenario())
+
+    assert dict(ranks) == {"1": 1210}
+    assert leftovers == 0
+    assert ready == "1"
+
+
+def test_new_rating_row_joins_zset_only_after_commit(redis_client):
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    async def scenario():
+        committed, rolled_back = AsyncSession(), AsyncSession()
+        rank_service.sync_after_commit(committed, GAME_ID, {9: 1200})
+        rank_service.sync_after_commit(rolled_back, GAME_ID, {10: 1200})
+        before = await redis_client.zscore(rank_service._key(GAME_ID), "9")
+        await committed.commit()
+        await rolled_back.rollback()
+        await asyncio.gather(*rank_service._sync_tasks)
+        return before, await redis_client.zrange(rank_service._key(GAME_ID), 0, -1, withscores=True)
+
+    before, members = asyncio.run(scenario())
+
+    assert before is None
+    assert members == [("9", 1200.0)]
+
+
+def test_user_missing_from_zset_falls_back_to_db(redis_client, monkeypatch):
+    async def rank_from_db(db, user_id, game_id, rating):
+        return 42
+
+    monkeypatch.setattr(rank_service, "_get_rank_from_db", rank_from_db)
+
+    async def scenario():
+        await redis_client.zadd(rank_service._key(GAME_ID), {"1": 1300})
+        await redis_client.set(rank_service._ready_key(GAME_ID), "1")
+        return await rank_service.get_rank(None, 9, GAME_ID), await rank_service.get_rank(None, 1, GAME_ID)
+
+    missing, present = asyncio.run(scenario())
+
+    assert missing == 42
+    assert present == 1
@@ -0,0 +1,133 @@
+# tests/test_spectators.py
+"""Spectator feed: throttle frame, không ai xem thì không build/publish, dọn room gửi frame cuối."""
+import asyncio
+import json
+
+import pytest
+
+from app.core import match_bus, spectators
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+@pytest.fixture(autouse=True)
+def local_only(monkeypatch):
+    monkeypatch.setattr(match_bus, "_enabled", False)
+    monkeypatch.setattr(spectators, "_feeds", {})
+    monkeypatch.setattr(spectators, "_viewers", {})
+    monkeypatch.setattr(spectators, "_stats", {"frames_total": 0})
+    monkeypatch.setattr(spectators, "FRAME_INTERVAL", 60)
+
+
+def test_close_feed_sends_final_frame_then_closes_viewers():
+    state = {"status": "playing", "result": None}
+
+    def frame():
+        return {"type": "spectate", "payload": dict(state)}
+
+    async def scenario():
+        ws = FakeSocket()
+        await spectators.subscribe(7, ws, user_id=1, frame=frame())
+        spectators.mark_dirty(7, frame)
+        await asyncio.sleep(0)  # frame đầu đi ngay, frame kế bị throttle FRAME_INTERVAL
+        state.update(status="finished", result={"winner_id": 2})
+        spectators.mark_dirty(7, frame)
+        await spectators.close_feed(7)
+        await asyncio.sleep(0.01)
+        return ws
+
+    ws = asyncio.run(scenario())
+
+    assert ws.sent[-1]["payload"] == {"status": "finished", "result": {"winner_id": 2}}
+    assert ws.close_code == 1000
+    assert spectators.stats()["active_feeds"] == 0
+
+
+class CountingBuilder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {"type": "spectate", "payload": {"n": self.calls}}
+
+
+def test_mark_dirty_coalesces_changes_within_interval(monkeypatch):
+    monkeypatch.setattr(spectators, "FRAME_INTERVAL", 0.05)
+    build = CountingBuilder()
+
+    async def scenario():
+        ws = FakeSocket()
+        await spectators.subscribe(7, ws, user_id=1, frame={"type": "spectate", "payload": {}})
+        for _ in range(5):
+            spectators.mark_dirty(7, build)
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.1)
+        return ws
+
+    ws = asyncio.run(scenario())
+
+    # frame lúc vào xem + frame đầu đi ngay + 1 frame gộp 4 thay đổi còn lại
+    assert build.calls == 2
+    assert len(ws.sent) == 3
+
+
+@pytest.fixture
+def bus(redis_client, monkeypatch):
+    monkeypatch.setattr(match_bus, "_enabled", True)
+    monkeypatch.setattr(spectators, "FRAME_INTERVAL", 0.01)
+    return redis_client
+
+
+def test_no_viewers_anywhere_skips_build_and_publish(bus):
+    build = CountingBuilder()
+
+    async def scenario():
+        for _ in range(10):
+            spectators.mark_dirty(7, build)
+            await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+
+    assert build.calls == 0
+    assert bus.commands.count("PUBSUB NUMSUB") == 1  # hỏi 1 lần, sau đó nhớ trong feed
+    assert spectators.stats()["frames_total"] == 0
+
+
+def test_remote_viewer_turns_publishing_on_and_off(bus):
+    build = CountingBuilder()
+
+    async def scenario():
+        watcher = bus.pubsub()
+        await watcher.subscribe("match:spectate:7")
+        spectators.mark_dirty(7, build)
+        await asyncio.sleep(0.02)
+        published = build.calls
+
+        await watcher.unsubscribe("match:spectate:7")
+        spectators.mark_dirty(7, build)
+        await asyncio.sleep(0.02)  # publish tới 0 worker -> tắt
+        spectators.mark_dirty(7, build)
+        await asyncio.sleep(0.02)
+        after_leave = build.calls
+
+        spectators.request_frame(7, build)  # người xem mới ở worker khác
+        await asyncio.sleep(0.02)
+        await watcher.aclose()
+        return published, after_leave, build.calls
+
+    published, after_leave, after_request = asyncio.run(scenario())
+
+    assert published == 1
+    assert after_leave == 2
+    assert after_request == 3
@@ -0,0 +1,28 @@
+# tests/test_time_control.py
+"""Time control theo trận: lấy từ Match / snapshot, chỉ dùng mặc định env khi trận không chọn."""
+import json
+
+from app.api import realtime
+from app.core.turn_scheduler import TimeControl
+
+
+def test_snapshot_keeps_match_time_control(monkeypatch):
+    monkeypatch.setenv("MATCH_TIME_INITIAL", "0")
+    state = realtime.RoomState(1, 15, 19, 5, TimeControl(per_move=20, initial=180, increment=2))
+
+    restored = realtime.RoomState.from_snapshot(json.loads(json.dumps(state.to_snapshot())))
+
+    assert restored.time_control.to_dict() == {"per_move": 20, "initial": 180, "increment": 2}
+    assert restored.time_control.is_fischer
+
+
+def test_missing_time_control_falls_back_to_env(monkeypatch):
+    monkeypatch.setenv("MATCH_TIME_INITIAL", "300")
+    monkeypatch.setenv("MATCH_TIME_INCREMENT", "5")
+
+    assert TimeControl.from_dict(None, 30).to_dict() == {"per_move": 30, "initial": 300.0, "increment": 5.0}
+    # Match chỉ đặt per_move: phần còn lại vẫn theo env
+    assert TimeControl.from_dict({"per_move": 10, "initial": None, "increment": None}, 30).to_dict() == {
+        "per_move": 10, "initial": 300.0, "increment": 5.0,
+    }
+    assert TimeControl.from_dict({"per_move": 10, "initial": 0, "increment": 0}, 30).is_fischer is False